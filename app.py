@@ -3,17 +3,29 @@ Hunt-Hunt-Planur - Real-time Location Sharing Application
 Flask Backend Server
 """
 
-from flask import Flask, request, jsonify, session, send_from_directory, redirect, url_for
+from flask import Flask, request, jsonify, session, send_from_directory, redirect, url_for, Response
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.http import parse_cookie
+from itsdangerous import BadSignature
 from datetime import datetime, timedelta
 import string
 import random
 import os
-import requests
+import time
+import base64
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
+from realtime import SessionEventBroker, Snapshot, SnapshotCache, sse_stream
+from retention import PeriodicWorker, prune_history
+from migrations import upgrade as upgrade_schema, recompute_participant_counters
+from storage import configure_sqlite, optimize as optimize_database, reclaim_free_pages
+from geocoding import CachingGeocoder, GeocodingQueue, make_geocoder
+from tracks import TRACK_FORMATS, Track, encode_track, pack_track, simplify, stop_points, unpack_track
+from ingest import GroupCommitWriter, StationaryFilter
+from spatial import ProximityMonitor, SessionGrids, haversine_m
+from ws_gateway import SessionGateway
 
 app = Flask(__name__, static_folder='.', static_url_path='')
 
@@ -22,8 +34,46 @@ from config import config
 app.config.from_object(config['development'])
 
 db = SQLAlchemy(app)
+
+# WAL, synchronous=NORMAL, busy timeout and cache sizes on every SQLite connection (storage.py)
+with app.app_context():
+    configure_sqlite(db.engine, app.config['SQLITE_PRAGMAS'])
 CORS(app, supports_credentials=True)
 
+# Live participant changes, streamed to /api/sessions/<code>/stream
+session_events = SessionEventBroker()
+
+# Rendered /api/get_participants responses, valid until the next session_events event
+participants_snapshots = SnapshotCache(session_events)
+
+# Current participant positions per session, for /api/sessions/<code>/nearby
+participant_grid = SessionGrids(cell_m=app.config['SPATIAL_CELL_M'])
+
+# Which participants are near each other, for automatic proximity alerts (PROXIMITY_ALERTS)
+proximity_monitor = ProximityMonitor(
+    enter_m=app.config['PROXIMITY_ALERT_RADIUS_M'],
+    exit_m=app.config['PROXIMITY_RELEASE_RADIUS_M'],
+    cooldown_s=app.config['PROXIMITY_ALERT_COOLDOWN_SECONDS']
+)
+
+# Alerts, used to wake long-polling /api/get_notifications?wait=N requests
+notification_events = SessionEventBroker(history_size=50)
+
+# Last stored fix per participant, so fixes from someone standing still extend that row
+stationary_filter = StationaryFilter(
+    min_radius_m=app.config['STATIONARY_MIN_RADIUS_M'],
+    max_radius_m=app.config['STATIONARY_MAX_RADIUS_M'],
+    max_interval_s=app.config['STATIONARY_MAX_INTERVAL_SECONDS']
+)
+
+def realtime_in_process():
+    """
+    Whether this process sees every change: true unless serve.py runs several worker
+    processes, in which case the brokers, snapshot cache and grid above only see their
+    own process's writes and callers go to the database instead
+    """
+    return app.config['SERVE_WORKERS'] == 1
+
 # Database Models
 class User(db.Model):
     __tablename__ = 'users'
@@ -43,6 +93,9 @@ class User(db.Model):
 
 class Session(db.Model):
     __tablename__ = 'sessions'
+    __table_args__ = (
+        db.Index('ix_sessions_creator_created', 'creator_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_code = db.Column(db.String(10), unique=True, nullable=False)
     creator_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -50,11 +103,25 @@ class Session(db.Model):
     location_name = db.Column(db.String(200), nullable=True)  # Approximate location name
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    # Denormalized from session_participants; kept in step by add_participant /
+    # set_participant_active and rebuilt by `flask repair-counters`
+    participant_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Distinct ever joined
+    active_participant_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    ended_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=True)  # Participants moved to session_archives (archive_session)
     
     participants = db.relationship('SessionParticipant', backref='session', lazy=True, cascade='all, delete-orphan')
 
 class SessionParticipant(db.Model):
     __tablename__ = 'session_participants'
+    __table_args__ = (
+        db.Index('ix_session_participants_session_active', 'session_id', 'is_active'),
+        db.Index('ix_session_participants_session_user', 'session_id', 'user_id'),
+        db.Index('ix_session_participants_session_guest', 'session_id', 'guest_name'),
+        db.Index('ix_session_participants_user', 'user_id'),
+        # Archived participants are deleted; their ids must never be handed out again
+        {'sqlite_autoincrement': True},
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
@@ -63,36 +130,91 @@ class SessionParticipant(db.Model):
     is_active = db.Column(db.Boolean, default=True)
     
     locations = db.relationship('Location', backref='participant', lazy=True, cascade='all, delete-orphan')
+    last_position = db.relationship('ParticipantLastPosition', uselist=False, lazy=True, cascade='all, delete-orphan')
 
 class Location(db.Model):
     __tablename__ = 'locations'
+    __table_args__ = (
+        db.Index('ix_locations_participant_timestamp', 'participant_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     participant_id = db.Column(db.Integer, db.ForeignKey('session_participants.id'), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     accuracy = db.Column(db.Float)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime, nullable=True)  # Latest stationary fix merged into this row
 
 class UserPosition(db.Model):
     __tablename__ = 'user_positions'
+    __table_args__ = (
+        db.Index('ix_user_positions_user_timestamp', 'user_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     latitude = db.Column(db.Float, nullable=False)
     longitude = db.Column(db.Float, nullable=False)
     accuracy = db.Column(db.Float)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    last_seen = db.Column(db.DateTime, nullable=True)  # Latest stationary fix merged into this row
+
+class ParticipantLastPosition(db.Model):
+    """Latest fix per session participant, upserted by update_location"""
+    __tablename__ = 'participant_last_positions'
+    participant_id = db.Column(db.Integer, db.ForeignKey('session_participants.id'), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    accuracy = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seq = db.Column(db.Integer, nullable=True)  # Superseded by location_streams (migration 11)
+
+class LocationStream(db.Model):
+    """Highest batch sequence number accepted per participant and upload stream (one per browser)"""
+    __tablename__ = 'location_streams'
+    participant_id = db.Column(db.Integer, db.ForeignKey('session_participants.id'), primary_key=True)
+    stream_id = db.Column(db.String(64), primary_key=True)  # '' for clients that send no stream
+    last_seq = db.Column(db.Integer, nullable=False)
+
+class UserLastPosition(db.Model):
+    """Latest fix per registered user (across all sessions), upserted by update_location"""
+    __tablename__ = 'user_last_positions'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    accuracy = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_session_read_created', 'session_id', 'is_read', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
     sender_participant_id = db.Column(db.Integer, db.ForeignKey('session_participants.id'), nullable=False)
     message = db.Column(db.String(500), nullable=False)
+    kind = db.Column(db.String(20), nullable=False, default='alert', server_default='alert')  # 'alert' or 'proximity'
     sender_latitude = db.Column(db.Float, nullable=True)
     sender_longitude = db.Column(db.Float, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
 
+class SessionArchive(db.Model):
+    """One participant of an archived session, with their track packed by tracks.pack_track"""
+    __tablename__ = 'session_archives'
+    __table_args__ = (
+        db.Index('ix_session_archives_session', 'session_id'),
+        db.Index('ix_session_archives_user', 'user_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.Integer, db.ForeignKey('sessions.id'), nullable=False)
+    participant_id = db.Column(db.Integer, nullable=False)  # The session_participants id it replaced
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    guest_name = db.Column(db.String(50), nullable=True)
+    joined_at = db.Column(db.DateTime)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    track = db.Column(db.LargeBinary, nullable=False)
+
 # Helper Functions
 def generate_session_code():
     """Generate a unique 6-character session code"""
@@ -103,56 +225,553 @@ def generate_session_code():
             return code
     return None
 
-def reverse_geocode(latitude, longitude):
-    """Get location name from coordinates using Nominatim (OpenStreetMap)"""
+def record_last_position(participant, latitude, longitude, accuracy, timestamp):
+    """Upsert the latest fix for a participant (and its registered user) in the current transaction"""
+    last_position = ParticipantLastPosition.query.get(participant.id)
+    if not last_position:
+        last_position = ParticipantLastPosition(participant_id=participant.id)
+        db.session.add(last_position)
+    last_position.latitude = latitude
+    last_position.longitude = longitude
+    last_position.accuracy = accuracy
+    last_position.timestamp = timestamp
+    
+    if participant.user_id:
+        user_last_position = UserLastPosition.query.get(participant.user_id)
+        if not user_last_position:
+            user_last_position = UserLastPosition(user_id=participant.user_id)
+            db.session.add(user_last_position)
+        user_last_position.latitude = latitude
+        user_last_position.longitude = longitude
+        user_last_position.accuracy = accuracy
+        user_last_position.timestamp = timestamp
+
+def clear_last_position(participant_id):
+    """Forget a participant's current fix so they show as offline"""
+    ParticipantLastPosition.query.filter_by(participant_id=participant_id).delete()
+    stationary_filter.forget(participant_id)
+
+def cookie_participant():
+    """
+    The participant named by the session cookie, or None. The id must belong to the
+    session the cookie was issued for: a cookie that outlived its participant row
+    (archived sessions) is cleared rather than matched to whoever has the id now.
+    """
+    participant_id = session.get('participant_id')
+    if participant_id is None:
+        return None
+    participant = SessionParticipant.query.join(Session).options(
+        db.contains_eager(SessionParticipant.session)
+    ).filter(
+        SessionParticipant.id == participant_id,
+        Session.session_code == session.get('session_code')
+    ).first()
+    if participant is None:
+        session.pop('participant_id', None)
+        session.pop('session_code', None)
+        session.pop('guest_name', None)
+    return participant
+
+def previous_stored_fix(participant_id):
+    """Last fix stored as a history row for the participant, or None when suppression is off"""
+    if not app.config['STATIONARY_FILTER_ENABLED']:
+        return None
+    if realtime_in_process():
+        return stationary_filter.last(participant_id)
+    # Other processes store fixes too: the newest row (the one extend_last_row merges into) decides
+    row = db.session.query(
+        Location.latitude, Location.longitude, Location.accuracy, Location.timestamp
+    ).filter(
+        Location.id == db.select(db.func.max(Location.id)).where(Location.participant_id == participant_id).scalar_subquery()
+    ).first()
+    return row._asdict() if row else None
+
+def extend_last_row(model, owner_column, owner_id, last_seen):
+    """Merge a stationary fix into the owner's newest history row; False if there is no row"""
+    newest = db.select(db.func.max(model.id)).where(owner_column == owner_id).scalar_subquery()
+    result = db.session.execute(
+        db.update(model).where(model.id == newest).values(last_seen=last_seen),
+        execution_options={'synchronize_session': False}
+    )
+    return result.rowcount > 0
+
+def add_participant(user_session, user_id=None, guest_name=None):
+    """Add a new participant and bump the session's counters in the same transaction"""
+    participant = SessionParticipant(session_id=user_session.id, user_id=user_id, guest_name=guest_name)
+    db.session.add(participant)
+    db.session.execute(
+        db.update(Session).where(Session.id == user_session.id).values(
+            participant_count=Session.participant_count + 1,
+            active_participant_count=Session.active_participant_count + 1
+        )
+    )
+    return participant
+
+def set_participant_active(participant, active, **values):
+    """
+    Flip a participant's is_active (plus any extra column ``values``) and adjust the
+    session's active counter in the same transaction. The update is conditional on
+    the current state, so concurrent leave/remove requests cannot count twice.
+    Returns True if the participant changed state.
+    """
+    result = db.session.execute(
+        db.update(SessionParticipant).where(
+            SessionParticipant.id == participant.id,
+            SessionParticipant.is_active == (not active)
+        ).values(is_active=active, **values)
+    )
+    if result.rowcount == 0:
+        return False
+    db.session.execute(
+        db.update(Session).where(Session.id == participant.session_id).values(
+            active_participant_count=Session.active_participant_count + (1 if active else -1)
+        )
+    )
+    return True
+
+def run_retention():
+    """Trim location history (see retention.py) and the geocode cache; called by the background worker and the CLI"""
+    with app.app_context():
+        deleted = prune_history(db.engine, app.config)
+        if any(deleted.values()):
+            reclaim_free_pages(db.engine, app.config['SQLITE_VACUUM_CHUNK_PAGES'])
+    if isinstance(geocoder, CachingGeocoder):
+        deleted['geocode_cache'] = geocoder.cache.evict()
+    return deleted
+
+def run_optimize():
+    """Refresh the SQLite planner statistics; called by the background worker and the CLI"""
+    with app.app_context():
+        return optimize_database(db.engine)
+
+def participant_track(participant, start, end=None):
+    """
+    (latitude, longitude, accuracy, timestamp, last_seen) rows of a participant from
+    ``start`` (to ``end``) in time order: the user's position history for registered
+    users, the participant's own locations for guests
+    """
+    if participant.user_id:
+        model, owner = UserPosition, UserPosition.user_id == participant.user_id
+    else:
+        model, owner = Location, Location.participant_id == participant.id
+    query = db.session.query(
+        model.latitude, model.longitude, model.accuracy, model.timestamp, model.last_seen
+    ).filter(owner, model.timestamp >= start)
+    if end is not None:
+        query = query.filter(model.timestamp <= end)
+    return query.order_by(model.timestamp.asc()).all()
+
+def review_window(user_session, participant):
+    """
+    (start, end) of a participant's part in an ended session. It starts with the session:
+    joined_at is reset by every rejoin, so it would drop what was shared before leaving.
+    end is None (open) for sessions that ended before ended_at was recorded and whose
+    participant has no last fix left to stand in for it.
+    """
+    start = user_session.created_at
+    end = user_session.ended_at
+    if end is None:
+        last_position = participant.last_position
+        end = last_position.timestamp if last_position else None
+    return start, end
+
+def was_in_session(user_session, user_id):
+    """Whether a user ever joined the session, archived or not"""
+    model = SessionArchive if user_session.archived_at else SessionParticipant
+    return model.query.filter_by(session_id=user_session.id, user_id=user_id).first() is not None
+
+def archive_session(user_session):
+    """
+    Move an ended session to the cold archive: one session_archives row per
+    participant holding their review track (tracks.pack_track), then delete the
+    session's participants with their locations and last positions, and its
+    notifications. User position history is per user, not per session, and stays.
+    Returns the number of participants archived, or None if another process got there first.
+    """
+    # Claim the session first, so concurrent archivers (one per worker process) skip it
+    claimed = db.session.execute(
+        db.update(Session).where(Session.id == user_session.id, Session.archived_at.is_(None))
+        .values(archived_at=datetime.utcnow())
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return None
+
+    participants = SessionParticipant.query.filter_by(session_id=user_session.id).all()
+    participant_ids = [p.id for p in participants]
+    for p in participants:
+        rows = participant_track(p, *review_window(user_session, p))
+        db.session.add(SessionArchive(
+            session_id=user_session.id,
+            participant_id=p.id,
+            user_id=p.user_id,
+            guest_name=p.guest_name,
+            joined_at=p.joined_at,
+            point_count=len(rows),
+            track=pack_track(rows)
+        ))
+
+    if participant_ids:
+        Location.query.filter(Location.participant_id.in_(participant_ids)).delete(synchronize_session=False)
+        ParticipantLastPosition.query.filter(
+            ParticipantLastPosition.participant_id.in_(participant_ids)
+        ).delete(synchronize_session=False)
+        LocationStream.query.filter(LocationStream.participant_id.in_(participant_ids)).delete(synchronize_session=False)
+    Notification.query.filter_by(session_id=user_session.id).delete(synchronize_session=False)
+    SessionParticipant.query.filter_by(session_id=user_session.id).delete(synchronize_session=False)
+    db.session.commit()
+
+    for participant_id in participant_ids:
+        stationary_filter.forget(participant_id)
+    return len(participant_ids)
+
+def run_archive():
+    """Archive sessions that ended ARCHIVE_AFTER_SECONDS ago; called by the background worker and the CLI"""
+    archived = participants = 0
+    with app.app_context():
+        cutoff = datetime.utcnow() - timedelta(seconds=app.config['ARCHIVE_AFTER_SECONDS'])
+        ended = Session.query.filter(
+            Session.is_active == False,
+            Session.archived_at.is_(None),
+            # Sessions ended before migration 010 have no reliable end to cut their tracks at; they stay hot
+            Session.ended_at.isnot(None),
+            Session.ended_at <= cutoff
+        ).order_by(Session.id).limit(app.config['ARCHIVE_BATCH_SESSIONS']).all()
+        for user_session in ended:
+            try:
+                count = archive_session(user_session)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Archive error for session {user_session.id}: {e}")
+                continue
+            if count is not None:
+                archived += 1
+                participants += count
+        if archived:
+            reclaim_free_pages(db.engine, app.config['SQLITE_VACUUM_CHUNK_PAGES'])
+    return {'sessions': archived, 'participants': participants}
+
+def start_background_workers():
+    """Start the retention worker (history is no longer pruned inside update_location), the optimize and archive workers"""
+    worker = PeriodicWorker(run_retention, app.config['RETENTION_INTERVAL_SECONDS'], name='retention-worker')
+    worker.start()
+    # First pass shortly after startup, so a database that was never analyzed gets statistics
+    PeriodicWorker(run_optimize, app.config['SQLITE_OPTIMIZE_INTERVAL_SECONDS'],
+                   name='optimize-worker', delay=60).start()
+    if app.config['ARCHIVE_ENABLED']:
+        PeriodicWorker(run_archive, app.config['ARCHIVE_INTERVAL_SECONDS'], name='archive-worker').start()
+    return worker
+
+@app.cli.command('prune-history')
+def prune_history_command():
+    """Trim locations, user_positions and the geocode cache to the configured limits"""
+    for table, deleted in run_retention().items():
+        print(f"{table}: deleted {deleted} rows")
+
+@app.cli.command('optimize-db')
+def optimize_db_command():
+    """Refresh the SQLite query planner statistics (ANALYZE / PRAGMA optimize)"""
+    print(f"ran {run_optimize()}")
+
+@app.cli.command('archive-sessions')
+def archive_sessions_command():
+    """Move ended sessions to the cold archive (session_archives)"""
+    result = run_archive()
+    print(f"sessions: archived {result['sessions']} ({result['participants']} participants)")
+
+@app.cli.command('repair-counters')
+def repair_counters_command():
+    """Recompute the sessions participant counters from session_participants"""
+    with db.engine.begin() as conn:
+        repaired = recompute_participant_counters(conn)
+    print(f"sessions: repaired {repaired} counters")
+
+def is_valid_coordinate(latitude, longitude):
+    """Both values are numbers within WGS84 bounds"""
+    for value in (latitude, longitude):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+    return -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+def serialize_participant(p, user, latest_location, last_position):
+    """Build the get_participants entry for one participant"""
+    name = user.username if user else p.guest_name
+    
+    # Check if location is stale (older than ONLINE_TIMEOUT_SECONDS) - consider as offline
+    is_online = False
+    if latest_location:
+        time_diff = (datetime.utcnow() - latest_location.timestamp).total_seconds()
+        is_online = time_diff < app.config['ONLINE_TIMEOUT_SECONDS']
+    
+    # Determine which position to show
+    latitude = None
+    longitude = None
+    accuracy = None
+    last_update = None
+    
+    if is_online and latest_location:
+        # User is online: show current position from session location
+        latitude = latest_location.latitude
+        longitude = latest_location.longitude
+        accuracy = latest_location.accuracy
+        last_update = latest_location.timestamp.isoformat()
+    elif not is_online and last_position:
+        # User is offline but is a registered user: show last known position
+        latitude = last_position.latitude
+        longitude = last_position.longitude
+        accuracy = last_position.accuracy
+        last_update = last_position.timestamp.isoformat()
+    
+    return {
+        'id': p.id,
+        'user_id': p.user_id,
+        'name': name,
+        'is_guest': p.user_id is None,
+        'profile_picture': user.profile_picture if user else None,
+        'latitude': latitude,
+        'longitude': longitude,
+        'accuracy': accuracy,
+        'last_update': last_update,
+        'is_online': is_online
+    }
+
+def in_live_session(participant):
+    """Whether a participant is still in the session and the session still running"""
+    return participant.is_active and participant.session.is_active
+
+def publish_participant(participant):
+    """
+    Push a participant's current state to everyone streaming the session (and into the
+    spatial grid). Nothing happens for removed participants or ended sessions: leaving,
+    removal and end_session already told the session and cleared the grid.
+    """
+    if not in_live_session(participant):
+        return
+    latest_location = ParticipantLastPosition.query.get(participant.id)
+    last_position = UserLastPosition.query.get(participant.user_id) if participant.user_id else None
+    grid = participant_grid.grid(participant.session_id)
+    if latest_location:
+        grid.update(participant.id, latest_location.latitude, latest_location.longitude, latest_location.timestamp)
+    else:
+        grid.remove(participant.id)
+    session_events.publish(
+        participant.session_id,
+        'participant',
+        serialize_participant(participant, participant.user, latest_location, last_position)
+    )
+
+def publish_user_participants(user):
+    """Re-publish every active participation of a user whose name or picture changed"""
+    participants = SessionParticipant.query.join(Session).filter(
+        SessionParticipant.user_id == user.id,
+        SessionParticipant.is_active == True,
+        Session.is_active == True
+    ).all()
+    for participant in participants:
+        publish_participant(participant)
+
+def load_participant_grid(user_session):
+    """The session's spatial grid, filled from participant_last_positions the first time it is used in this process"""
+    if not realtime_in_process():
+        # Other processes move and remove participants too: start from the database every time
+        participant_grid.drop(user_session.id)
+    grid = participant_grid.grid(user_session.id)
+    if not grid.loaded:
+        rows = db.session.query(ParticipantLastPosition).join(
+            SessionParticipant, ParticipantLastPosition.participant_id == SessionParticipant.id
+        ).filter(
+            SessionParticipant.session_id == user_session.id,
+            SessionParticipant.is_active == True
+        ).all()
+        for fix in rows:
+            # Fixes published since the grid was created are newer than what was just read
+            grid.update(fix.participant_id, fix.latitude, fix.longitude, fix.timestamp, replace=False)
+        grid.loaded = True
+    return grid
+
+def creator_participant_id(user_session):
+    """
+    The session creator's participant id, or None until they join. Cached once found
+    (participant rows are never re-created); end_session evicts it.
+    """
+    creator_id = creator_participants.get(user_session.id)
+    if creator_id is None:
+        creator_id = db.session.query(SessionParticipant.id).filter_by(
+            session_id=user_session.id, user_id=user_session.creator_id
+        ).scalar()
+        if creator_id is not None:
+            creator_participants[user_session.id] = creator_id
+    return creator_id
+
+creator_participants = {}  # session id -> creator's participant id, for sessions still running
+
+def check_proximity(participant):
+    """
+    Alert the session when the participant who just moved came near someone
+    (PROXIMITY_ALERTS). Only the mover is evaluated, against its grid neighbours,
+    so a location update costs O(nearby participants) rather than O(n).
+    """
+    mode = app.config['PROXIMITY_ALERTS']
+    if mode not in ('creator', 'all') or not realtime_in_process():
+        # Pair state is per process; several processes would each alert for the same pair
+        return
+    
     try:
-        url = f"https://nominatim.openstreetmap.org/reverse"
-        params = {
-            'lat': latitude,
-            'lon': longitude,
-            'format': 'json',
-            'zoom': 14,  # City/town level
-            'addressdetails': 1
-        }
-        headers = {
-            'User-Agent': 'Hunt-Hunt-Planur/1.0'  # Required by Nominatim
-        }
+        grid = load_participant_grid(participant.session)
+        me = grid.get(participant.id)
+        if me is None:
+            return
+        latitude, longitude, _ = me
         
-        response = requests.get(url, params=params, headers=headers, timeout=5)
+        scope = None
+        if mode == 'all':
+            candidates = grid.nearby(latitude, longitude, proximity_monitor.exit_m)
+        else:
+            creator_id = creator_participant_id(participant.session)
+            creator = grid.get(creator_id) if creator_id else None
+            if creator_id == participant.id:
+                candidates = grid.nearby(latitude, longitude, proximity_monitor.exit_m)
+            else:
+                # Only the distance to the creator matters: no grid search needed
+                scope = {creator_id}
+                candidates = [(haversine_m(latitude, longitude, creator[0], creator[1]), creator_id,
+                               creator[0], creator[1], creator[2])] if creator else []
         
-        if response.status_code == 200:
-            data = response.json()
-            address = data.get('address', {})
-            
-            # Build location name from available components
-            parts = []
-            
-            # Try to get neighborhood, suburb, or district
-            for key in ['neighbourhood', 'suburb', 'district', 'quarter']:
-                if key in address:
-                    parts.append(address[key])
-                    break
-            
-            # Add city/town/village
-            for key in ['city', 'town', 'village', 'municipality']:
-                if key in address:
-                    parts.append(address[key])
-                    break
-            
-            # Add country
-            if 'country' in address:
-                parts.append(address['country'])
-            
-            if parts:
-                return ', '.join(parts)
-            
-            # Fallback to display_name if no specific parts found
-            return data.get('display_name', 'Unknown Location')
+        # Ignore last-known positions of participants who are no longer sending fixes
+        online_since = datetime.utcnow() - timedelta(seconds=app.config['ONLINE_TIMEOUT_SECONDS'])
+        neighbours = [(distance, other_id) for distance, other_id, _, _, timestamp in candidates
+                      if timestamp >= online_since]
+        alerts = proximity_monitor.update(participant.session_id, participant.id, neighbours, scope)
+        if not alerts:
+            return
         
-        return None
+        names = dict(db.session.query(
+            SessionParticipant.id, db.func.coalesce(User.username, SessionParticipant.guest_name)
+        ).outerjoin(
+            User, SessionParticipant.user_id == User.id
+        ).filter(
+            SessionParticipant.id.in_([participant.id] + [other_id for other_id, _ in alerts])
+        ).all())
+        
+        for other_id, distance in alerts:
+            db.session.add(Notification(
+                session_id=participant.session_id,
+                sender_participant_id=participant.id,
+                message=f"{names.get(participant.id)} is {round(distance)} m from {names.get(other_id)}",
+                kind='proximity',
+                sender_latitude=latitude,
+                sender_longitude=longitude
+            ))
+        db.session.commit()
+        
+        notification_events.publish(participant.session_id, 'alert', {'proximity': len(alerts)})
     except Exception as e:
-        print(f"Reverse geocoding error: {e}")
+        db.session.rollback()
+        print(f"Proximity check error: {e}")
+
+def publish_participant_left(participant):
+    """Tell everyone streaming the session that a participant is gone"""
+    participant_grid.grid(participant.session_id).remove(participant.id)
+    proximity_monitor.forget(participant.session_id, participant.id)
+    session_events.publish(participant.session_id, 'participant_left', {'id': participant.id})
+
+def encode_history_cursor(s):
+    """Opaque keyset cursor pointing just after session ``s`` in (created_at, id) DESC order"""
+    raw = f"{s.created_at.isoformat()}|{s.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_history_cursor(cursor):
+    """Inverse of encode_history_cursor; raises ValueError on anything malformed"""
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    created_at, session_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(session_id)
+
+def store_location_name(session_id, location_name):
+    """Geocoding queue callback: fill in a session's location name once resolved"""
+    if not location_name:
+        return
+    with app.app_context():
+        Session.query.filter_by(id=session_id, location_name=None).update({'location_name': location_name})
+        db.session.commit()
+
+# WebSocket gateway callbacks (see ws_gateway.py); they run on the gateway's worker threads
+
+def ws_authenticate(session_code, cookie_header):
+    """(session_id, participant_id) for the Flask session cookie, if it belongs to an active participant of the session"""
+    value = parse_cookie(cookie_header).get(app.config['SESSION_COOKIE_NAME'])
+    serializer = app.session_interface.get_signing_serializer(app)
+    if not value or serializer is None:
+        return None
+    try:
+        data = serializer.loads(value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
         return None
+    
+    participant_id = data.get('participant_id')
+    if not participant_id or data.get('session_code') != session_code:
+        return None
+    with app.app_context():
+        row = db.session.query(SessionParticipant.session_id).join(Session).filter(
+            SessionParticipant.id == participant_id,
+            SessionParticipant.is_active == True,
+            Session.session_code == session_code,
+            Session.is_active == True
+        ).first()
+    return (row[0], participant_id) if row else None
+
+def ws_snapshot(session_code):
+    """The get_participants body for a session, from the shared snapshot cache"""
+    with app.app_context():
+        snapshot = participants_snapshots.get_or_build(session_code, lambda: build_participants_snapshot(session_code))
+    return snapshot.body.decode() if snapshot else '{"success": false, "participants": []}'
+
+def ws_receive(participant_id, message):
+    """Handle one client message; returns the reply, if any"""
+    if message.get('type') != 'location':
+        return {'type': 'error', 'message': 'Unknown message type'}
+    
+    latitude = message.get('latitude')
+    longitude = message.get('longitude')
+    accuracy = message.get('accuracy')
+    if not is_valid_coordinate(latitude, longitude):
+        return {'type': 'error', 'message': 'Invalid coordinates'}
+    if not isinstance(accuracy, (int, float)) or isinstance(accuracy, bool):
+        accuracy = None
+    
+    with app.app_context():
+        try:
+            stored = store_location(participant_id, latitude, longitude, accuracy)
+        except TimeoutError:
+            return {'type': 'error', 'message': 'Server busy, try again'}
+        except Exception as e:
+            db.session.rollback()
+            print(f"WebSocket location error: {e}")
+            return {'type': 'error', 'message': 'Server error'}
+    if not stored:
+        return {'type': 'error', 'message': 'Not an active participant'}
+    return None
+
+def start_websocket_gateway(ssl_context=None, port=None, reuse_port=False):
+    """Start the gateway on its own thread and feed it everything published for sessions"""
+    global websocket_gateway
+    gateway = SessionGateway(
+        ws_authenticate, ws_snapshot, ws_receive,
+        port=app.config['WEBSOCKET_PORT'] if port is None else port,
+        ssl_context=ssl_context,
+        workers=app.config['WEBSOCKET_WORKERS'],
+        reuse_port=reuse_port
+    )
+    gateway.start()
+    session_events.add_listener(lambda session_id, event: gateway.publish(session_id, event.event_type, event.data))
+    notification_events.add_listener(lambda session_id, event: gateway.publish(session_id, 'alert', event.data))
+    websocket_gateway = gateway
+    return gateway
+
+websocket_gateway = None  # Set once start_websocket_gateway has run in this process
+
+# Reverse geocoding runs off the request path; create_session only queues the lookup
+geocoder = make_geocoder(app.config)
+geocoding_queue = GeocodingQueue(geocoder, store_location_name, max_workers=app.config['GEOCODING_WORKERS'])
 
 # Routes - Serve HTML files
 @app.route('/')
@@ -348,14 +967,15 @@ def create_session():
     if not session_name:
         return jsonify({'success': False, 'message': 'Session name required'}), 400
     
-    # Get location coordinates if provided
+    # Get location coordinates if provided; the name is resolved in the background
     latitude = data.get('latitude')
     longitude = data.get('longitude')
     location_name = None
-    
-    # Try to reverse geocode the location
-    if latitude is not None and longitude is not None:
-        location_name = reverse_geocode(latitude, longitude)
+    location_pending = False
+    if is_valid_coordinate(latitude, longitude):
+        # Known neighbourhoods are answered from the geocode cache straight away
+        location_name = geocoder.cached(latitude, longitude)
+        location_pending = location_name is None
     
     session_code = generate_session_code()
     if not session_code:
@@ -371,27 +991,28 @@ def create_session():
     
     try:
         db.session.add(new_session)
-        db.session.commit()
+        db.session.flush()
         
         # Add creator as participant
-        participant = SessionParticipant(
-            session_id=new_session.id,
-            user_id=session['user_id']
-        )
-        db.session.add(participant)
+        participant = add_participant(new_session, user_id=session['user_id'])
         db.session.commit()
         
         # Store participant_id and session_code in session for later use
         session['participant_id'] = participant.id
         session['session_code'] = session_code
         
+        if location_pending:
+            geocoding_queue.submit(new_session.id, latitude, longitude)
+        
         return jsonify({
             'success': True,
             'message': 'Session created successfully',
             'session': {
                 'id': new_session.id,
                 'session_code': session_code,
-                'session_name': session_name
+                'session_name': session_name,
+                'location_name': location_name,
+                'location_pending': location_pending
             }
         })
     except Exception as e:
@@ -410,11 +1031,6 @@ def get_sessions():
     
     sessions_data = []
     for s in user_sessions:
-        participant_count = SessionParticipant.query.filter_by(
-            session_id=s.id,
-            is_active=True
-        ).count()
-        
         sessions_data.append({
             'id': s.id,
             'session_code': s.session_code,
@@ -422,7 +1038,7 @@ def get_sessions():
             'location_name': s.location_name,
             'created_at': s.created_at.isoformat(),
             'is_active': s.is_active,
-            'participant_count': participant_count,
+            'participant_count': s.active_participant_count,
             'is_creator': True
         })
     
@@ -435,42 +1051,34 @@ def get_joined_sessions():
     
     user_id = session['user_id']
     
-    # Debug: Check all participants for this user
-    all_participants = SessionParticipant.query.filter_by(user_id=user_id).all()
-    print(f"DEBUG: User {user_id} has {len(all_participants)} total participant records")
-    for p in all_participants:
-        s = Session.query.get(p.session_id)
-        if s:
-            print(f"  - Session {s.session_code}: participant_active={p.is_active}, session_active={s.is_active}, is_creator={s.creator_id == user_id}")
-    
-    # Get ALL sessions where user has joined (regardless of participant is_active status)
-    # Show both active and left sessions, but only if the session itself is still active
-    # Don't show sessions the user created (those appear in "Your Created Sessions")
-    joined_sessions = db.session.query(Session).join(
-        SessionParticipant, Session.id == SessionParticipant.session_id
+    # One row per session the user has a participant record in, and whether any
+    # of those records is still active (left sessions are listed too, for rejoining)
+    own = db.session.query(
+        SessionParticipant.session_id.label('session_id'),
+        db.func.max(SessionParticipant.is_active).label('user_is_active')
+    ).filter(
+        SessionParticipant.user_id == user_id
+    ).group_by(SessionParticipant.session_id).subquery()
+    
+    # Only sessions that are still active (not ended), and not ones the user
+    # created (those appear in "Your Created Sessions")
+    rows = db.session.query(
+        Session,
+        User.username,
+        own.c.user_is_active
+    ).join(
+        own, own.c.session_id == Session.id
+    ).outerjoin(
+        User, User.id == Session.creator_id
     ).filter(
-        SessionParticipant.user_id == user_id,
-        Session.is_active == True,  # Only show if session is still active (not ended)
-        Session.creator_id != user_id  # Not the creator
-    ).distinct().order_by(Session.created_at.desc()).all()
+        Session.is_active == True,
+        Session.creator_id != user_id
+    ).order_by(Session.created_at.desc()).all()
     
-    print(f"DEBUG: Found {len(joined_sessions)} joined sessions (excluding created ones)")
+    app.logger.debug("User %s has %d joined sessions (excluding created ones)", user_id, len(rows))
     
     sessions_data = []
-    for s in joined_sessions:
-        creator = User.query.get(s.creator_id)
-        # Count only active participants
-        participant_count = SessionParticipant.query.filter_by(
-            session_id=s.id,
-            is_active=True
-        ).count()
-        
-        # Check if user is currently active in this session
-        user_participant = SessionParticipant.query.filter_by(
-            session_id=s.id,
-            user_id=user_id
-        ).first()
-        
+    for s, creator_name, user_is_active in rows:
         sessions_data.append({
             'id': s.id,
             'session_code': s.session_code,
@@ -478,126 +1086,124 @@ def get_joined_sessions():
             'location_name': s.location_name,
             'created_at': s.created_at.isoformat(),
             'is_active': s.is_active,
-            'participant_count': participant_count,
+            'participant_count': s.active_participant_count,
             'is_creator': False,
-            'creator_name': creator.username if creator else 'Unknown',
-            'user_is_active': user_participant.is_active if user_participant else False
+            'creator_name': creator_name or 'Unknown',
+            'user_is_active': bool(user_is_active)
         })
     
     return jsonify({'success': True, 'sessions': sessions_data})
 
 @app.route('/api/get_all_sessions_history', methods=['GET'])
 def get_all_sessions_history():
-    """Get all sessions (created and joined) for the logged-in user, including ended ones"""
+    """
+    Get sessions (created and joined) for the logged-in user, including ended ones,
+    newest first. Paginated with ?limit=N&cursor=<next_cursor>; ?filter= narrows to
+    created, joined, active or ended sessions.
+    """
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not authenticated'}), 401
     
-    # Get all sessions created by user
-    created_sessions = Session.query.filter_by(
-        creator_id=session['user_id']
-    ).order_by(Session.created_at.desc()).all()
+    user_id = session['user_id']
+    
+    limit = request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['HISTORY_PAGE_MAX']))
+    
+    filters = {
+        'all': None,
+        'created': Session.creator_id == user_id,
+        'joined': Session.creator_id != user_id,
+        'active': Session.is_active == True,
+        'ended': Session.is_active == False
+    }
+    filter_name = request.args.get('filter', 'all')
+    if filter_name not in filters:
+        return jsonify({'success': False, 'message': 'Invalid filter'}), 400
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_created_at, cursor_id = decode_history_cursor(cursor)
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    own_participant = db.aliased(SessionParticipant)
+    own_archive = db.aliased(SessionArchive)
+    
+    # Sessions the user created or ever joined (archived sessions keep their participants in session_archives)
+    user_session_ids = db.union(
+        db.select(Session.id).where(Session.creator_id == user_id),
+        db.select(SessionParticipant.session_id).where(SessionParticipant.user_id == user_id),
+        db.select(SessionArchive.session_id).where(SessionArchive.user_id == user_id)
+    )
     
-    # Get all sessions joined by user (including ended ones)
-    joined_sessions = db.session.query(Session).join(
-        SessionParticipant, Session.id == SessionParticipant.session_id
+    query = db.session.query(
+        Session,
+        User.username,
+        db.func.coalesce(own_participant.joined_at, own_archive.joined_at),
+        own_participant.is_active
+    ).outerjoin(
+        User, User.id == Session.creator_id
+    ).outerjoin(
+        own_participant, db.and_(
+            own_participant.session_id == Session.id,
+            own_participant.user_id == user_id
+        )
+    ).outerjoin(
+        own_archive, db.and_(
+            own_archive.session_id == Session.id,
+            own_archive.user_id == user_id
+        )
     ).filter(
-        SessionParticipant.user_id == session['user_id'],
-        Session.creator_id != session['user_id']  # Not the creator
-    ).distinct().order_by(Session.created_at.desc()).all()
+        Session.id.in_(user_session_ids)
+    )
     
-    sessions_data = []
+    if filters[filter_name] is not None:
+        query = query.filter(filters[filter_name])
     
-    # Add created sessions
-    for s in created_sessions:
-        # Get unique participants (count distinct user_id and guest_name combinations)
-        # For registered users, count by user_id; for guests, count by guest_name
-        all_participants = SessionParticipant.query.filter_by(session_id=s.id).all()
-        unique_participants = set()
-        for p in all_participants:
-            if p.user_id:
-                unique_participants.add(('user', p.user_id))
-            else:
-                unique_participants.add(('guest', p.guest_name))
-        max_participant_count = len(unique_participants)
-        
-        # Get currently active unique participants
-        active_participants = SessionParticipant.query.filter_by(
-            session_id=s.id,
-            is_active=True
-        ).all()
-        active_unique_participants = set()
-        for p in active_participants:
-            if p.user_id:
-                active_unique_participants.add(('user', p.user_id))
-            else:
-                active_unique_participants.add(('guest', p.guest_name))
-        active_participant_count = len(active_unique_participants)
-        
-        sessions_data.append({
+    # Keyset: everything strictly after the cursor in (created_at, id) DESC order
+    if cursor:
+        query = query.filter(db.or_(
+            Session.created_at < cursor_created_at,
+            db.and_(Session.created_at == cursor_created_at, Session.id < cursor_id)
+        ))
+    
+    # Fetch one extra row to learn whether another page exists
+    rows = query.order_by(Session.created_at.desc(), Session.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    sessions_data = []
+    for s, creator_name, joined_at, user_is_active in rows:
+        session_data = {
             'id': s.id,
             'session_code': s.session_code,
             'session_name': s.session_name,
             'location_name': s.location_name,
             'created_at': s.created_at.isoformat(),
             'is_active': s.is_active,
-            'participant_count': max_participant_count,
-            'active_participant_count': active_participant_count,
-            'is_creator': True,
-            'user_is_active': True  # Creator is always considered active if session is active
-        })
-    
-    # Add joined sessions
-    for s in joined_sessions:
-        creator = User.query.get(s.creator_id)
-        
-        # Get unique participants
-        all_participants = SessionParticipant.query.filter_by(session_id=s.id).all()
-        unique_participants = set()
-        for p in all_participants:
-            if p.user_id:
-                unique_participants.add(('user', p.user_id))
-            else:
-                unique_participants.add(('guest', p.guest_name))
-        max_participant_count = len(unique_participants)
-        
-        # Get currently active unique participants
-        active_participants = SessionParticipant.query.filter_by(
-            session_id=s.id,
-            is_active=True
-        ).all()
-        active_unique_participants = set()
-        for p in active_participants:
-            if p.user_id:
-                active_unique_participants.add(('user', p.user_id))
-            else:
-                active_unique_participants.add(('guest', p.guest_name))
-        active_participant_count = len(active_unique_participants)
+            'participant_count': s.participant_count,
+            'active_participant_count': s.active_participant_count
+        }
         
-        # Check if user is currently active in this session
-        user_participant = SessionParticipant.query.filter_by(
-            session_id=s.id,
-            user_id=session['user_id']
-        ).first()
+        if s.creator_id == user_id:
+            session_data.update({
+                'is_creator': True,
+                'user_is_active': True  # Creator is always considered active if session is active
+            })
+        else:
+            session_data.update({
+                'is_creator': False,
+                'creator_name': creator_name or 'Unknown',
+                'user_is_active': bool(user_is_active),
+                'joined_at': joined_at.isoformat() if joined_at else None
+            })
         
-        sessions_data.append({
-            'id': s.id,
-            'session_code': s.session_code,
-            'session_name': s.session_name,
-            'location_name': s.location_name,
-            'created_at': s.created_at.isoformat(),
-            'is_active': s.is_active,
-            'participant_count': max_participant_count,
-            'active_participant_count': active_participant_count,
-            'is_creator': False,
-            'creator_name': creator.username if creator else 'Unknown',
-            'user_is_active': user_participant.is_active if user_participant else False,
-            'joined_at': user_participant.joined_at.isoformat() if user_participant else None
-        })
+        sessions_data.append(session_data)
     
-    # Sort all sessions by created_at descending
-    sessions_data.sort(key=lambda x: x['created_at'], reverse=True)
+    next_cursor = encode_history_cursor(rows[-1][0]) if has_more else None
     
-    return jsonify({'success': True, 'sessions': sessions_data})
+    return jsonify({'success': True, 'sessions': sessions_data, 'next_cursor': next_cursor})
 
 @app.route('/api/end_session', methods=['POST'])
 def end_session():
@@ -617,11 +1223,21 @@ def end_session():
     
     try:
         user_session.is_active = False
+        user_session.ended_at = datetime.utcnow()
         
         # Deactivate all participants
         SessionParticipant.query.filter_by(session_id=user_session.id).update({'is_active': False})
+        user_session.active_participant_count = 0
         
         db.session.commit()
+        
+        session_events.publish(user_session.id, 'ended', {'session_code': user_session.session_code})
+        # Streams still open get the 'ended' event; their channels go when they do
+        session_events.close(user_session.id)
+        notification_events.close(user_session.id)
+        participant_grid.drop(user_session.id)
+        proximity_monitor.drop(user_session.id)
+        creator_participants.pop(user_session.id, None)
         return jsonify({'success': True, 'message': 'Session ended successfully'})
     except Exception as e:
         db.session.rollback()
@@ -692,9 +1308,10 @@ def join_session():
     if existing:
         # Reactivate if they were inactive (rejoining)
         if not existing.is_active:
-            existing.is_active = True
-            existing.joined_at = datetime.utcnow()  # Update join time
+            # Update join time as well
+            set_participant_active(existing, True, joined_at=datetime.utcnow())
             db.session.commit()
+            publish_participant(existing)
             message = 'Rejoined session successfully'
         else:
             message = 'Already joined session'
@@ -711,17 +1328,13 @@ def join_session():
             'session_name': user_session.session_name
         })
     
-    # Add as new participant
-    participant = SessionParticipant(
-        session_id=user_session.id,
-        user_id=user_id,
-        guest_name=guest_name
-    )
-    
     try:
-        db.session.add(participant)
+        # Add as new participant
+        participant = add_participant(user_session, user_id=user_id, guest_name=guest_name)
         db.session.commit()
         
+        publish_participant(participant)
+        
         session['participant_id'] = participant.id
         session['session_code'] = session_code
         if guest_name:
@@ -764,7 +1377,8 @@ def get_session_info():
             'creator_id': user_session.creator_id,
             'creator_name': creator.username if creator else None,
             'is_active': user_session.is_active
-        }
+        },
+        'websocket_port': websocket_gateway.port if websocket_gateway else None
     })
 
 @app.route('/api/get_participant_info', methods=['GET'])
@@ -772,7 +1386,7 @@ def get_participant_info():
     if 'participant_id' not in session:
         return jsonify({'success': False, 'message': 'Not a participant'}), 401
     
-    participant = SessionParticipant.query.get(session['participant_id'])
+    participant = cookie_participant()
     
     if not participant:
         return jsonify({'success': False, 'message': 'Participant not found'}), 404
@@ -805,118 +1419,430 @@ def update_location():
     if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
         return jsonify({'success': False, 'message': 'Invalid coordinates'}), 400
     
-    location = Location(
-        participant_id=session['participant_id'],
-        latitude=latitude,
-        longitude=longitude,
-        accuracy=accuracy
-    )
+    participant = cookie_participant()
+    if not participant:
+        return jsonify({'success': False, 'message': 'Participant not found'}), 404
+    if not in_live_session(participant):
+        return jsonify({'success': False, 'message': 'Not an active participant'}), 404
     
     try:
-        db.session.add(location)
+        store_location(participant.id, latitude, longitude, accuracy)
+        return jsonify({'success': True, 'message': 'Location updated'})
+    except TimeoutError:
+        # The location writer is backed up or stuck
+        return jsonify({'success': False, 'message': 'Server busy, try again'}), 503
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+
+def store_location(participant_id, latitude, longitude, accuracy):
+    """
+    Store one fix received now and tell the session about it; shared by
+    update_location and the WebSocket gateway. Coordinates must already be validated.
+    Returns False, storing nothing, if the participant has left or the session ended.
+    """
+    fix = {'latitude': latitude, 'longitude': longitude, 'accuracy': accuracy, 'timestamp': datetime.utcnow()}
+    
+    if location_writer is not None:
+        # Committed together with other requests' fixes on the writer thread
+        return location_writer.submit((participant_id, fix))
+    
+    participant, merged = stage_fix(participant_id, fix, previous_stored_fix(participant_id))
+    db.session.commit()
+    if not participant:
+        return False
+    
+    if not merged:
+        stationary_filter.remember(participant_id, fix)
+    publish_participant(participant)
+    check_proximity(participant)
+    return True
+
+def stage_fix(participant_id, fix, previous):
+    """
+    Add one fix to the current transaction, merged into the last row when it is
+    stationary relative to ``previous``. Returns (participant, merged); the participant
+    is None, and nothing is staged, if they have left or the session ended.
+    """
+    now = fix['timestamp']
+    participant = SessionParticipant.query.get(participant_id)
+    if not participant or not in_live_session(participant):
+        return None, False
+    
+    # Standing still: extend the previous row instead of adding one
+    merged = stationary_filter.is_stationary(previous, fix) and \
+        extend_last_row(Location, Location.participant_id, participant_id, now)
+    
+    if merged:
+        if participant.user_id:
+            extend_last_row(UserPosition, UserPosition.user_id, participant.user_id, now)
+    else:
+        db.session.add(Location(participant_id=participant_id, **fix))
         
         # Save position to UserPosition table for registered users
-        participant = SessionParticipant.query.get(session['participant_id'])
-        if participant and participant.user_id:
-            user_position = UserPosition(
-                user_id=participant.user_id,
-                latitude=latitude,
-                longitude=longitude,
-                accuracy=accuracy
-            )
-            db.session.add(user_position)
+        if participant.user_id:
+            db.session.add(UserPosition(user_id=participant.user_id, **fix))
+    
+    # Keep the latest-position tables in step (this is also what keeps them online)
+    record_last_position(participant, fix['latitude'], fix['longitude'], fix['accuracy'], now)
+    
+    return participant, merged
+
+def load_participants(participant_ids):
+    """
+    Load participants with their sessions, users and last-position rows in one query per table,
+    so the per-participant lookups of staging and publishing find them in the session.
+    Returns the loaded objects; hold on to them, the session only keeps weak references.
+    """
+    participants = SessionParticipant.query.filter(SessionParticipant.id.in_(participant_ids)).all()
+    loaded = participants + ParticipantLastPosition.query.filter(
+        ParticipantLastPosition.participant_id.in_(participant_ids)
+    ).all()
+    session_ids = {p.session_id for p in participants}
+    if session_ids:
+        loaded += Session.query.filter(Session.id.in_(session_ids)).all()
+    user_ids = {p.user_id for p in participants if p.user_id}
+    if user_ids:
+        loaded += User.query.filter(User.id.in_(user_ids)).all()
+        loaded += UserLastPosition.query.filter(UserLastPosition.user_id.in_(user_ids)).all()
+    return loaded
+
+def write_fixes(writes):
+    """
+    GroupCommitWriter callback: stage queued (participant_id, fix) pairs, commit once, then
+    publish. Each result is whether the fix was stored (see store_location).
+    """
+    with app.app_context():
+        previous = {}
+        participants = {}
+        remembered = []
+        try:
+            loaded = load_participants({participant_id for participant_id, _ in writes})
+            for participant_id, fix in writes:
+                if participant_id not in previous:
+                    previous[participant_id] = previous_stored_fix(participant_id)
+                participant, merged = stage_fix(participant_id, fix, previous[participant_id])
+                if not participant:
+                    continue
+                participants[participant_id] = participant
+                if not merged:
+                    remembered.append((participant_id, fix))
+                    if app.config['STATIONARY_FILTER_ENABLED']:
+                        # A later fix in this batch compares with this one
+                        previous[participant_id] = fix
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
         
-        db.session.commit()
+        for participant_id, fix in remembered:
+            stationary_filter.remember(participant_id, fix)
+        # Someone with several fixes in the batch is published once, at their latest.
+        # The fixes are committed, so a failure here must not fail (and retry) the batch
+        try:
+            # The commit expired everything; reload it all at once
+            loaded = load_participants(list(participants))
+            for participant in participants.values():
+                publish_participant(participant)
+                check_proximity(participant)
+        except Exception as e:
+            print(f"Location publish error: {e}")
+    return [participant_id in participants for participant_id, _ in writes]
+
+location_writer = GroupCommitWriter(
+    write_fixes,
+    max_batch=app.config['LOCATION_GROUP_COMMIT_MAX_ROWS'],
+    max_delay_s=app.config['LOCATION_GROUP_COMMIT_DELAY_MS'] / 1000,
+    timeout_s=app.config['LOCATION_GROUP_COMMIT_TIMEOUT_SECONDS']
+) if app.config['LOCATION_GROUP_COMMIT'] else None
+
+@app.route('/api/update_locations_batch', methods=['POST'])
+def update_locations_batch():
+    """
+    Store an ordered batch of buffered fixes in one transaction.
+    Each fix carries the Geolocation timestamp (ms since epoch) and a sequence number
+    counted per ``stream`` (an id each browser picks for itself); fixes at or below
+    the stream's last accepted sequence were stored before and are skipped, so
+    clients can safely retry a batch, and other devices keep counting on their own.
+    """
+    if 'participant_id' not in session:
+        return jsonify({'success': False, 'message': 'Not a participant'}), 401
+    
+    data = request.get_json() or {}
+    fixes = data.get('fixes')
+    
+    if not isinstance(fixes, list) or not fixes:
+        return jsonify({'success': False, 'message': 'Fixes required'}), 400
+    
+    if len(fixes) > app.config['LOCATION_BATCH_MAX']:
+        return jsonify({'success': False, 'message': 'Too many fixes in one batch'}), 400
+    
+    stream_id = data.get('stream', '')
+    if not isinstance(stream_id, str) or len(stream_id) > 64:
+        return jsonify({'success': False, 'message': 'Invalid stream'}), 400
+    
+    participant = cookie_participant()
+    if not participant:
+        return jsonify({'success': False, 'message': 'Participant not found'}), 404
+    if not in_live_session(participant):
+        return jsonify({'success': False, 'message': 'Not an active participant'}), 404
+    
+    now = datetime.utcnow()
+    
+    # Correct for client clock skew using the client's send time
+    clock_offset = timedelta(0)
+    sent_at = data.get('sent_at')
+    if isinstance(sent_at, (int, float)) and not isinstance(sent_at, bool):
+        clock_offset = now - datetime.utcfromtimestamp(sent_at / 1000.0)
+    
+    parsed = {}
+    for fix in fixes:
+        if not isinstance(fix, dict):
+            return jsonify({'success': False, 'message': 'Invalid fix'}), 400
         
-        # Clean up old locations (keep last 100 per participant)
-        old_locations = Location.query.filter_by(
-            participant_id=session['participant_id']
-        ).order_by(Location.timestamp.desc()).offset(100).all()
+        latitude = fix.get('latitude')
+        longitude = fix.get('longitude')
+        seq = fix.get('seq')
+        client_timestamp = fix.get('timestamp')
         
-        for old_loc in old_locations:
-            db.session.delete(old_loc)
+        if not is_valid_coordinate(latitude, longitude):
+            return jsonify({'success': False, 'message': 'Invalid coordinates'}), 400
         
-        # Clean up old user positions (keep last 1000 per user)
-        if participant and participant.user_id:
-            old_positions = UserPosition.query.filter_by(
-                user_id=participant.user_id
-            ).order_by(UserPosition.timestamp.desc()).offset(1000).all()
-            
-            for old_pos in old_positions:
-                db.session.delete(old_pos)
+        if not isinstance(seq, int) or isinstance(seq, bool):
+            return jsonify({'success': False, 'message': 'Sequence number required'}), 400
+        
+        if isinstance(client_timestamp, (int, float)) and not isinstance(client_timestamp, bool):
+            timestamp = datetime.utcfromtimestamp(client_timestamp / 1000.0) + clock_offset
+            timestamp = min(timestamp, now)
+        else:
+            timestamp = now
+        
+        parsed[seq] = {
+            'latitude': latitude,
+            'longitude': longitude,
+            'accuracy': fix.get('accuracy'),
+            'timestamp': timestamp
+        }
+    
+    stream = LocationStream.query.get((participant.id, stream_id))
+    last_seq = stream.last_seq if stream else None
+    
+    accepted_seqs = sorted(seq for seq in parsed if last_seq is None or seq > last_seq)
+    if not accepted_seqs:
+        # Every fix is a retry of one already stored from this stream
+        return jsonify({'success': True, 'accepted': 0, 'duplicates': len(parsed), 'last_seq': last_seq})
+    
+    accepted = [parsed[seq] for seq in accepted_seqs]
+    
+    # Fixes within the accuracy radius of the last stored one extend that row's last_seen
+    rows = []
+    previous = previous_stored_fix(participant.id)
+    first_merged = None  # First fix merged into the newest row already in the database
+    extend_to = None
+    suppress = app.config['STATIONARY_FILTER_ENABLED']
+    for fix in accepted:
+        if suppress and stationary_filter.is_stationary(previous, fix):
+            if rows:
+                rows[-1]['last_seen'] = fix['timestamp']
+            else:
+                first_merged = first_merged or fix
+                extend_to = fix['timestamp']
+        else:
+            rows.append(dict(fix, last_seen=None))
+            previous = fix
+    
+    try:
+        if extend_to:
+            if extend_last_row(Location, Location.participant_id, participant.id, extend_to):
+                if participant.user_id:
+                    extend_last_row(UserPosition, UserPosition.user_id, participant.user_id, extend_to)
+            else:
+                # The row is gone (cleared or pruned); store the merged fixes as one after all
+                rows.insert(0, dict(first_merged, last_seen=extend_to))
+        
+        # executemany-style bulk inserts, committed together with the latest position
+        if rows:
+            db.session.execute(
+                db.insert(Location),
+                [dict(row, participant_id=participant.id) for row in rows]
+            )
+            if participant.user_id:
+                db.session.execute(
+                    db.insert(UserPosition),
+                    [dict(row, user_id=participant.user_id) for row in rows]
+                )
+        
+        newest = max(accepted, key=lambda fix: fix['timestamp'])
+        # The batch arriving now is what proves the participant is still online
+        record_last_position(participant, newest['latitude'], newest['longitude'], newest['accuracy'], now)
+        if not stream:
+            stream = LocationStream(participant_id=participant.id, stream_id=stream_id)
+            db.session.add(stream)
+        stream.last_seq = accepted_seqs[-1]
         
         db.session.commit()
         
-        return jsonify({'success': True, 'message': 'Location updated'})
+        if rows:
+            stationary_filter.remember(participant.id, rows[-1])
+        publish_participant(participant)
+        check_proximity(participant)
+        
+        return jsonify({
+            'success': True,
+            'accepted': len(accepted),
+            'duplicates': len(parsed) - len(accepted),
+            'stored': len(rows),
+            'last_seq': accepted_seqs[-1]
+        })
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': 'Server error'}), 500
 
 @app.route('/api/get_participants', methods=['GET'])
 def get_participants():
+    """
+    Active participants of a session. Every poller of a session shares one cached
+    snapshot until something is published for it (or someone's fix goes stale),
+    and a matching If-None-Match gets a 304 without touching the database.
+    """
     session_code = request.args.get('code', '').upper()
     
+    try:
+        if realtime_in_process():
+            snapshot = participants_snapshots.get_or_build(session_code, lambda: build_participants_snapshot(session_code))
+        else:
+            # Changes made by other worker processes never invalidate this process's cache
+            snapshot = build_participants_snapshot(session_code)
+    except Exception as e:
+        # A failed build fails everyone who waited on it, rather than reading as "not found"
+        db.session.rollback()
+        print(f"Participants snapshot error: {e}")
+        return jsonify({'success': False, 'message': 'Server error'}), 500
+    
+    if not snapshot:
+        return jsonify({'success': False, 'message': 'Session not found'}), 404
+    
+    if request.if_none_match.contains(snapshot.etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    # Browsers revalidate on every poll and turn the 304 back into the cached body
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def build_participants_snapshot(session_code):
+    """Render get_participants for one session, or None if there is no such active session"""
     user_session = Session.query.filter_by(session_code=session_code, is_active=True).first()
     
     if not user_session:
-        return jsonify({'success': False, 'message': 'Session not found'}), 404
+        return None
     
-    participants = SessionParticipant.query.filter_by(
-        session_id=user_session.id,
-        is_active=True
+    # Read the version before the data, so a change published meanwhile makes this snapshot stale
+    version = session_events.version(user_session.id)
+    
+    # One joined query: participant, user, current session fix and last known fix
+    rows = db.session.query(
+        SessionParticipant, User, ParticipantLastPosition, UserLastPosition
+    ).outerjoin(
+        User, SessionParticipant.user_id == User.id
+    ).outerjoin(
+        ParticipantLastPosition, ParticipantLastPosition.participant_id == SessionParticipant.id
+    ).outerjoin(
+        UserLastPosition, UserLastPosition.user_id == SessionParticipant.user_id
+    ).filter(
+        SessionParticipant.session_id == user_session.id,
+        SessionParticipant.is_active == True
     ).order_by(SessionParticipant.joined_at).all()
     
-    participants_data = []
-    for p in participants:
-        # Get latest location from session
-        latest_location = Location.query.filter_by(
-            participant_id=p.id
-        ).order_by(Location.timestamp.desc()).first()
-        
-        name = p.user.username if p.user else p.guest_name
-        
-        # Check if location is stale (older than 30 seconds) - consider as offline
-        is_online = False
+    participants_data = [
+        serialize_participant(p, user, latest_location, last_position)
+        for p, user, latest_location, last_position in rows
+    ]
+    
+    # Nothing is published when someone simply stops sending fixes, so expire when the
+    # first online participant would turn offline
+    now = datetime.utcnow()
+    ttl = app.config['PARTICIPANTS_CACHE_MAX_AGE']
+    for _, _, latest_location, _ in rows:
         if latest_location:
-            time_diff = (datetime.utcnow() - latest_location.timestamp).total_seconds()
-            is_online = time_diff < 30
-        
-        # Determine which position to show
-        latitude = None
-        longitude = None
-        accuracy = None
-        last_update = None
-        
-        if is_online and latest_location:
-            # User is online: show current position from session location
-            latitude = latest_location.latitude
-            longitude = latest_location.longitude
-            accuracy = latest_location.accuracy
-            last_update = latest_location.timestamp.isoformat()
-        elif not is_online and p.user_id:
-            # User is offline but is a registered user: get last known position from UserPosition table
-            last_position = UserPosition.query.filter_by(
-                user_id=p.user_id
-            ).order_by(UserPosition.timestamp.desc()).first()
-            
-            if last_position:
-                latitude = last_position.latitude
-                longitude = last_position.longitude
-                accuracy = last_position.accuracy
-                last_update = last_position.timestamp.isoformat()
-        
-        participants_data.append({
-            'id': p.id,
-            'user_id': p.user_id,
-            'name': name,
-            'is_guest': p.user_id is None,
-            'profile_picture': p.user.profile_picture if p.user else None,
-            'latitude': latitude,
-            'longitude': longitude,
-            'accuracy': accuracy,
-            'last_update': last_update,
-            'is_online': is_online
-        })
+            remaining = app.config['ONLINE_TIMEOUT_SECONDS'] - (now - latest_location.timestamp).total_seconds()
+            if remaining > 0:
+                ttl = min(ttl, remaining)
+    
+    body = app.json.dumps({'success': True, 'participants': participants_data}).encode()
+    return Snapshot(user_session.id, version, body, ttl)
+
+@app.route('/api/sessions/<code>/stream', methods=['GET'])
+def stream_session(code):
+    """Server-Sent Events stream of participant changes for an active session"""
+    user_session = Session.query.filter_by(session_code=code.upper(), is_active=True).first()
+    
+    if not user_session:
+        return jsonify({'success': False, 'message': 'Session not found'}), 404
+    
+    if not realtime_in_process():
+        # The stream would miss changes made in other worker processes; clients poll instead
+        return jsonify({'success': False, 'message': 'Live stream unavailable, poll get_participants'}), 503
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    return Response(
+        sse_stream(session_events, user_session.id, last_event_id),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.route('/api/sessions/<code>/nearby', methods=['GET'])
+def get_nearby_participants(code):
+    """
+    Participants of an active session nearest to ?lat=&lon=, from the in-memory grid.
+    ?radius_m=N limits the distance, ?k=N the count (at most NEARBY_MAX_RESULTS).
+    """
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lon'])
+        radius_m = float(request.args['radius_m']) if request.args.get('radius_m') else None
+        k = int(request.args['k']) if request.args.get('k') else None
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'lat and lon are required; radius_m and k must be numbers'}), 400
+    
+    if not is_valid_coordinate(latitude, longitude) or \
+            (radius_m is not None and not radius_m > 0) or (k is not None and k < 1):
+        return jsonify({'success': False, 'message': 'Invalid coordinates, radius_m or k'}), 400
+    
+    user_session = Session.query.filter_by(session_code=code.upper(), is_active=True).first()
+    
+    if not user_session:
+        return jsonify({'success': False, 'message': 'Session not found'}), 404
+    
+    max_results = app.config['NEARBY_MAX_RESULTS']
+    matches = load_participant_grid(user_session).nearby(
+        latitude, longitude, radius_m, min(k, max_results) if k else max_results
+    )
+    
+    # Names for just the participants returned
+    names = dict(db.session.query(
+        SessionParticipant.id, db.func.coalesce(User.username, SessionParticipant.guest_name)
+    ).outerjoin(
+        User, SessionParticipant.user_id == User.id
+    ).filter(
+        SessionParticipant.id.in_([match[1] for match in matches])
+    ).all()) if matches else {}
+    
+    now = datetime.utcnow()
+    participants_data = [{
+        'id': participant_id,
+        'name': names[participant_id],
+        'latitude': lat,
+        'longitude': lon,
+        'distance_m': round(distance, 1),
+        'last_update': timestamp.isoformat(),
+        'is_online': (now - timestamp).total_seconds() < app.config['ONLINE_TIMEOUT_SECONDS']
+    } for distance, participant_id, lat, lon, timestamp in matches if participant_id in names]
     
     return jsonify({'success': True, 'participants': participants_data})
 
@@ -941,52 +1867,39 @@ def get_all_participants_for_review():
     # Check if user was part of this session (either creator or participant)
     current_user_id = session['user_id']
     is_creator = user_session.creator_id == current_user_id
-    was_participant = SessionParticipant.query.filter_by(
-        session_id=user_session.id,
-        user_id=current_user_id
-    ).first() is not None
     
-    if not is_creator and not was_participant:
+    if not is_creator and not was_in_session(user_session, current_user_id):
         return jsonify({'success': False, 'message': 'You were not part of this session'}), 403
     
-    # Get ALL participants (including inactive ones) who ever joined this session
-    participants = SessionParticipant.query.filter_by(
-        session_id=user_session.id
-    ).order_by(SessionParticipant.joined_at).all()
+    # Get ALL participants (including inactive ones) who ever joined this session,
+    # together with their last known position, in one joined query; archived
+    # sessions keep them in session_archives
+    participant_model = SessionArchive if user_session.archived_at else SessionParticipant
+    rows = db.session.query(
+        participant_model, User, UserLastPosition
+    ).outerjoin(
+        User, participant_model.user_id == User.id
+    ).outerjoin(
+        UserLastPosition, UserLastPosition.user_id == participant_model.user_id
+    ).filter(
+        participant_model.session_id == user_session.id
+    ).order_by(participant_model.joined_at).all()
     
     participants_data = []
-    for p in participants:
-        name = p.user.username if p.user else p.guest_name
-        
-        # Get last known position from UserPosition table for registered users
-        latitude = None
-        longitude = None
-        accuracy = None
-        last_update = None
-        
-        if p.user_id:
-            # Get last known position from UserPosition table
-            last_position = UserPosition.query.filter_by(
-                user_id=p.user_id
-            ).order_by(UserPosition.timestamp.desc()).first()
-            
-            if last_position:
-                latitude = last_position.latitude
-                longitude = last_position.longitude
-                accuracy = last_position.accuracy
-                last_update = last_position.timestamp.isoformat()
+    for p, user, last_position in rows:
+        name = user.username if user else p.guest_name
         
         participants_data.append({
-            'id': p.id,
+            'id': p.participant_id if user_session.archived_at else p.id,  # Stable across archiving
             'user_id': p.user_id,
             'name': name,
             'is_guest': p.user_id is None,
-            'profile_picture': p.user.profile_picture if p.user else None,
-            'latitude': latitude,
-            'longitude': longitude,
-            'accuracy': accuracy,
-            'last_update': last_update,
-            'is_active': p.is_active,
+            'profile_picture': user.profile_picture if user else None,
+            'latitude': last_position.latitude if last_position else None,
+            'longitude': last_position.longitude if last_position else None,
+            'accuracy': last_position.accuracy if last_position else None,
+            'last_update': last_position.timestamp.isoformat() if last_position else None,
+            'is_active': False if user_session.archived_at else p.is_active,
             'joined_at': p.joined_at.isoformat() if p.joined_at else None
         })
     
@@ -998,11 +1911,18 @@ def stop_sharing():
     if 'participant_id' not in session:
         return jsonify({'success': False, 'message': 'Not a participant'}), 401
     
+    participant = cookie_participant()
+    if not participant:
+        return jsonify({'success': False, 'message': 'Participant not found'}), 404
+    
     try:
         # Delete all locations for this participant to mark them as offline
-        Location.query.filter_by(participant_id=session['participant_id']).delete()
+        Location.query.filter_by(participant_id=participant.id).delete()
+        clear_last_position(participant.id)
         db.session.commit()
         
+        publish_participant(participant)
+        
         return jsonify({'success': True, 'message': 'Stopped sharing location'})
     except Exception as e:
         db.session.rollback()
@@ -1021,7 +1941,7 @@ def remove_participant():
         return jsonify({'success': False, 'message': 'Participant ID required'}), 400
     
     # Get the current participant
-    current_participant = SessionParticipant.query.get(session['participant_id'])
+    current_participant = cookie_participant()
     if not current_participant:
         return jsonify({'success': False, 'message': 'Not a participant'}), 401
     
@@ -1046,11 +1966,14 @@ def remove_participant():
     try:
         # Clear location data
         Location.query.filter_by(participant_id=participant_id_to_remove).delete()
+        clear_last_position(participant_id_to_remove)
         
         # Mark participant as inactive
-        participant_to_remove.is_active = False
+        set_participant_active(participant_to_remove, False)
         db.session.commit()
         
+        publish_participant_left(participant_to_remove)
+        
         return jsonify({'success': True, 'message': 'Participant removed successfully'})
     except Exception as e:
         db.session.rollback()
@@ -1061,16 +1984,19 @@ def leave_session():
     if 'participant_id' not in session:
         return jsonify({'success': False, 'message': 'Not a participant'}), 401
     
-    participant = SessionParticipant.query.get(session['participant_id'])
+    participant = cookie_participant()
     
     if participant:
         try:
             # Clear location data when leaving
-            Location.query.filter_by(participant_id=session['participant_id']).delete()
+            Location.query.filter_by(participant_id=participant.id).delete()
+            clear_last_position(participant.id)
             
-            participant.is_active = False
+            set_participant_active(participant, False)
             db.session.commit()
             
+            publish_participant_left(participant)
+            
             # Clear session data
             session.pop('participant_id', None)
             session.pop('session_code', None)
@@ -1130,6 +2056,7 @@ def update_profile():
     try:
         user.username = username
         db.session.commit()
+        publish_user_participants(user)
         return jsonify({'success': True, 'message': 'Profile updated successfully'})
     except Exception as e:
         db.session.rollback()
@@ -1177,6 +2104,7 @@ def upload_profile_picture():
         profile_picture_url = f"/uploads/profiles/{filename}"
         user.profile_picture = profile_picture_url
         db.session.commit()
+        publish_user_participants(user)
         
         return jsonify({
             'success': True,
@@ -1207,6 +2135,7 @@ def remove_profile_picture():
         
         user.profile_picture = None
         db.session.commit()
+        publish_user_participants(user)
         
         return jsonify({'success': True, 'message': 'Profile picture removed successfully'})
     except Exception as e:
@@ -1220,7 +2149,7 @@ def send_alert():
         return jsonify({'success': False, 'message': 'Not a participant'}), 401
     
     # Get the current participant
-    participant = SessionParticipant.query.get(session['participant_id'])
+    participant = cookie_participant()
     if not participant:
         return jsonify({'success': False, 'message': 'Participant not found'}), 404
     
@@ -1228,9 +2157,7 @@ def send_alert():
     sender_name = participant.user.username if participant.user else participant.guest_name
     
     # Get participant's current location
-    latest_location = Location.query.filter_by(
-        participant_id=participant.id
-    ).order_by(Location.timestamp.desc()).first()
+    latest_location = ParticipantLastPosition.query.get(participant.id)
     
     sender_lat = latest_location.latitude if latest_location else None
     sender_lng = latest_location.longitude if latest_location else None
@@ -1250,6 +2177,8 @@ def send_alert():
         db.session.add(notification)
         db.session.commit()
         
+        notification_events.publish(participant.session_id, 'alert', {'id': notification.id})
+        
         return jsonify({
             'success': True,
             'message': 'Alert sent to all participants',
@@ -1265,39 +2194,78 @@ def send_alert():
 
 @app.route('/api/get_notifications', methods=['GET'])
 def get_notifications():
-    """Get unread notifications for the current participant"""
+    """
+    Get unread notifications for the current participant.
+    With ?wait=N the request is held for up to N seconds until an alert arrives.
+    """
     if 'participant_id' not in session:
         return jsonify({'success': False, 'message': 'Not a participant'}), 401
     
-    participant = SessionParticipant.query.get(session['participant_id'])
+    participant = cookie_participant()
     if not participant:
         return jsonify({'success': False, 'message': 'Participant not found'}), 404
     
-    # Get unread notifications for this session, excluding ones sent by this participant
-    notifications = Notification.query.filter(
-        Notification.session_id == participant.session_id,
-        Notification.sender_participant_id != participant.id,
+    wait = request.args.get('wait', 0, type=float)
+    wait = max(0, min(wait, app.config['NOTIFICATION_MAX_WAIT']))
+    session_id = participant.session_id
+    own_participant_id = participant.id
+    
+    with notification_events.subscription(session_id):
+        # Read the version before querying so an alert committed in between still wakes us
+        seen_version = notification_events.version(session_id)
+        notifications_data = load_unread_notifications(session_id, own_participant_id)
+        
+        if not notifications_data and wait > 0:
+            deadline = time.monotonic() + wait
+            # Alerts stored by another worker process don't wake this one, so check the database now and then
+            recheck = None if realtime_in_process() else app.config['NOTIFICATION_RECHECK_SECONDS']
+            while not notifications_data:
+                # Don't hold a database connection while parked
+                db.session.close()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                events, _ = notification_events.wait(session_id, seen_version, min(remaining, recheck or remaining))
+                if events:
+                    seen_version = events[-1].seq
+                elif recheck is None:
+                    break
+                notifications_data = load_unread_notifications(session_id, own_participant_id)
+    
+    return jsonify({
+        'success': True,
+        'notifications': notifications_data
+    })
+
+def load_unread_notifications(session_id, own_participant_id):
+    """Unread notifications for a session, excluding ones sent by this participant, with sender names"""
+    rows = db.session.query(
+        Notification, SessionParticipant, User
+    ).outerjoin(
+        SessionParticipant, Notification.sender_participant_id == SessionParticipant.id
+    ).outerjoin(
+        User, SessionParticipant.user_id == User.id
+    ).filter(
+        Notification.session_id == session_id,
+        Notification.sender_participant_id != own_participant_id,
         Notification.is_read == False
     ).order_by(Notification.created_at.desc()).all()
     
     notifications_data = []
-    for notif in notifications:
-        sender = SessionParticipant.query.get(notif.sender_participant_id)
-        sender_name = sender.user.username if sender and sender.user else (sender.guest_name if sender else 'Unknown')
+    for notif, sender, sender_user in rows:
+        sender_name = sender_user.username if sender_user else (sender.guest_name if sender else 'Unknown')
         
         notifications_data.append({
             'id': notif.id,
             'message': notif.message,
+            'kind': notif.kind,
             'sender_name': sender_name,
             'sender_latitude': notif.sender_latitude,
             'sender_longitude': notif.sender_longitude,
             'created_at': notif.created_at.isoformat()
         })
     
-    return jsonify({
-        'success': True,
-        'notifications': notifications_data
-    })
+    return notifications_data
 
 @app.route('/api/mark_notifications_read', methods=['POST'])
 def mark_notifications_read():
@@ -1325,7 +2293,12 @@ def mark_notifications_read():
 
 @app.route('/api/get_user_positions', methods=['GET'])
 def get_user_positions():
-    """Get position history for a specific user in a session"""
+    """
+    Get position history for a specific user in a session.
+    Optional ?tolerance_m=N and/or ?max_points=N simplify the track server-side
+    (see tracks.py); start, end and stop points are always kept. ?format=polyline
+    or ?format=columnar return a compact 'track' object instead of 'positions'.
+    """
     participant_id = request.args.get('participant_id')
     session_code = request.args.get('session_code')
     review_mode = request.args.get('review_mode', 'false').lower() == 'true'
@@ -1333,6 +2306,16 @@ def get_user_positions():
     if not participant_id or not session_code:
         return jsonify({'success': False, 'message': 'Missing parameters'}), 400
     
+    tolerance_m = request.args.get('tolerance_m', type=float)
+    max_points = request.args.get('max_points', type=int)
+    if (tolerance_m is not None and not 0 <= tolerance_m < float('inf')) or \
+            (max_points is not None and max_points < 2):
+        return jsonify({'success': False, 'message': 'Invalid tolerance_m or max_points'}), 400
+    
+    track_format = request.args.get('format', 'json')
+    if track_format not in TRACK_FORMATS:
+        return jsonify({'success': False, 'message': 'Invalid format'}), 400
+    
     # In review mode, check if user is authenticated and was part of the session
     # In normal mode, check if user is an active participant
     if review_mode:
@@ -1352,55 +2335,62 @@ def get_user_positions():
         if review_mode:
             current_user_id = session['user_id']
             is_creator = session_obj.creator_id == current_user_id
-            was_participant = SessionParticipant.query.filter_by(
-                session_id=session_obj.id,
-                user_id=current_user_id
-            ).first() is not None
             
-            if not is_creator and not was_participant:
+            if not is_creator and not was_in_session(session_obj, current_user_id):
                 return jsonify({'success': False, 'message': 'You were not part of this session'}), 403
         
-        # Get the participant
-        participant = SessionParticipant.query.filter_by(
-            id=participant_id,
-            session_id=session_obj.id
-        ).first()
+        if review_mode and session_obj.archived_at:
+            # Archived: the participant and their track come from session_archives
+            participant = SessionArchive.query.filter_by(
+                participant_id=participant_id,
+                session_id=session_obj.id
+            ).first()
+            if not participant:
+                return jsonify({'success': False, 'message': 'Participant not found'}), 404
+            positions = unpack_track(participant.track)
+            user = User.query.get(participant.user_id) if participant.user_id else None
+        else:
+            participant = SessionParticipant.query.filter_by(
+                id=participant_id,
+                session_id=session_obj.id
+            ).first()
+            if not participant:
+                return jsonify({'success': False, 'message': 'Participant not found'}), 404
+            if review_mode and not session_obj.is_active:
+                # The participant's part in the session, as archive_session will keep it
+                positions = participant_track(participant, *review_window(session_obj, participant))
+            else:
+                # Positions from the last 24 hours
+                positions = participant_track(participant, datetime.utcnow() - timedelta(hours=24))
+            user = participant.user
         
-        if not participant:
-            return jsonify({'success': False, 'message': 'Participant not found'}), 404
+        total_points = len(positions)
+        if positions and (tolerance_m is not None or max_points is not None):
+            track = Track.from_rows(positions)
+            stops = stop_points(track, app.config['TRACK_STOP_RADIUS_M'], app.config['TRACK_STOP_MIN_SECONDS'])
+            positions = [positions[i] for i in simplify(track, tolerance_m, max_points, keep=stops)]
         
-        # Get user positions for this participant's user_id
-        if participant.user_id:
-            # Get positions from the last 24 hours
-            time_limit = datetime.utcnow() - timedelta(hours=24)
-            positions = UserPosition.query.filter(
-                UserPosition.user_id == participant.user_id,
-                UserPosition.timestamp >= time_limit
-            ).order_by(UserPosition.timestamp.asc()).all()
-            
-            positions_data = [{
-                'latitude': pos.latitude,
-                'longitude': pos.longitude,
-                'accuracy': pos.accuracy,
-                'timestamp': pos.timestamp.isoformat()
-            } for pos in positions]
-            
-            # Get participant name
-            participant_name = participant.user.username if participant.user else participant.guest_name
-            
-            return jsonify({
-                'success': True,
-                'positions': positions_data,
-                'participant_name': participant_name
-            })
+        # Get participant name
+        participant_name = user.username if user else participant.guest_name
+        
+        response = {
+            'success': True,
+            'total_points': total_points,
+            'participant_name': participant_name
+        }
+        if track_format == 'json':
+            response['positions'] = [{
+                'latitude': latitude,
+                'longitude': longitude,
+                'accuracy': accuracy,
+                'timestamp': timestamp.isoformat(),
+                'last_seen': last_seen.isoformat() if last_seen else None
+            } for latitude, longitude, accuracy, timestamp, last_seen in positions]
         else:
-            # Guest user - no position history
-            participant_name = participant.guest_name
-            return jsonify({
-                'success': True,
-                'positions': [],
-                'participant_name': participant_name
-            })
+            response['format'] = track_format
+            response['track'] = encode_track(positions, track_format)
+        
+        return jsonify(response)
             
     except Exception as e:
         print(f"Error getting user positions: {e}")
@@ -1409,6 +2399,12 @@ def get_user_positions():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        # Bring databases created by older versions up to the current schema
+        upgrade_schema(db.engine)
+    
+    # With the debug reloader, only the serving child process runs background workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug:
+        start_background_workers()
     
     # Check if SSL certificates exist
     import os
@@ -1429,6 +2425,15 @@ if __name__ == '__main__':
     cert_file = 'cert.pem'
     key_file = 'key.pem'
     
+    if app.config['WEBSOCKET_ENABLED'] and (os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or not app.debug):
+        import ssl
+        gateway_ssl = None
+        if os.path.exists(cert_file) and os.path.exists(key_file):
+            gateway_ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            gateway_ssl.load_cert_chain(cert_file, key_file)
+        start_websocket_gateway(gateway_ssl)
+        print(f"WebSocket gateway on port {websocket_gateway.port}")
+    
     if os.path.exists(cert_file) and os.path.exists(key_file):
         print("=" * 60)
         print("[HTTPS] Starting server with HTTPS (SSL enabled)")
@@ -0,0 +1,1025 @@
+"""
+Hunt-Hunt-Planur - Benchmarks
+Runs against a scratch SQLite database; never touches hunt_planur.db.
+
+Usage:
+    python benchmark.py history [--sizes 10,100,200]
+    python benchmark.py participants [--sizes 5,20,50]
+    python benchmark.py geocode [--sizes 100,1000,10000]
+    python benchmark.py gazetteer [--sizes 1000,25000,150000]
+    python benchmark.py tracks [--sizes 1000,10000]
+    python benchmark.py ingest [--sizes 5,20]
+    python benchmark.py gateway [--sizes 100,500,1000]
+    python benchmark.py serve [--sizes 4,16,64]
+    python benchmark.py writes [--sizes 100,500,1000]
+    python benchmark.py storage [--sizes 4,16,64]
+    python benchmark.py archive [--sizes 10,100,500]
+    python benchmark.py formats [--sizes 1000,10000]
+    python benchmark.py nearby [--sizes 100,1000,10000]
+    python benchmark.py proximity [--sizes 100,1000]
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Point the app at a scratch database before it is imported
+_scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_scratch.close()
+os.environ['DATABASE_URL'] = 'sqlite:///' + _scratch.name
+# A pooled connection for each simulated sharer in the writes benchmark
+os.environ.setdefault('SERVE_THREADS', '1000')
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from app import (app, db, User, Session, SessionParticipant, Location, UserPosition, ParticipantLastPosition,
+                 Notification, SessionArchive, stationary_filter, session_events, participants_snapshots, start_websocket_gateway,
+                 run_archive)
+import app as app_module
+from migrations import recompute_participant_counters, upgrade as upgrade_schema
+from geocoding import CachingGeocoder, GeocodeCache, StubGeocoder
+from ingest import GroupCommitWriter
+from gazetteer import Gazetteer
+from spatial import GridIndex, ProximityMonitor, haversine_m
+from tracks import TRACK_FORMATS, Track, encode_track, simplify, stop_points
+
+
+# Helpers
+
+class QueryCounter:
+    """Counts SQL statements issued while active"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+@contextmanager
+def fresh_database():
+    """Empty schema for one benchmark run"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield
+
+
+def create_user(username):
+    user = User(username=username, email=f'{username}@example.com',
+                password_hash=generate_password_hash('password123'))
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def logged_in_client(username):
+    client = app.test_client()
+    client.post('/api/login', json={'username': username, 'password': 'password123'})
+    return client
+
+
+def seed_history(user, session_count, participants_per_session=8):
+    """Half created by ``user``, half created by others and joined by ``user``; a third already ended"""
+    others = [create_user(f'bench_other_{user.id}_{i}') for i in range(participants_per_session)]
+    start = datetime.utcnow() - timedelta(days=session_count)
+    for i in range(session_count):
+        creator = user if i % 2 == 0 else others[i % len(others)]
+        s = Session(session_code=f'B{user.id:02d}{i:05d}'[:10], creator_id=creator.id,
+                    session_name=f'Bench {i}', created_at=start + timedelta(days=i),
+                    is_active=(i % 3 != 0))
+        db.session.add(s)
+        db.session.flush()
+        members = {creator.id, user.id} | {o.id for o in others[:participants_per_session // 2]}
+        for j, member_id in enumerate(sorted(members)):
+            db.session.add(SessionParticipant(session_id=s.id, user_id=member_id, is_active=(j % 2 == 0)))
+        db.session.add(SessionParticipant(session_id=s.id, guest_name=f'guest{i % 3}'))
+    db.session.commit()
+    with db.engine.begin() as conn:
+        recompute_participant_counters(conn)
+
+
+def print_table(headers, rows):
+    widths = [max(len(str(x)) for x in col) for col in zip(headers, *rows)]
+    line = '  '.join(f'{{:>{w}}}' for w in widths)
+    print(line.format(*headers))
+    for row in rows:
+        print(line.format(*row))
+
+
+# Benchmarks
+
+def bench_history(args):
+    """Query count and latency of /api/get_all_sessions_history as history grows"""
+    rows = []
+    for size in args.sizes:
+        with fresh_database():
+            user = create_user(f'bench_user_{size}')
+            db.session.commit()
+            seed_history(user, size)
+            engine = db.engine
+            username = user.username
+        client = logged_in_client(username)
+        with QueryCounter(engine) as counter:
+            started = time.perf_counter()
+            response = client.get('/api/get_all_sessions_history')
+            elapsed = time.perf_counter() - started
+        sessions = len(response.get_json()['sessions'])
+        rows.append((size, sessions, counter.count, f'{elapsed * 1000:.1f}'))
+    print_table(('seeded', 'returned', 'queries', 'ms'), rows)
+
+
+def bench_participants(args):
+    """
+    /api/get_participants polled by every participant of one session, with 0, 1 or
+    size/4 changes published per round of polls: queries and latency per poll and
+    share of 304s, with the snapshot cache on and off. The published changes carry
+    no new data, so rebuilt snapshots keep their ETag.
+    """
+    rounds = 5
+    rows = []
+    for size in args.sizes:
+        with fresh_database():
+            creator = create_user(f'bench_poll_{size}')
+            s = Session(session_code=f'P{size:05d}', creator_id=creator.id, session_name='Bench')
+            db.session.add(s)
+            db.session.flush()
+            now = datetime.utcnow()
+            for i in range(size):
+                p = SessionParticipant(session_id=s.id, guest_name=f'guest{i}')
+                db.session.add(p)
+                db.session.flush()
+                db.session.add(ParticipantLastPosition(participant_id=p.id, latitude=45.46 + i * 1e-4,
+                                                       longitude=9.19, accuracy=10.0, timestamp=now))
+            db.session.commit()
+            engine = db.engine
+            session_id = s.id
+            url = f'/api/get_participants?code={s.session_code}'
+        client = app.test_client()
+        for changes in sorted({0, 1, max(size // 4, 1)}):
+            for cached in (False, True):
+                polls = not_modified = 0
+                etag = None
+                with QueryCounter(engine) as counter:
+                    started = time.perf_counter()
+                    for _ in range(rounds):
+                        for i in range(size):
+                            if changes and i % (size // changes) == 0:
+                                session_events.publish(session_id, 'participant', {})
+                            if not cached:
+                                participants_snapshots.clear()
+                            headers = {'If-None-Match': etag} if cached and etag else {}
+                            response = client.get(url, headers=headers)
+                            etag = response.headers.get('ETag')
+                            polls += 1
+                            not_modified += response.status_code == 304
+                    elapsed = time.perf_counter() - started
+                rows.append((size, changes, 'on' if cached else 'off', f'{counter.count / polls:.2f}',
+                             f'{elapsed / polls * 1000:.2f}', f'{not_modified / polls:.0%}'))
+    print_table(('participants', 'changes/round', 'cache', 'queries/poll', 'ms/poll', '304s'), rows)
+
+
+def bench_geocode(args):
+    """Upstream calls and per-lookup latency of the geocode cache for clustered session locations"""
+    rng = random.Random(42)
+    # Sessions get created from a handful of neighbourhoods, give or take ~100 m
+    centers = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(50)]
+    rows = []
+    for size in args.sizes:
+        points = [(lat + rng.uniform(-0.001, 0.001), lon + rng.uniform(-0.001, 0.001))
+                  for lat, lon in (rng.choice(centers) for _ in range(size))]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'geocode_cache.db')
+            for tier in ('cold', 'restart'):
+                # 'restart' reopens the same file with an empty memory tier
+                upstream = StubGeocoder()
+                geocoder = CachingGeocoder(upstream, GeocodeCache(path))
+                started = time.perf_counter()
+                for lat, lon in points:
+                    geocoder.reverse(lat, lon)
+                elapsed = time.perf_counter() - started
+                stats = geocoder.cache.stats()
+                rows.append((size, tier, upstream.calls, stats['memory_hits'], stats['disk_hits'],
+                             f"{stats['hit_rate']:.1%}", f'{elapsed / size * 1e6:.1f}'))
+    print_table(('lookups', 'run', 'upstream', 'mem hits', 'disk hits', 'hit rate', 'us/lookup'), rows)
+
+
+def bench_gazetteer(args):
+    """Build/load time and lookups per second of the offline gazetteer (synthetic places)"""
+    rng = random.Random(42)
+    lookups = 20000
+    queries = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(lookups)]
+    rows = []
+    for size in args.sizes:
+        # GeoNames cities1000 is ~150k places; a fifth of them as neighbourhoods
+        places = [(rng.uniform(-60, 70), rng.uniform(-180, 180), f'Place {i}', i % 250) for i in range(size)]
+        neighbourhoods = [(rng.uniform(-60, 70), rng.uniform(-180, 180), f'Quarter {i}', 0)
+                          for i in range(size // 5)]
+        countries = [f'Country {i}' for i in range(250)]
+
+        started = time.perf_counter()
+        built = Gazetteer.from_records(places, neighbourhoods, countries)
+        build_time = time.perf_counter() - started
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'gazetteer.bin')
+            built.save(path)
+            file_size = os.path.getsize(path)
+            started = time.perf_counter()
+            gazetteer = Gazetteer.load(path)
+            load_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for lat, lon in queries:
+            gazetteer.reverse(lat, lon)
+        elapsed = time.perf_counter() - started
+        rows.append((size, f'{build_time:.2f}', f'{load_time * 1000:.1f}', f'{file_size / 1024:.0f}',
+                     f'{lookups / elapsed:,.0f}'))
+    print_table(('places', 'build s', 'load ms', 'file KiB', 'lookups/s'), rows)
+
+
+def synthetic_track(size, rng):
+    """Walk at ~1.4 m/s with a fix every 5 s and GPS jitter, stopping for a few minutes now and then"""
+    lat, lon = 45.4642, 9.19
+    heading = rng.uniform(0, 2 * math.pi)
+    start = datetime(2024, 5, 1, 8, 0)
+    rows = []
+    stopped_for = 0
+    for i in range(size):
+        if stopped_for:
+            stopped_for -= 1
+        elif rng.random() < 0.005:
+            stopped_for = rng.randint(30, 120)
+        else:
+            heading += rng.gauss(0, 0.3)
+            lat += 7 * math.cos(heading) / 111320
+            lon += 7 * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+        jitter = rng.gauss(0, 3) / 111320
+        rows.append((lat + jitter, lon + jitter, 8.0, start + timedelta(seconds=5 * i)))
+    return rows
+
+
+def bench_tracks(args):
+    """Server-side simplification of get_user_positions tracks: time, points kept and payload size"""
+    rng = random.Random(42)
+    rows = []
+    for size in args.sizes:
+        track_rows = synthetic_track(size, rng)
+        full_json = len(json.dumps([{'latitude': r[0], 'longitude': r[1], 'accuracy': r[2],
+                                     'timestamp': r[3].isoformat()} for r in track_rows]))
+        for tolerance_m, max_points in ((5, None), (5, 200), (None, 200)):
+            started = time.perf_counter()
+            track = Track.from_rows(track_rows)
+            stops = stop_points(track)
+            kept = simplify(track, tolerance_m, max_points, keep=stops)
+            elapsed = time.perf_counter() - started
+            kept_json = len(json.dumps([{'latitude': track_rows[i][0], 'longitude': track_rows[i][1],
+                                         'accuracy': track_rows[i][2], 'timestamp': track_rows[i][3].isoformat()}
+                                        for i in kept]))
+            rows.append((size, tolerance_m if tolerance_m is not None else '-', max_points or '-', len(stops),
+                         len(kept), f'{elapsed * 1000:.1f}', f'{full_json / 1024:.0f}', f'{kept_json / 1024:.1f}'))
+    print_table(('points', 'tol m', 'max', 'stops', 'kept', 'ms', 'full KiB', 'kept KiB'), rows)
+
+
+def bench_formats(args):
+    """get_user_positions payload per format: size raw and gzipped, time to encode and to parse"""
+    rng = random.Random(42)
+    rows = []
+    for size in args.sizes:
+        track_rows = [(*r, None) for r in synthetic_track(size, rng)]
+        for fmt in TRACK_FORMATS:
+            started = time.perf_counter()
+            if fmt == 'json':
+                payload = {'positions': [{'latitude': r[0], 'longitude': r[1], 'accuracy': r[2],
+                                          'timestamp': r[3].isoformat(), 'last_seen': None}
+                                         for r in track_rows]}
+            else:
+                payload = {'format': fmt, 'track': encode_track(track_rows, fmt)}
+            body = json.dumps(payload).encode()
+            encode_time = time.perf_counter() - started
+            started = time.perf_counter()
+            json.loads(body)
+            parse_time = time.perf_counter() - started
+            rows.append((size, fmt, f'{len(body) / 1024:.1f}', f'{len(zlib.compress(body)) / 1024:.1f}',
+                         f'{len(body) / size:.1f}', f'{encode_time * 1000:.1f}', f'{parse_time * 1000:.2f}'))
+    print_table(('points', 'format', 'KiB', 'gzip KiB', 'B/point', 'encode ms', 'parse ms'), rows)
+
+
+def bench_nearby(args):
+    """
+    Spatial grid vs a linear scan for participants spread over a 5 km square:
+    microseconds per radius (200 m) and k-nearest (k=10) query
+    """
+    rng = random.Random(42)
+    span = 5000 / 111320
+    lookups = 200
+    rows = []
+    for size in args.sizes:
+        grid = GridIndex(app.config['SPATIAL_CELL_M'])
+        points = {}
+        for i in range(size):
+            lat = 45.45 + rng.uniform(0, span)
+            lon = 9.17 + rng.uniform(0, span * 1.4)
+            grid.update(i, lat, lon)
+            points[i] = (lat, lon)
+        queries = [(45.45 + rng.uniform(0, span), 9.17 + rng.uniform(0, span * 1.4)) for _ in range(lookups)]
+
+        timings = []
+        for radius_m, k in ((200, None), (None, 10)):
+            started = time.perf_counter()
+            found = sum(len(grid.nearby(lat, lon, radius_m, k)) for lat, lon in queries)
+            grid_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for lat, lon in queries:
+                distances = sorted(haversine_m(lat, lon, *p) for p in points.values())
+                _ = [d for d in distances if d <= radius_m] if radius_m else distances[:k]
+            scan_time = time.perf_counter() - started
+            timings += [f'{found / lookups:.1f}', f'{grid_time / lookups * 1e6:.0f}', f'{scan_time / lookups * 1e6:.0f}']
+        rows.append((size, *timings))
+    print_table(('participants', 'in 200 m', 'grid us', 'scan us', 'k', 'grid us', 'scan us'), rows)
+
+
+def bench_proximity(args):
+    """
+    Proximity alerts for participants random-walking in a 2 km square, every one
+    moving once per tick: ms per tick and alerts raised, for the grid-based check of
+    the mover only, with and without hysteresis, against checking every pair. A first,
+    untimed tick finds the pairs that start out near each other.
+    """
+    rng = random.Random(42)
+    span = 2000 / 111320
+    ticks = 10
+    enter_m, exit_m = app.config['PROXIMITY_ALERT_RADIUS_M'], app.config['PROXIMITY_RELEASE_RADIUS_M']
+    rows = []
+    for size in args.sizes:
+        start = [(45.45 + rng.uniform(0, span), 9.17 + rng.uniform(0, span * 1.4)) for _ in range(size)]
+        steps = [[(rng.gauss(0, 5) / 111320, rng.gauss(0, 5) / 78000) for _ in range(size)] for _ in range(ticks + 1)]
+
+        for label, exit_radius in (('grid', exit_m), ('grid, no hysteresis', enter_m), ('all pairs', None)):
+            positions = list(start)
+            grid = GridIndex(app.config['SPATIAL_CELL_M'])
+            monitor = ProximityMonitor(enter_m, exit_radius or exit_m, cooldown_s=0)
+            near = set()
+            alerts = 0
+            for i, (lat, lon) in enumerate(positions):
+                grid.update(i, lat, lon)
+            for tick in range(ticks + 1):
+                if tick == 1:
+                    alerts = 0
+                    started = time.perf_counter()
+                for i in range(size):
+                    lat, lon = positions[i]
+                    lat, lon = lat + steps[tick][i][0], lon + steps[tick][i][1]
+                    positions[i] = (lat, lon)
+                    if exit_radius is None:
+                        # Every pair involving the mover, entering within enter_m and leaving beyond exit_m
+                        for j, (other_lat, other_lon) in enumerate(positions):
+                            if j == i:
+                                continue
+                            pair = (min(i, j), max(i, j))
+                            distance = haversine_m(lat, lon, other_lat, other_lon)
+                            if distance <= enter_m and pair not in near:
+                                near.add(pair)
+                                alerts += 1
+                            elif distance > exit_m:
+                                near.discard(pair)
+                    else:
+                        grid.update(i, lat, lon)
+                        neighbours = [(d, key) for d, key, _, _, _ in grid.nearby(lat, lon, monitor.exit_m)]
+                        alerts += len(monitor.update(0, i, neighbours))
+            elapsed = time.perf_counter() - started
+            rows.append((size, label, f'{elapsed / ticks * 1000:.1f}', f'{elapsed / ticks / size * 1e6:.0f}',
+                         f'{alerts / ticks:.1f}'))
+    print_table(('participants', 'check', 'ms/tick', 'us/update', 'alerts/tick'), rows)
+
+
+def stationary_heavy_fixes(count, rng, start_ms):
+    """A fix every 5 s for ``count`` fixes: mostly standing around (GPS jitter), sometimes walking"""
+    lat, lon = 45.4642 + rng.uniform(-0.01, 0.01), 9.19 + rng.uniform(-0.01, 0.01)
+    heading = rng.uniform(0, 2 * math.pi)
+    walking = False
+    fixes = []
+    for i in range(count):
+        if rng.random() < (0.1 if walking else 0.02):
+            walking = not walking
+        if walking:
+            heading += rng.gauss(0, 0.3)
+            lat += 7 * math.cos(heading) / 111320
+            lon += 7 * math.sin(heading) / 111320 / math.cos(math.radians(lat))
+        accuracy = rng.uniform(8, 20)
+        fixes.append({
+            'latitude': lat + rng.gauss(0, accuracy / 3) / 111320,
+            'longitude': lon + rng.gauss(0, accuracy / 3) / 111320 / math.cos(math.radians(lat)),
+            'accuracy': accuracy,
+            'timestamp': start_ms + i * 5000,
+            'seq': i + 1
+        })
+    return fixes
+
+
+def bench_ingest(args):
+    """Rows stored for an hour of stationary-heavy sharing, with and without stationary suppression"""
+    fixes_per_participant = 720  # one hour at one fix every 5 s
+    rows = []
+    for size in args.sizes:
+        for enabled in (False, True):
+            app.config['STATIONARY_FILTER_ENABLED'] = enabled
+            stationary_filter.clear()
+            rng = random.Random(size)
+            with fresh_database():
+                creator = create_user('bench_creator')
+                db.session.commit()
+                names = [create_user(f'bench_sharer_{i}').username for i in range(size)]
+                db.session.commit()
+            owner = logged_in_client('bench_creator')
+            code = owner.post('/api/create_session', json={'session_name': 'Ingest'}).get_json()['session']['session_code']
+            clients = []
+            for name in names:
+                client = logged_in_client(name)
+                client.post('/api/join_session', json={'session_code': code})
+                clients.append(client)
+
+            start_ms = (time.time() - 3600) * 1000
+            uploads = [(client, stationary_heavy_fixes(fixes_per_participant, rng, start_ms)) for client in clients]
+            started = time.perf_counter()
+            # The page flushes its buffer every 20 s, i.e. four fixes per batch
+            for offset in range(0, fixes_per_participant, 4):
+                for client, fixes in uploads:
+                    batch = fixes[offset:offset + 4]
+                    client.post('/api/update_locations_batch', json={'sent_at': batch[-1]['timestamp'], 'fixes': batch})
+            elapsed = time.perf_counter() - started
+            with app.app_context():
+                locations = Location.query.count()
+                positions = UserPosition.query.count()
+            rows.append((size, 'on' if enabled else 'off', size * fixes_per_participant, locations, positions,
+                         f'{elapsed:.1f}'))
+    app.config['STATIONARY_FILTER_ENABLED'] = True
+    print_table(('sharers', 'suppression', 'fixes', 'locations', 'user_positions', 's'), rows)
+
+
+def seed_sessions(participant_count, per_session=20):
+    """Active sessions of ``per_session`` guests; returns [(session_code, [(participant_id, cookie)])]"""
+    owner = create_user(f'bench_owner_{participant_count}')
+    serializer = app.session_interface.get_signing_serializer(app)
+    sessions = []
+    for s_index in range((participant_count + per_session - 1) // per_session):
+        s = Session(session_code=f'G{participant_count:04d}{s_index:04d}'[:10], creator_id=owner.id,
+                    session_name=f'Gateway {s_index}')
+        db.session.add(s)
+        db.session.flush()
+        members = []
+        for i in range(min(per_session, participant_count - s_index * per_session)):
+            p = SessionParticipant(session_id=s.id, guest_name=f'guest{i}')
+            db.session.add(p)
+            db.session.flush()
+            members.append((p.id, serializer.dumps({'participant_id': p.id})))
+        sessions.append((s.session_code, members))
+    db.session.commit()
+    return sessions
+
+
+def run_gateway_clients(port_queue, result_queue, sessions, duration, interval):
+    """Child process: one WebSocket per participant, each sending a fix every ``interval`` seconds"""
+    from websockets.asyncio.client import connect
+
+    async def main(port):
+        latencies = []
+        received = 0
+        connections = []
+        for code, members in sessions:
+            url = f'ws://127.0.0.1:{port}/ws/sessions/{code}'
+            for participant_id, cookie in members:
+                ws = await connect(url, additional_headers={'Cookie': f'session={cookie}'},
+                                   open_timeout=60, ping_interval=None, compression=None)
+                await ws.recv()  # Snapshot
+                connections.append((participant_id, ws))
+
+        async def participant(participant_id, ws, offset):
+            nonlocal received
+            sent_at = []
+
+            async def reader():
+                nonlocal received
+                async for raw in ws:
+                    received += 1
+                    message = json.loads(raw)
+                    # A participant's own update coming back is the end-to-end latency of its fix
+                    if message['type'] == 'participant' and message['data']['id'] == participant_id and sent_at:
+                        latencies.append(time.perf_counter() - sent_at.pop(0))
+
+            reading = asyncio.ensure_future(reader())
+            await asyncio.sleep(offset)
+            rng = random.Random(participant_id)
+            while time.perf_counter() < deadline:
+                sent_at.append(time.perf_counter())
+                await ws.send(json.dumps({'type': 'location', 'latitude': 45.46 + rng.uniform(0, 0.01),
+                                          'longitude': 9.19, 'accuracy': 10}))
+                await asyncio.sleep(interval)
+            await asyncio.sleep(1)
+            reading.cancel()
+            await ws.close()
+
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(participant(pid, ws, i * interval / len(connections))
+                               for i, (pid, ws) in enumerate(connections)))
+        return len(connections), received, sorted(latencies)
+
+    result_queue.put(asyncio.run(main(port_queue.get())))
+
+
+def bench_gateway(args):
+    """
+    WebSocket gateway load test: N participants in sessions of 20, each sending a fix
+    every 5 s over the gateway for 15 s, clients in a separate process. Reports fan-out,
+    fix round-trip latency and gateway process CPU, next to the CPU the HTTP design
+    (update_location per fix, get_participants every 3 s) needs for the same load and
+    the threads it keeps parked (one SSE stream and one notification long-poll each).
+    """
+    duration, interval = 15, 5
+    context = multiprocessing.get_context('fork')
+    rows = []
+    for size in args.sizes:
+        with fresh_database():
+            sessions = seed_sessions(size)
+        stationary_filter.clear()
+
+        # Fork the clients before the gateway starts any threads
+        port_queue, result_queue = context.Queue(), context.Queue()
+        clients = context.Process(target=run_gateway_clients,
+                                  args=(port_queue, result_queue, sessions, duration, interval))
+        clients.start()
+        gateway = start_websocket_gateway(port=0)
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        port_queue.put(gateway.port)
+        connected, received, latencies = result_queue.get()
+        gateway_cpu = (time.process_time() - cpu_started) / (time.perf_counter() - wall_started)
+        clients.join()
+        gateway.stop()
+
+        # The same fixes and 3-second polls through Flask, timed in-process
+        with fresh_database():
+            sessions = seed_sessions(size)
+        stationary_filter.clear()
+        participants_snapshots.clear()
+        cookie_name = app.config['SESSION_COOKIE_NAME']
+        clients_by_code = []
+        for code, members in sessions[:max(1, len(sessions) // 5)]:  # A sample of sessions is enough
+            http_clients = []
+            for _, cookie in members:
+                client = app.test_client()
+                client.set_cookie(cookie_name, cookie)
+                http_clients.append(client)
+            clients_by_code.append((code, http_clients))
+        sampled = sum(len(c) for _, c in clients_by_code)
+        simulated = 15
+        cpu_started = time.process_time()
+        for second in range(simulated):
+            for code, http_clients in clients_by_code:
+                for i, client in enumerate(http_clients):
+                    if (second + i) % interval == 0:
+                        client.post('/api/update_location', json={'latitude': 45.46 + random.uniform(0, 0.01),
+                                                                  'longitude': 9.19, 'accuracy': 10})
+                    if (second + i) % 3 == 0:
+                        client.get(f'/api/get_participants?code={code}')
+        polling_cpu = (time.process_time() - cpu_started) / simulated * size / sampled
+
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float('nan')
+        rows.append((size, connected, f'{received / duration:,.0f}', f'{p50:.1f}', f'{p95:.1f}',
+                     f'{gateway_cpu:.0%}', f'{polling_cpu:.0%}', 2 * size))
+    print_table(('participants', 'connected', 'msgs/s out', 'p50 ms', 'p95 ms', 'gateway cpu',
+                 'http cpu', 'http parked threads'), rows)
+
+
+def start_server(workers, threads):
+    """serve.py on a free port against the scratch database; returns (process, port)"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, WEBSOCKET_ENABLED='false')
+    process = subprocess.Popen(
+        [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(port), '--http',
+         '--workers', str(workers), '--threads', str(threads), '--graceful-timeout', '1'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('serve.py did not start')
+
+
+def bench_serve(args):
+    """
+    serve.py under the session page's HTTP load. ``--sizes`` are threads per process,
+    each run with 1 and 2 worker processes. 32 clients loop over get_participants
+    (sending If-None-Match, as browsers do) and update_location in the page's 3 s : 5 s
+    ratio, while 16 more keep notification long-polls open, for 10 s per run.
+    """
+    duration, polling, parked = 10, 32, 16
+    with fresh_database():
+        [(code, members)] = seed_sessions(polling + parked, per_session=polling + parked)
+        # The server processes own the scratch database from here on
+        db.engine.dispose()
+    rows = []
+    for threads in args.sizes:
+        for workers in (1, 2):
+            process, port = start_server(workers, threads)
+            stop = threading.Event()
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+
+            def poller(cookie, rng):
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                etag = None
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    try:
+                        if rng.random() < 5 / 8:
+                            headers = {'Cookie': f'session={cookie}'}
+                            if etag:
+                                headers['If-None-Match'] = etag
+                            conn.request('GET', f'/api/get_participants?code={code}', headers=headers)
+                        else:
+                            body = json.dumps({'latitude': 45.46 + rng.uniform(0, 0.01),
+                                               'longitude': 9.19 + rng.uniform(0, 0.01), 'accuracy': 10})
+                            conn.request('POST', '/api/update_location', body=body,
+                                         headers={'Cookie': f'session={cookie}', 'Content-Type': 'application/json'})
+                        response = conn.getresponse()
+                        response.read()
+                        etag = response.getheader('ETag') or etag
+                        ok = response.status < 400
+                    except (OSError, http.client.HTTPException):
+                        conn.close()
+                        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                        ok = False
+                    with lock:
+                        if ok:
+                            latencies.append(time.perf_counter() - started)
+                        elif not stop.is_set():  # Not the server shutting down under it
+                            errors[0] += 1
+
+            def holder(cookie):
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                while not stop.is_set():
+                    try:
+                        conn.request('GET', '/api/get_notifications?wait=25', headers={'Cookie': f'session={cookie}'})
+                        conn.getresponse().read()
+                    except (OSError, http.client.HTTPException):
+                        return
+
+            clients = [threading.Thread(target=holder, args=(cookie,), daemon=True) for _, cookie in members[polling:]]
+            clients += [threading.Thread(target=poller, args=(cookie, random.Random(pid)), daemon=True)
+                        for pid, cookie in members[:polling]]
+            for t in clients:
+                t.start()
+            time.sleep(duration)
+            stop.set()
+            process.send_signal(signal.SIGTERM)
+            process.wait()
+            for t in clients:
+                t.join(timeout=5)
+
+            latencies.sort()
+            rate = len(latencies) / duration
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+            p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float('nan')
+            # The session page polls participants every 3 s and sends a fix every 5 s
+            rows.append((workers, threads, f'{rate:,.0f}', f'{p50:.1f}', f'{p95:.1f}', errors[0],
+                         f'{rate / (1 / 3 + 1 / 5):,.0f}'))
+    print_table(('workers', 'threads', 'req/s', 'p50 ms', 'p95 ms', 'errors', 'pollers served'), rows)
+
+
+def bench_writes(args):
+    """
+    update_location's write path under N concurrent sharers, each sending a moving fix
+    once a second (or straight away when running late) for 10 s: a transaction per
+    fix vs the group-commit writer. Offered load is N fixes per second.
+    """
+    duration = 10
+    rows = []
+    for size in args.sizes:
+        for grouped in (False, True):
+            with fresh_database():
+                [(_, members)] = seed_sessions(size, per_session=size)
+            stationary_filter.clear()
+            writer = GroupCommitWriter(
+                app_module.write_fixes,
+                max_batch=app.config['LOCATION_GROUP_COMMIT_MAX_ROWS'],
+                max_delay_s=app.config['LOCATION_GROUP_COMMIT_DELAY_MS'] / 1000
+            ) if grouped else None
+            app_module.location_writer = writer
+            latencies, errors = [], [0]
+            lock = threading.Lock()
+            started = time.perf_counter()
+            deadline = started + duration
+
+            def sharer(participant_id, rng):
+                due = started + rng.random()
+                latitude, longitude = 45.46 + rng.uniform(0, 0.05), 9.19 + rng.uniform(0, 0.05)
+                while True:
+                    time.sleep(max(0, due - time.perf_counter()))
+                    if time.perf_counter() >= deadline:
+                        return
+                    latitude += 0.001  # ~110 m, never merged as stationary
+                    sent = time.perf_counter()
+                    try:
+                        with app.app_context():
+                            app_module.store_location(participant_id, latitude, longitude, 10)
+                        ok = True
+                    except Exception:
+                        ok = False
+                    with lock:
+                        if ok:
+                            latencies.append(time.perf_counter() - sent)
+                        else:
+                            errors[0] += 1
+                    due += 1
+
+            threads = [threading.Thread(target=sharer, args=(pid, random.Random(pid)))
+                       for pid, _ in members]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - started
+            if writer:
+                writer.stop()
+
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+            p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float('nan')
+            batch = f'{writer.items / writer.batches:.1f}' if writer and writer.batches else '1'
+            rows.append((size, 'group' if grouped else 'per request', f'{len(latencies) / elapsed:,.0f}',
+                         f'{p50:.1f}', f'{p95:.1f}', errors[0], batch))
+    app_module.location_writer = None
+    print_table(('sharers', 'commit', 'writes/s', 'p50 ms', 'p95 ms', 'errors', 'fixes/commit'), rows)
+
+
+# SQLite as it was before storage.py: rollback journal, fsync on every commit,
+# pysqlite's 5 s busy timeout, 2 MiB page cache, no mmap
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+    'busy_timeout': 5000,
+    'cache_size': -2000,
+    'mmap_size': 0,
+    'temp_store': 'DEFAULT',
+}
+
+
+def bench_storage(args):
+    """
+    Readers vs writers on one database file, default SQLite settings vs the
+    SQLITE_PRAGMAS profile. ``--sizes`` concurrent clients for 10 s: half rebuild the
+    get_participants response of a 50-participant session (bypassing the snapshot
+    cache), half store a moving fix each in its own transaction (group commit off).
+    Also times bare one-row commits, where the two profiles differ most.
+    """
+    duration = 10
+    pragmas = app.config['SQLITE_PRAGMAS']
+    tuned = dict(pragmas)
+    rows = []
+    commit_rows = []
+    for profile, settings in (('default', DEFAULT_PRAGMAS), ('tuned', tuned)):
+        path = _scratch.name + '.commits'
+        conn = sqlite3.connect(path)
+        for name, value in settings.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn.execute("CREATE TABLE t (x INTEGER)")
+        conn.commit()
+        started = time.perf_counter()
+        for i in range(1000):
+            conn.execute("INSERT INTO t VALUES (?)", (i,))
+            conn.commit()
+        commit_rows.append((profile, f'{1000 / (time.perf_counter() - started):,.0f}'))
+        conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+    print_table(('profile', 'commits/s'), commit_rows)
+    print()
+    try:
+        for size in args.sizes:
+            for profile, settings in (('default', DEFAULT_PRAGMAS), ('tuned', tuned)):
+                # The connect hook reads this dict, so new connections get the profile
+                pragmas.clear()
+                pragmas.update(settings)
+                with app.app_context():
+                    db.engine.dispose()
+                with fresh_database():
+                    [(code, members)] = seed_sessions(50, per_session=50)
+                stationary_filter.clear()
+                app_module.location_writer = None
+                stop = threading.Event()
+                timings = {'read': [], 'write': []}
+                errors = [0]
+                lock = threading.Lock()
+
+                def client(kind, participant_id, rng):
+                    latitude = 45.46 + rng.uniform(0, 0.05)
+                    while not stop.is_set():
+                        started = time.perf_counter()
+                        try:
+                            with app.app_context():
+                                if kind == 'read':
+                                    app_module.build_participants_snapshot(code)
+                                else:
+                                    latitude += 0.001
+                                    app_module.store_location(participant_id, latitude, 9.19, 10)
+                            ok = True
+                        except Exception:
+                            ok = False
+                        with lock:
+                            if ok:
+                                timings[kind].append(time.perf_counter() - started)
+                            else:
+                                errors[0] += 1
+
+                threads = [threading.Thread(target=client, args=('read' if i % 2 else 'write', pid, random.Random(pid)))
+                           for i, (pid, _) in enumerate(members[:size] * (size // len(members) + 1))][:size]
+                for t in threads:
+                    t.start()
+                time.sleep(duration)
+                stop.set()
+                for t in threads:
+                    t.join()
+
+                row = [size, profile]
+                for kind in ('read', 'write'):
+                    values = sorted(timings[kind])
+                    p95 = values[int(len(values) * 0.95)] * 1000 if values else float('nan')
+                    row += [f'{len(values) / duration:,.0f}', f'{p95:.1f}']
+                rows.append(tuple(row) + (errors[0],))
+    finally:
+        pragmas.clear()
+        pragmas.update(tuned)
+        app_module.location_writer = None
+    print_table(('clients', 'profile', 'reads/s', 'read p95 ms', 'writes/s', 'write p95 ms', 'errors'), rows)
+
+
+# Tables whose rows for a session move to session_archives
+ARCHIVED_TABLES = ('session_participants', 'locations', 'participant_last_positions', 'notifications')
+
+
+def table_bytes(tables):
+    """Bytes of table and index pages per table (SQLite dbstat)"""
+    with db.engine.connect() as conn:
+        sizes = dict(conn.exec_driver_sql(
+            "SELECT m.tbl_name, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name "
+            "GROUP BY m.tbl_name"
+        ).fetchall())
+    return sum(sizes.get(table, 0) for table in tables)
+
+
+def bench_archive(args):
+    """
+    ``--sizes`` ended sessions of 10 participants (8 registered, 2 guests) with 100
+    fixes each, archived by run_archive: hot table + index size before and after,
+    archive size per point, archiving time, and review latency (participant list
+    plus one track) from the hot tables vs from the archive
+    """
+    rng = random.Random(42)
+    rows = []
+    for size in args.sizes:
+        with fresh_database():
+            upgrade_schema(db.engine)  # Incremental auto_vacuum, as in production
+            creator = create_user(f'bench_archive_{size}')
+            users = [create_user(f'bench_archive_{size}_{i}') for i in range(40)]
+            db.session.commit()
+            start = datetime.utcnow() - timedelta(days=30)
+            codes = []
+            for i in range(size):
+                began = start + timedelta(hours=i)
+                s = Session(session_code=f'A{i:07d}', creator_id=creator.id, session_name=f'Archive {i}',
+                            created_at=began, is_active=False, ended_at=began + timedelta(minutes=10))
+                db.session.add(s)
+                db.session.flush()
+                codes.append(s.session_code)
+                members = [SessionParticipant(session_id=s.id, user_id=users[(i + j) % len(users)].id,
+                                              joined_at=began, is_active=False) for j in range(8)]
+                members += [SessionParticipant(session_id=s.id, guest_name=f'guest{j}', joined_at=began,
+                                               is_active=False) for j in range(2)]
+                db.session.add_all(members)
+                db.session.flush()
+                locations, positions, last = [], [], []
+                for p in members:
+                    track = synthetic_track(100, rng)
+                    for latitude, longitude, accuracy, timestamp in track:
+                        timestamp = began + (timestamp - track[0][3])
+                        locations.append({'participant_id': p.id, 'latitude': latitude, 'longitude': longitude,
+                                          'accuracy': accuracy, 'timestamp': timestamp})
+                        if p.user_id:
+                            positions.append({'user_id': p.user_id, 'latitude': latitude, 'longitude': longitude,
+                                              'accuracy': accuracy, 'timestamp': timestamp})
+                    last.append({'participant_id': p.id, 'latitude': latitude, 'longitude': longitude,
+                                 'accuracy': accuracy, 'timestamp': timestamp})
+                db.session.execute(db.insert(Location), locations)
+                db.session.execute(db.insert(UserPosition), positions)
+                db.session.execute(db.insert(ParticipantLastPosition), last)
+                db.session.execute(db.insert(Notification), [
+                    {'session_id': s.id, 'sender_participant_id': members[j].id, 'message': 'Alert'}
+                    for j in range(5)
+                ])
+            db.session.commit()
+            points = size * 10 * 100
+
+            client = logged_in_client(creator.username)
+            sample = [codes[k] for k in range(0, size, max(1, size // 20))]
+
+            def review_ms():
+                started = time.perf_counter()
+                for code in sample:
+                    participants = client.get(f'/api/get_all_participants_for_review?code={code}').get_json()
+                    participant_id = participants['participants'][0]['id']
+                    client.get(f'/api/get_user_positions?participant_id={participant_id}'
+                               f'&session_code={code}&review_mode=true')
+                return (time.perf_counter() - started) * 1000 / len(sample)
+
+            review_ms()  # Warm up
+            hot_review = review_ms()
+            hot_before = table_bytes(ARCHIVED_TABLES)
+
+            app.config['ARCHIVE_BATCH_SESSIONS'] = size
+            started = time.perf_counter()
+            result = run_archive()
+            archive_time = time.perf_counter() - started
+            assert result['sessions'] == size
+            db.session.expire_all()  # Test client requests share this app context's session
+
+            archived_review = review_ms()
+            hot_after = table_bytes(ARCHIVED_TABLES)
+            archive_bytes = table_bytes(('session_archives',))
+            blob_bytes = db.session.query(db.func.sum(db.func.length(SessionArchive.track))).scalar()
+            rows.append((size, f'{points:,}', f'{hot_before / 2**20:.1f}', f'{hot_after / 2**20:.2f}',
+                         f'{archive_bytes / 2**20:.2f}', f'{blob_bytes / points:.1f}',
+                         f'{archive_time / size * 1000:.1f}', f'{hot_review:.1f}', f'{archived_review:.1f}'))
+            db.engine.dispose()
+    print_table(('sessions', 'points', 'hot MiB', 'hot MiB after', 'archive MiB', 'B/point', 'ms/session',
+                 'review ms hot', 'review ms archived'), rows)
+
+
+BENCHMARKS = {
+    'history': bench_history,
+    'participants': bench_participants,
+    'geocode': bench_geocode,
+    'gazetteer': bench_gazetteer,
+    'tracks': bench_tracks,
+    'ingest': bench_ingest,
+    'gateway': bench_gateway,
+    'serve': bench_serve,
+    'writes': bench_writes,
+    'storage': bench_storage,
+    'archive': bench_archive,
+    'formats': bench_formats,
+    'nearby': bench_nearby,
+    'proximity': bench_proximity,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hunt-Hunt-Planur benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--sizes', default='10,100,200',
+                        type=lambda v: [int(x) for x in v.split(',')],
+                        help='comma-separated problem sizes')
+    args = parser.parse_args()
+    try:
+        BENCHMARKS[args.benchmark](args)
+    finally:
+        os.unlink(_scratch.name)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,39 @@ class Config:
         'sqlite:///' + os.path.join(BASE_DIR, 'hunt_planur.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Production server (serve.py): gunicorn worker processes x threads per process.
+    # Event streams, the participants snapshot cache, the spatial grid and WebSocket rooms
+    # live in one process; with SERVE_WORKERS > 1 they fall back to the database instead
+    SERVE_WORKERS = int(os.environ.get('SERVE_WORKERS') or 1)
+    SERVE_THREADS = int(os.environ.get('SERVE_THREADS') or 100)
+    # Seconds a SQLite writer waits for another thread or process to release the lock
+    SQLITE_BUSY_TIMEOUT = 30
+    # Connections kept open per process. Most serving threads sit in event streams and
+    # held long-polls, which hold no connection, so this only has to cover the requests
+    # inside a query at once plus the location writer, gateway and background workers.
+    # Bursts open up to as many again, closed as soon as they are returned
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE') or 16)
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': SQLITE_POOL_SIZE, 'max_overflow': SQLITE_POOL_SIZE}
+    
+    # SQLite storage profile (storage.py), set on every new connection. WAL lets readers
+    # run alongside the writer; synchronous=NORMAL syncs at checkpoints rather than every
+    # commit, which with WAL can only lose the last commits on power loss, never corrupt.
+    # cache_size is per connection, in KiB when negative: at most 2 x SQLITE_POOL_SIZE x
+    # 8 MiB = 256 MiB of page cache per worker process, 128 MiB once bursts are over.
+    # The mmap'd file is the OS page cache, shared by every connection and process
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': SQLITE_BUSY_TIMEOUT * 1000,
+        'cache_size': -8192,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    }
+    # Planner statistics are refreshed (ANALYZE, then PRAGMA optimize) this often, and
+    # pages freed by retention are returned to the filesystem this many at a time
+    SQLITE_OPTIMIZE_INTERVAL_SECONDS = 3600
+    SQLITE_VACUUM_CHUNK_PAGES = 1000
+    
     # Session configuration
     SESSION_COOKIE_SAMESITE = 'Lax'
     SESSION_COOKIE_HTTPONLY = True
@@ -26,6 +59,111 @@ class Config:
     # CORS configuration
     CORS_SUPPORTS_CREDENTIALS = True
     
+    # Longest a /api/get_notifications?wait=N request may be held open (seconds)
+    NOTIFICATION_MAX_WAIT = 30
+    # With several worker processes an alert stored by another process does not wake a
+    # held request, so it rereads the database this often (seconds) while held
+    NOTIFICATION_RECHECK_SECONDS = 2
+    
+    # Seconds without a fix before a participant shows as offline
+    ONLINE_TIMEOUT_SECONDS = 30
+    
+    # Upper bound on how long a cached /api/get_participants snapshot is served
+    # (it is normally replaced sooner, on the next change in its session)
+    PARTICIPANTS_CACHE_MAX_AGE = 60
+    
+    # Spatial grid over current positions (/api/sessions/<code>/nearby): cell height in
+    # metres, and the most participants one query returns
+    SPATIAL_CELL_M = 250
+    NEARBY_MAX_RESULTS = 100
+    
+    # Automatic proximity alerts, checked for the participant who moved: 'off', 'creator'
+    # (someone reaches the session creator) or 'all' (any two participants). A pair alerts
+    # within PROXIMITY_ALERT_RADIUS_M, then only again after moving apart beyond
+    # PROXIMITY_RELEASE_RADIUS_M and at most once per PROXIMITY_ALERT_COOLDOWN_SECONDS
+    PROXIMITY_ALERTS = os.environ.get('PROXIMITY_ALERTS') or 'off'
+    PROXIMITY_ALERT_RADIUS_M = 50
+    PROXIMITY_RELEASE_RADIUS_M = 100
+    PROXIMITY_ALERT_COOLDOWN_SECONDS = 600
+    
+    # WebSocket gateway (ws_gateway.py): participants send fixes and receive participant
+    # changes and alerts over one connection to /ws/sessions/<code> on this port
+    WEBSOCKET_ENABLED = (os.environ.get('WEBSOCKET_ENABLED') or 'true').lower() == 'true'
+    WEBSOCKET_PORT = int(os.environ.get('WEBSOCKET_PORT') or 5001)
+    WEBSOCKET_WORKERS = 4  # Threads for the gateway's database work
+    
+    # Group commit: fixes from concurrent update_location requests (and the WebSocket
+    # gateway) are written by one thread, up to LOCATION_GROUP_COMMIT_MAX_ROWS per
+    # transaction, waiting at most LOCATION_GROUP_COMMIT_DELAY_MS for more to arrive.
+    # A request gives up (503) after LOCATION_GROUP_COMMIT_TIMEOUT_SECONDS
+    LOCATION_GROUP_COMMIT = (os.environ.get('LOCATION_GROUP_COMMIT') or 'true').lower() == 'true'
+    LOCATION_GROUP_COMMIT_MAX_ROWS = 200
+    LOCATION_GROUP_COMMIT_DELAY_MS = 2
+    LOCATION_GROUP_COMMIT_TIMEOUT_SECONDS = 5
+    
+    # Most fixes accepted by one /api/update_locations_batch request
+    LOCATION_BATCH_MAX = 500
+    
+    # Stationary-fix suppression at ingest: a fix within the reported accuracy (clamped to
+    # STATIONARY_MIN/MAX_RADIUS_M) of the last stored one extends that row's last_seen
+    # instead of adding a row, but a new row is still stored every STATIONARY_MAX_INTERVAL_SECONDS
+    STATIONARY_FILTER_ENABLED = True
+    STATIONARY_MIN_RADIUS_M = 10
+    STATIONARY_MAX_RADIUS_M = 100
+    STATIONARY_MAX_INTERVAL_SECONDS = 300
+    
+    # Session history pagination (/api/get_all_sessions_history?limit=N)
+    HISTORY_PAGE_SIZE = 20
+    HISTORY_PAGE_MAX = 100
+    
+    # Position history retention, enforced by the background worker / `flask prune-history`
+    RETENTION_LOCATIONS_PER_PARTICIPANT = 100
+    RETENTION_POSITIONS_PER_USER = 1000
+    RETENTION_INTERVAL_SECONDS = 300
+    RETENTION_CHUNK_SIZE = 500
+    
+    # Cold archive: ARCHIVE_AFTER_SECONDS after a session ends, each participant's track is
+    # packed into session_archives and the session's participant, location and notification
+    # rows are deleted; the worker archives up to ARCHIVE_BATCH_SESSIONS sessions per pass
+    ARCHIVE_ENABLED = (os.environ.get('ARCHIVE_ENABLED') or 'true').lower() == 'true'
+    ARCHIVE_AFTER_SECONDS = 600
+    ARCHIVE_INTERVAL_SECONDS = 300
+    ARCHIVE_BATCH_SESSIONS = 50
+    
+    # Track simplification (/api/get_user_positions?tolerance_m=&max_points=): a stop is
+    # staying within TRACK_STOP_RADIUS_M for TRACK_STOP_MIN_SECONDS; stops are always kept
+    TRACK_STOP_RADIUS_M = 25
+    TRACK_STOP_MIN_SECONDS = 120
+    
+    # Reverse geocoding for session location names: 'nominatim' or 'stub' (offline)
+    GEOCODER = os.environ.get('GEOCODER') or 'nominatim'
+    # Nominatim client: one keep-alive connection pool, NOMINATIM_RATE requests per second
+    # (bursts of NOMINATIM_BURST, waiting at most NOMINATIM_MAX_WAIT seconds for a slot);
+    # after NOMINATIM_FAILURE_THRESHOLD straight errors calls fail fast for NOMINATIM_RESET_TIMEOUT seconds
+    NOMINATIM_URL = os.environ.get('NOMINATIM_URL') or 'https://nominatim.openstreetmap.org/reverse'
+    NOMINATIM_USER_AGENT = 'Hunt-Hunt-Planur/1.0'
+    NOMINATIM_TIMEOUT = 5
+    NOMINATIM_RATE = 1.0
+    NOMINATIM_BURST = 1
+    NOMINATIM_MAX_WAIT = 30
+    NOMINATIM_FAILURE_THRESHOLD = 5
+    NOMINATIM_RESET_TIMEOUT = 60
+    # 'online' (GEOCODER only), 'offline' (gazetteer only) or 'offline_first'
+    # (gazetteer, falling back to GEOCODER where it knows no nearby place)
+    GEOCODER_MODE = os.environ.get('GEOCODER_MODE') or 'online'
+    # Compiled with `python gazetteer.py import cities1000.txt --countries countryInfo.txt`
+    GAZETTEER_PATH = os.environ.get('GAZETTEER_PATH') or os.path.join(BASE_DIR, 'gazetteer.bin')
+    GEOCODING_WORKERS = 2
+    
+    # Geocode cache: names are shared by every point in a GEOCODE_CELL_SIZE degree grid
+    # cell (~330 m, about Nominatim's zoom 14). Memory LRU in front of a SQLite file;
+    # set GEOCODE_CACHE_PATH = None to disable
+    GEOCODE_CACHE_PATH = os.environ.get('GEOCODE_CACHE_PATH') or os.path.join(BASE_DIR, 'geocode_cache.db')
+    GEOCODE_CELL_SIZE = 0.003
+    GEOCODE_CACHE_TTL = 30 * 86400  # seconds
+    GEOCODE_CACHE_MEMORY_SIZE = 1024
+    GEOCODE_CACHE_MAX_ROWS = 100000
+    
     # Google OAuth configuration
     # IMPORTANT: Set these in environment variables or .env file
     # Never commit real credentials to version control
@@ -49,6 +187,7 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
 
 # Configuration dictionary
 config = {
@@ -0,0 +1,26 @@
+"""
+Shared setup for the app-level tests: one scratch SQLite database for the whole
+run, so test modules can import the app in any order
+"""
+
+import os
+import tempfile
+
+import pytest
+
+# Point the app at a scratch database before any test module imports it
+_scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+_scratch.close()
+os.environ['DATABASE_URL'] = 'sqlite:///' + _scratch.name
+
+
+@pytest.fixture(scope='session')
+def scratch_database():
+    from app import app, db, location_writer
+
+    with app.app_context():
+        db.create_all()
+    yield
+    if location_writer:
+        location_writer.stop()
+    os.unlink(_scratch.name)
@@ -0,0 +1,251 @@
+"""
+Hunt-Hunt-Planur - Offline gazetteer
+Nearest-place lookups over a GeoNames extract, for reverse geocoding without a
+network call. Places live in flat arrays laid out as an implicit k-d tree over
+unit-sphere coordinates, so a compiled gazetteer loads without rebuilding.
+
+Usage:
+    python gazetteer.py import cities1000.txt [--countries countryInfo.txt] [-o gazetteer.bin]
+    python gazetteer.py lookup 45.4642 9.1900 [-g gazetteer.bin]
+
+Extracts are at https://download.geonames.org/export/dump/ (cities500/1000/5000/15000.zip
+and countryInfo.txt).
+"""
+
+import argparse
+import json
+import math
+import sys
+from array import array
+
+EARTH_RADIUS_KM = 6371.0
+
+MAGIC = b'HHPGAZ1\n'
+
+# GeoNames feature codes: sections of a populated place serve as neighbourhoods,
+# other populated places as the city/town/village (historical/abandoned ones are skipped)
+NEIGHBOURHOOD_CODES = {'PPLX'}
+SKIPPED_CODES = {'PPLH', 'PPLQ', 'PPLW', 'PPLCH'}
+
+
+def to_unit_vector(latitude, longitude):
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+def chord_squared(km):
+    """Squared straight-line distance between unit-sphere points ``km`` apart on the surface"""
+    return (2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)) ** 2
+
+
+class KDTree:
+    """
+    Static 3-d tree stored implicitly: for a range [lo, hi) the node is the middle
+    element, its left subtree is [lo, mid) and its right subtree is (mid, hi);
+    the split axis cycles x, y, z with depth.
+    """
+
+    def __init__(self, xs, ys, zs):
+        self.axes = (xs, ys, zs)
+        self.size = len(xs)
+
+    @staticmethod
+    def build(points):
+        """Return the order in which ``points`` [(x, y, z), ...] must be stored to form the tree"""
+        order = list(range(len(points)))
+        stack = [(0, len(order), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= 1:
+                continue
+            axis = depth % 3
+            order[lo:hi] = sorted(order[lo:hi], key=lambda i: points[i][axis])
+            mid = (lo + hi) // 2
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid + 1, hi, depth + 1))
+        return order
+
+    def nearest(self, x, y, z, max_distance_squared=math.inf):
+        """Index of the stored point closest to (x, y, z) within the limit, or -1"""
+        xs, ys, zs = self.axes
+        axes = self.axes
+        target = (x, y, z)
+        best = -1
+        best_distance = max_distance_squared
+        stack = [(0, self.size, 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            dx = xs[mid] - x
+            dy = ys[mid] - y
+            dz = zs[mid] - z
+            distance = dx * dx + dy * dy + dz * dz
+            if distance < best_distance:
+                best, best_distance = mid, distance
+
+            axis = depth % 3
+            delta = target[axis] - axes[axis][mid]
+            near, far = ((lo, mid), (mid + 1, hi)) if delta < 0 else ((mid + 1, hi), (lo, mid))
+            # Push the far side first so the near side is searched first
+            if delta * delta < best_distance:
+                stack.append((far[0], far[1], depth + 1))
+            stack.append((near[0], near[1], depth + 1))
+        return best
+
+
+class PlaceIndex:
+    """Named places in k-d order: coordinates in float arrays, one name and country per place"""
+
+    def __init__(self, xs, ys, zs, names, countries):
+        self.tree = KDTree(xs, ys, zs)
+        self.names = names
+        self.countries = countries  # index into Gazetteer.countries
+
+    @classmethod
+    def build(cls, records):
+        """``records``: [(latitude, longitude, name, country_index), ...]"""
+        points = [to_unit_vector(lat, lon) for lat, lon, _, _ in records]
+        order = KDTree.build(points)
+        return cls(
+            array('f', (points[i][0] for i in order)),
+            array('f', (points[i][1] for i in order)),
+            array('f', (points[i][2] for i in order)),
+            [records[i][2] for i in order],
+            array('H', (records[i][3] for i in order))
+        )
+
+    def nearest(self, point, max_km):
+        return self.tree.nearest(*point, max_distance_squared=chord_squared(max_km))
+
+    def __len__(self):
+        return self.tree.size
+
+
+class Gazetteer:
+    """
+    Reverse geocoder over two place indexes. Produces the same
+    "neighbourhood, city, country" string as geocoding.format_address.
+    """
+
+    def __init__(self, places, neighbourhoods, countries, place_radius_km=30, neighbourhood_radius_km=2):
+        self.places = places
+        self.neighbourhoods = neighbourhoods
+        self.countries = countries
+        self.place_radius_km = place_radius_km
+        self.neighbourhood_radius_km = neighbourhood_radius_km
+
+    def reverse(self, latitude, longitude):
+        """Location name for a point, or None if no known place is near enough"""
+        point = to_unit_vector(latitude, longitude)
+        place = self.places.nearest(point, self.place_radius_km)
+        if place < 0:
+            return None
+
+        parts = []
+        if len(self.neighbourhoods):
+            neighbourhood = self.neighbourhoods.nearest(point, self.neighbourhood_radius_km)
+            if neighbourhood >= 0:
+                parts.append(self.neighbourhoods.names[neighbourhood])
+        parts.append(self.places.names[place])
+        country = self.countries[self.places.countries[place]]
+        if country:
+            parts.append(country)
+        return ', '.join(parts)
+
+    # Building
+
+    @classmethod
+    def from_records(cls, places, neighbourhoods, countries, **kwargs):
+        """Build from [(latitude, longitude, name, country_index), ...] lists"""
+        return cls(PlaceIndex.build(places), PlaceIndex.build(neighbourhoods), countries, **kwargs)
+
+    @classmethod
+    def from_geonames(cls, cities_path, country_info_path=None, **kwargs):
+        """Build from a GeoNames cities*.txt dump and, optionally, countryInfo.txt for country names"""
+        country_names = {}
+        if country_info_path:
+            with open(country_info_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('#') or not line.strip():
+                        continue
+                    fields = line.rstrip('\n').split('\t')
+                    country_names[fields[0]] = fields[4]
+
+        countries = []
+        country_index = {}
+        places = []
+        neighbourhoods = []
+        with open(cities_path, encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 9 or fields[6] != 'P' or fields[7] in SKIPPED_CODES:
+                    continue
+                code = fields[8]
+                if code not in country_index:
+                    country_index[code] = len(countries)
+                    countries.append(country_names.get(code, code))
+                record = (float(fields[4]), float(fields[5]), fields[1], country_index[code])
+                (neighbourhoods if fields[7] in NEIGHBOURHOOD_CODES else places).append(record)
+        return cls.from_records(places, neighbourhoods, countries, **kwargs)
+
+    # Compiled file: magic, one JSON header line, then the arrays and names of each index
+
+    def save(self, path):
+        blobs = []
+        header = {'countries': self.countries, 'indexes': []}
+        for index in (self.places, self.neighbourhoods):
+            names = '\n'.join(index.names).encode('utf-8')
+            header['indexes'].append({'size': len(index), 'names_bytes': len(names)})
+            blobs.extend([*(a.tobytes() for a in index.tree.axes), index.countries.tobytes(), names])
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for blob in blobs:
+                f.write(blob)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a compiled gazetteer")
+            header = json.loads(f.readline())
+            indexes = []
+            for meta in header['indexes']:
+                size = meta['size']
+                xs, ys, zs, countries = array('f'), array('f'), array('f'), array('H')
+                for a in (xs, ys, zs, countries):
+                    a.frombytes(f.read(size * a.itemsize))
+                names = f.read(meta['names_bytes']).decode('utf-8').split('\n') if size else []
+                indexes.append(PlaceIndex(xs, ys, zs, names, countries))
+        return cls(indexes[0], indexes[1], header['countries'], **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline gazetteer for reverse geocoding')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('import', help='compile a GeoNames cities dump')
+    build.add_argument('cities', help='GeoNames cities500/1000/5000/15000.txt')
+    build.add_argument('--countries', help='GeoNames countryInfo.txt, for country names')
+    build.add_argument('-o', '--output', default='gazetteer.bin')
+
+    lookup = commands.add_parser('lookup', help='reverse geocode one point')
+    lookup.add_argument('latitude', type=float)
+    lookup.add_argument('longitude', type=float)
+    lookup.add_argument('-g', '--gazetteer', default='gazetteer.bin')
+
+    args = parser.parse_args()
+    if args.command == 'import':
+        gazetteer = Gazetteer.from_geonames(args.cities, args.countries)
+        gazetteer.save(args.output)
+        print(f"✓ {len(gazetteer.places)} places, {len(gazetteer.neighbourhoods)} neighbourhoods, "
+              f"{len(gazetteer.countries)} countries -> {args.output}")
+    else:
+        print(Gazetteer.load(args.gazetteer).reverse(args.latitude, args.longitude))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
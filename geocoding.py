@@ -0,0 +1,484 @@
+"""
+Hunt-Hunt-Planur - Reverse geocoding
+Pluggable geocoders (Nominatim, offline gazetteer, stub) plus a background queue,
+so session creation never waits on the network for a location name
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from gazetteer import Gazetteer
+
+
+def format_address(data):
+    """Build "neighbourhood, city, country" from a Nominatim reverse response"""
+    address = data.get('address', {})
+    parts = []
+
+    # Try to get neighborhood, suburb, or district
+    for key in ['neighbourhood', 'suburb', 'district', 'quarter']:
+        if key in address:
+            parts.append(address[key])
+            break
+
+    # Add city/town/village
+    for key in ['city', 'town', 'village', 'municipality']:
+        if key in address:
+            parts.append(address[key])
+            break
+
+    # Add country
+    if 'country' in address:
+        parts.append(address['country'])
+
+    if parts:
+        return ', '.join(parts)
+
+    # Fallback to display_name if no specific parts found
+    return data.get('display_name', 'Unknown Location')
+
+
+class Geocoder:
+    """Turns coordinates into a human readable location name"""
+
+    def reverse(self, latitude, longitude):
+        """Return the location name, or None if it cannot be resolved"""
+        raise NotImplementedError
+
+    def cached(self, latitude, longitude):
+        """Return the location name if it is available without a lookup, else None"""
+        return None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls()
+
+
+class TokenBucket:
+    """Allows ``rate`` acquisitions per second on average, bursts of up to ``capacity``"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Take a token, sleeping until one is available; False if that would exceed ``timeout``"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Fails fast after ``failure_threshold`` consecutive failures. Once ``reset_timeout``
+    seconds have passed a single trial call is let through; success closes the
+    circuit again, failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def release(self):
+        """Give up an allowed call without an outcome"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self.failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution of ``fn`` and its result"""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None}
+
+        if not leader:
+            call['done'].wait()
+            return call['result']
+
+        try:
+            call['result'] = fn()
+            return call['result']
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+
+class NominatimGeocoder(Geocoder):
+    """
+    OpenStreetMap Nominatim HTTP API over one keep-alive requests.Session.
+    Requests are paced by a token bucket (Nominatim's policy is 1 per second),
+    lookups for the same grid cell in flight at once share one request, and a
+    circuit breaker stops calling an upstream that keeps failing.
+    """
+
+    def __init__(self, url='https://nominatim.openstreetmap.org/reverse',
+                 user_agent='Hunt-Hunt-Planur/1.0', timeout=5, rate=1.0, burst=1,
+                 max_wait=30, failure_threshold=5, reset_timeout=60, cell_size=0.003):
+        self.url = url
+        self.timeout = timeout
+        self.max_wait = max_wait
+        self.cell_size = cell_size
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._flights = SingleFlight()
+        self.http = requests.Session()
+        self.http.headers['User-Agent'] = user_agent  # Required by Nominatim
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            url=config.get('NOMINATIM_URL', 'https://nominatim.openstreetmap.org/reverse'),
+            user_agent=config.get('NOMINATIM_USER_AGENT', 'Hunt-Hunt-Planur/1.0'),
+            timeout=config.get('NOMINATIM_TIMEOUT', 5),
+            rate=config.get('NOMINATIM_RATE', 1.0),
+            burst=config.get('NOMINATIM_BURST', 1),
+            max_wait=config.get('NOMINATIM_MAX_WAIT', 30),
+            failure_threshold=config.get('NOMINATIM_FAILURE_THRESHOLD', 5),
+            reset_timeout=config.get('NOMINATIM_RESET_TIMEOUT', 60),
+            cell_size=config.get('GEOCODE_CELL_SIZE', 0.003)
+        )
+
+    def reverse(self, latitude, longitude):
+        key = cell_key(latitude, longitude, self.cell_size)
+        return self._flights.do(key, lambda: self._request(latitude, longitude))
+
+    def _request(self, latitude, longitude):
+        if not self.breaker.allow():
+            return None
+        if not self.rate_limiter.acquire(timeout=self.max_wait):
+            # Not an upstream failure; just give back the trial slot if we held it
+            self.breaker.release()
+            print("Reverse geocoding skipped: rate limit queue is full")
+            return None
+
+        try:
+            params = {
+                'lat': latitude,
+                'lon': longitude,
+                'format': 'json',
+                'zoom': 14,  # City/town level
+                'addressdetails': 1
+            }
+            response = self.http.get(self.url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            print(f"Reverse geocoding error: {e}")
+            return None
+
+        # Throttling and server errors count against the upstream; other answers do not
+        if response.status_code == 429 or response.status_code >= 500:
+            self.breaker.record_failure()
+            print(f"Reverse geocoding error: HTTP {response.status_code}")
+            return None
+        self.breaker.record_success()
+
+        if response.status_code != 200:
+            return None
+        try:
+            return format_address(response.json())
+        except ValueError as e:
+            print(f"Reverse geocoding error: {e}")
+            return None
+
+
+class StubGeocoder(Geocoder):
+    """Offline stand-in for development and tests; ``delay`` simulates a slow upstream"""
+
+    def __init__(self, name=None, delay=0):
+        self.name = name
+        self.delay = delay
+        self.calls = 0
+
+    def reverse(self, latitude, longitude):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return self.name or f"{latitude:.3f}, {longitude:.3f}"
+
+
+class OfflineGeocoder(Geocoder):
+    """Nearest place from a compiled gazetteer file (see gazetteer.py); loaded on first use"""
+
+    def __init__(self, path):
+        self.path = path
+        self._gazetteer = None
+        self._load_failed = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._gazetteer is None and not self._load_failed:
+                try:
+                    self._gazetteer = Gazetteer.load(self.path)
+                except (OSError, ValueError) as e:
+                    self._load_failed = True
+                    print(f"Offline gazetteer unavailable ({self.path}): {e}")
+            return self._gazetteer
+
+    def reverse(self, latitude, longitude):
+        gazetteer = self._gazetteer or self._load()
+        if gazetteer is None:
+            return None
+        return gazetteer.reverse(latitude, longitude)
+
+
+class FallbackGeocoder(Geocoder):
+    """Tries ``primary`` and only asks ``fallback`` when it has no answer"""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    def reverse(self, latitude, longitude):
+        return self.primary.reverse(latitude, longitude) or self.fallback.reverse(latitude, longitude)
+
+
+def cell_key(latitude, longitude, cell_size):
+    """Grid cell containing a point; every point in a cell shares one cached name"""
+    return f"{math.floor(latitude / cell_size)}:{math.floor(longitude / cell_size)}"
+
+
+class GeocodeCache:
+    """
+    Two-tier cache of location names by grid cell: an in-memory LRU in front of a
+    SQLite file that survives restarts. Entries expire after ``ttl`` seconds; the
+    file keeps at most ``max_rows`` entries, dropping the oldest first.
+    """
+
+    def __init__(self, path, ttl=30 * 86400, memory_size=1024, max_rows=100000):
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (name, stored_at)
+        self._lock = threading.Lock()
+        self._path = path
+        self._conn = None
+
+    def _db(self):
+        """SQLite connection, opened on first use (callers hold the lock)"""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS geocode_cache (
+                    cell TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_geocode_cache_stored_at ON geocode_cache (stored_at)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key, count_miss=True):
+        """Cached name for ``key`` or None; ``count_miss=False`` for peeks that will be retried"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            row = self._db().execute(
+                "SELECT name, stored_at FROM geocode_cache WHERE cell = ? AND stored_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                self._remember(key, row[0], row[1])
+                self.disk_hits += 1
+                return row[0]
+
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def put(self, key, name):
+        now = time.time()
+        with self._lock:
+            self._remember(key, name, now)
+            self._db().execute(
+                "INSERT OR REPLACE INTO geocode_cache (cell, name, stored_at) VALUES (?, ?, ?)",
+                (key, name, now)
+            )
+            self._db().commit()
+
+    def _remember(self, key, name, stored_at):
+        self._memory[key] = (name, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def evict(self):
+        """Drop expired entries and trim the file to ``max_rows``; returns rows deleted"""
+        with self._lock:
+            deleted = self._db().execute(
+                "DELETE FROM geocode_cache WHERE stored_at <= ?", (time.time() - self.ttl,)
+            ).rowcount
+            deleted += self._db().execute("""
+                DELETE FROM geocode_cache WHERE cell IN (
+                    SELECT cell FROM geocode_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_rows,)).rowcount
+            self._db().commit()
+            return deleted
+
+    def stats(self):
+        with self._lock:
+            rows = self._db().execute("SELECT COUNT(*) FROM geocode_cache").fetchone()[0]
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'disk_entries': rows,
+            }
+
+
+class CachingGeocoder(Geocoder):
+    """Answers from a GeocodeCache by grid cell and only asks ``geocoder`` on a miss"""
+
+    def __init__(self, geocoder, cache, cell_size=0.003):
+        self.geocoder = geocoder
+        self.cache = cache
+        self.cell_size = cell_size
+
+    def cached(self, latitude, longitude):
+        return self.cache.get(cell_key(latitude, longitude, self.cell_size), count_miss=False)
+
+    def reverse(self, latitude, longitude):
+        key = cell_key(latitude, longitude, self.cell_size)
+        name = self.cache.get(key)
+        if name is None:
+            name = self.geocoder.reverse(latitude, longitude)
+            # Failures are not cached, so the next session in this cell retries
+            if name:
+                self.cache.put(key, name)
+        return name
+
+
+GEOCODERS = {
+    'nominatim': NominatimGeocoder,
+    'stub': StubGeocoder,
+}
+
+GEOCODER_MODES = ('online', 'offline', 'offline_first')
+
+def make_geocoder(config):
+    """
+    Geocoder for the GEOCODER_MODE config key: the online GEOCODER, the offline
+    gazetteer at GAZETTEER_PATH, or the gazetteer with the online one as fallback.
+    Sits behind the cell cache if GEOCODE_CACHE_PATH is set.
+    """
+    mode = config.get('GEOCODER_MODE', 'online')
+    if mode not in GEOCODER_MODES:
+        raise ValueError(f"Unknown GEOCODER_MODE {mode!r}; expected one of {GEOCODER_MODES}")
+    name = config.get('GEOCODER', 'nominatim')
+    if name not in GEOCODERS:
+        raise ValueError(f"Unknown GEOCODER {name!r}; expected one of {sorted(GEOCODERS)}")
+
+    if mode == 'online':
+        geocoder = GEOCODERS[name].from_config(config)
+    elif mode == 'offline':
+        geocoder = OfflineGeocoder(config['GAZETTEER_PATH'])
+    else:
+        geocoder = FallbackGeocoder(OfflineGeocoder(config['GAZETTEER_PATH']), GEOCODERS[name].from_config(config))
+
+    if config.get('GEOCODE_CACHE_PATH'):
+        cache = GeocodeCache(
+            config['GEOCODE_CACHE_PATH'],
+            ttl=config.get('GEOCODE_CACHE_TTL', 30 * 86400),
+            memory_size=config.get('GEOCODE_CACHE_MEMORY_SIZE', 1024),
+            max_rows=config.get('GEOCODE_CACHE_MAX_ROWS', 100000)
+        )
+        geocoder = CachingGeocoder(geocoder, cache, cell_size=config.get('GEOCODE_CELL_SIZE', 0.003))
+    return geocoder
+
+
+class GeocodingQueue:
+    """
+    Resolves location names on a small thread pool. ``on_result(key, name)`` is
+    called from a worker thread once a lookup finishes (``name`` may be None).
+    """
+
+    def __init__(self, geocoder, on_result, max_workers=2):
+        self.geocoder = geocoder
+        self.on_result = on_result
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='geocoder')
+
+    def submit(self, key, latitude, longitude):
+        """Queue a lookup; returns a Future for the location name"""
+        return self._executor.submit(self._resolve, key, latitude, longitude)
+
+    def _resolve(self, key, latitude, longitude):
+        name = self.geocoder.reverse(latitude, longitude)
+        try:
+            self.on_result(key, name)
+        except Exception as e:
+            print(f"Geocoding result for {key} not stored: {e}")
+        return name
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,171 @@
+"""
+Hunt-Hunt-Planur - Location ingest
+Remembers the last stored fix per participant so fixes from someone standing
+still extend that row (its last_seen) instead of adding a new one, and funnels
+concurrent writes through one thread that commits them in groups
+"""
+
+import math
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Equirectangular distance, plenty accurate for the few metres compared here"""
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.hypot(x, y) * EARTH_RADIUS_M
+
+
+def _accuracy(fix):
+    value = fix.get('accuracy')
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+class StationaryFilter:
+    """
+    A fix is stationary when it lies within the reported accuracy radius (clamped
+    to ``min_radius_m``..``max_radius_m``) of the last stored fix and less than ``max_interval_s`` has
+    passed since that fix was stored, so a stationary participant still gets one
+    row every ``max_interval_s``. State is per process and bounded to
+    ``max_entries`` participants; forgetting it only means the next fix is stored.
+    """
+
+    def __init__(self, min_radius_m=10, max_radius_m=100, max_interval_s=300, max_entries=10000):
+        self.min_radius_m = min_radius_m
+        self.max_radius_m = max_radius_m
+        self.max_interval_s = max_interval_s
+        self.max_entries = max_entries
+        self._last = OrderedDict()  # participant_id -> fix dict of the last stored row
+        self._lock = threading.Lock()
+
+    def last(self, participant_id):
+        with self._lock:
+            return self._last.get(participant_id)
+
+    def is_stationary(self, previous, fix):
+        """Whether ``fix`` can be merged into the stored ``previous`` fix"""
+        if previous is None:
+            return False
+        if (fix['timestamp'] - previous['timestamp']).total_seconds() >= self.max_interval_s:
+            return False
+        radius = min(self.max_radius_m, max(self.min_radius_m, _accuracy(previous), _accuracy(fix)))
+        moved = distance_m(previous['latitude'], previous['longitude'], fix['latitude'], fix['longitude'])
+        return moved <= radius
+
+    def remember(self, participant_id, fix):
+        """Record ``fix`` as the participant's last stored row (call after it is committed)"""
+        with self._lock:
+            self._last[participant_id] = fix
+            self._last.move_to_end(participant_id)
+            while len(self._last) > self.max_entries:
+                self._last.popitem(last=False)
+
+    def forget(self, participant_id):
+        with self._lock:
+            self._last.pop(participant_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._last.clear()
+
+
+class GroupCommitWriter:
+    """
+    Applies submitted writes on a single thread, many per transaction. The thread
+    takes whatever is queued, waits up to ``max_delay_s`` for more (at most
+    ``max_batch`` in all) and hands the batch to ``apply(items)``, which must
+    write and commit them together and return one result per item. Each
+    ``submit`` blocks until its batch is committed, at most ``timeout_s``. If a
+    batch fails, its items are retried one by one, so a bad write only fails its
+    own caller. A thread that has died is replaced on the next ``submit``.
+    """
+
+    _STOP = object()
+
+    def __init__(self, apply, max_batch=200, max_delay_s=0.002, timeout_s=5.0, name='group-commit-writer'):
+        self.apply = apply
+        self.max_batch = max_batch
+        self.max_delay_s = max_delay_s
+        self.timeout_s = timeout_s
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item, timeout=None):
+        """
+        Queue ``item`` and wait for it to be committed; returns its result or raises its
+        error. Raises TimeoutError after ``timeout`` (default ``timeout_s``) seconds; the
+        item is then dropped unless the writer has already started on it.
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                # Started on first use, so importing the app does not start threads before a fork
+                self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+                self._thread.start()
+        future = Future()
+        self._queue.put((item, future))
+        try:
+            return future.result(self.timeout_s if timeout is None else timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"{self.name} did not commit within the timeout") from None
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(self._STOP)
+            thread.join()
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is self._STOP:
+                return
+            batch = [entry]
+            deadline = time.monotonic() + self.max_delay_s
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    entry = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is self._STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            # Callers that gave up waiting have cancelled theirs; the rest can no longer be cancelled
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if batch:
+                self._flush(batch)
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        try:
+            results = self.apply([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                for entry in batch:
+                    self._flush([entry])
+            return
+        except BaseException as e:
+            # SystemExit and the like would end this thread with everyone still waiting
+            for _, future in batch:
+                future.set_exception(RuntimeError(f"{self.name} write aborted: {e!r}"))
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -2,6 +2,11 @@
 
 let allSessions = [];
 let currentFilter = 'all';
+let nextCursor = null;
+let isLoadingPage = false;
+let historyRequestId = 0;
+
+const HISTORY_PAGE_SIZE = 20;
 
 // Check if user is logged in
 async function checkAuth() {
@@ -36,14 +41,35 @@ function showMessage(message, type = 'info') {
     }, 5000);
 }
 
-// Load all sessions history
+// Load the first page of session history for the current filter
 async function loadHistory() {
+    allSessions = [];
+    nextCursor = null;
+    await loadHistoryPage();
+}
+
+// Fetch the next page (after nextCursor) and append it to the list
+async function loadHistoryPage() {
+    const requestId = ++historyRequestId;
+    isLoadingPage = true;
+    
     try {
-        const response = await fetch('/api/get_all_sessions_history');
+        const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE, filter: currentFilter });
+        if (nextCursor) {
+            params.set('cursor', nextCursor);
+        }
+        
+        const response = await fetch(`/api/get_all_sessions_history?${params}`);
         const data = await response.json();
         
+        // A filter change or reload started meanwhile; its response wins
+        if (requestId !== historyRequestId) {
+            return;
+        }
+        
         if (data.success) {
-            allSessions = data.sessions;
+            allSessions = allSessions.concat(data.sessions);
+            nextCursor = data.next_cursor;
             displaySessions(allSessions);
         } else {
             showMessage('Failed to load session history', 'error');
@@ -51,9 +77,33 @@ async function loadHistory() {
     } catch (error) {
         console.error('Load history error:', error);
         showMessage('Failed to load session history', 'error');
+    } finally {
+        if (requestId === historyRequestId) {
+            isLoadingPage = false;
+            // Short pages may not fill the screen, so the sentinel never scrolls into view
+            if (nextCursor && isSentinelVisible()) {
+                loadHistoryPage();
+            }
+        }
     }
 }
 
+// Sentinel below the list that triggers the next page when scrolled into view
+const historySentinel = document.createElement('div');
+historySentinel.id = 'historySentinel';
+document.getElementById('historyList').after(historySentinel);
+
+function isSentinelVisible() {
+    return historySentinel.getBoundingClientRect().top <= window.innerHeight;
+}
+
+const historyObserver = new IntersectionObserver(entries => {
+    if (entries.some(entry => entry.isIntersecting) && nextCursor && !isLoadingPage) {
+        loadHistoryPage();
+    }
+}, { rootMargin: '200px' });
+historyObserver.observe(historySentinel);
+
 // Display sessions based on current filter
 function displaySessions(sessions) {
     const historyList = document.getElementById('historyList');
@@ -128,31 +178,10 @@ function displaySessions(sessions) {
     }).join('');
 }
 
-// Filter sessions
+// Filter sessions (done by the server so every page matches the filter)
 function filterSessions(filter) {
     currentFilter = filter;
-    
-    let filtered = allSessions;
-    
-    switch(filter) {
-        case 'created':
-            filtered = allSessions.filter(s => s.is_creator);
-            break;
-        case 'joined':
-            filtered = allSessions.filter(s => !s.is_creator);
-            break;
-        case 'active':
-            filtered = allSessions.filter(s => s.is_active);
-            break;
-        case 'ended':
-            filtered = allSessions.filter(s => !s.is_active);
-            break;
-        case 'all':
-        default:
-            filtered = allSessions;
-    }
-    
-    displaySessions(filtered);
+    loadHistory();
 }
 
 // Edit session name function
@@ -7,7 +7,9 @@ let sessionCode = null;
 let isSharing = false;
 let watchId = null;
 let updateInterval = null;
-let positionUpdateInterval = null; // Interval for sending position updates every 1 minute
+let positionUpdateInterval = null; // Interval for flushing buffered fixes to the server
+let locationBuffer = []; // Fixes from watchPosition waiting to be uploaded
+let isFlushingLocations = false;
 let isCreator = false;
 let creatorId = null;
 let currentUserId = null;
@@ -17,6 +19,19 @@ let lastPosition = null; // Store last known position
 let trackMarkers = []; // Store track markers for position history
 let trackPolyline = null; // Store polyline for track path
 let isReviewMode = false; // Flag for review mode (ended sessions)
+let eventSource = null; // Server-Sent Events stream of participant changes
+let staleCheckInterval = null; // Ages out streamed participants that stopped reporting
+let websocketPort = null; // WebSocket gateway port from get_session_info, if the server runs one
+let gatewaySocket = null; // Open gateway connection; replaces the stream, long-poll and uploads
+let gatewayRetryMs = 2000;
+let gatewayClosed = false; // Session ended or we left: don't reconnect
+let lastGatewayFixTime = 0;
+
+const LOCATION_FLUSH_INTERVAL_MS = 20000; // Upload often enough to stay inside the 30 second online window
+const LOCATION_MIN_FIX_INTERVAL_MS = 5000; // Buffer at most one fix every 5 seconds
+const LOCATION_BUFFER_MAX = 500; // Matches the server's per-batch limit
+const TRACK_TOLERANCE_M = 5; // Server-side simplification of position history tracks
+const TRACK_MAX_POINTS = 200; // At most this many track markers on the map
 
 // Get session code from URL
 const urlParams = new URLSearchParams(window.location.search);
@@ -77,6 +92,7 @@ async function loadSessionInfo() {
             
             // Store creator info
             creatorId = data.session.creator_id;
+            websocketPort = data.websocket_port;
             
             // Configure UI for review mode
             if (isReviewMode) {
@@ -201,6 +217,7 @@ async function startSharing() {
     try {
         const position = await getCurrentLocation();
         isSharing = true;
+        lastPosition = position;
         
         // Update button
         const toggleBtn = document.getElementById('toggleSharingBtn');
@@ -208,11 +225,12 @@ async function startSharing() {
         toggleBtn.classList.remove('btn-primary');
         toggleBtn.classList.add('btn-danger');
         
-        // Watch position for real-time updates (for map display)
+        // Watch position for real-time updates; every fix is buffered for upload
         watchId = navigator.geolocation.watchPosition(
             (pos) => {
                 // Store the latest position
                 lastPosition = pos;
+                queueLocation(pos);
             },
             handleLocationError,
             {
@@ -223,19 +241,16 @@ async function startSharing() {
         );
         
         // Send initial position update
-        await updateLocation(position);
+        queueLocation(position);
+        await flushLocations();
         
-        // Set up interval to send position updates every 1 minute
-        positionUpdateInterval = setInterval(async () => {
-            if (isSharing && lastPosition) {
-                await updateLocation(lastPosition);
-            }
-        }, 60000); // 60000ms = 1 minute
+        // Upload buffered fixes periodically
+        positionUpdateInterval = setInterval(flushLocations, LOCATION_FLUSH_INTERVAL_MS);
         
         // Center map on user
         map.setView([position.coords.latitude, position.coords.longitude], 15);
         
-        showMessage('Location sharing started (updates every 1 minute)', 'success');
+        showMessage('Location sharing started', 'success');
     } catch (error) {
         showMessage('Failed to get location: ' + error.message, 'error');
     }
@@ -254,8 +269,12 @@ async function stopSharing() {
         positionUpdateInterval = null;
     }
     
+    // Upload whatever is still buffered before going offline
+    await flushLocations();
+    
     isSharing = false;
     lastPosition = null;
+    locationBuffer = [];
     
     // Notify server to mark as offline
     try {
@@ -278,33 +297,114 @@ async function stopSharing() {
     showMessage('Location sharing stopped', 'info');
 }
 
-// Update location
-async function updateLocation(position) {
+// This browser's upload stream: the server counts sequence numbers per stream, so
+// other devices of the same participant (or cleared storage) start their own count
+function locationStreamId() {
+    const key = `hhp_location_stream_${participantId}`;
+    let stream = localStorage.getItem(key);
+    if (!stream) {
+        stream = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+        localStorage.setItem(key, stream);
+        localStorage.removeItem(`hhp_location_seq_${participantId}`);
+    }
+    return stream;
+}
+
+// Next sequence number of this browser's stream; persisted so reloads never reuse one
+function nextLocationSeq() {
+    locationStreamId();
+    const key = `hhp_location_seq_${participantId}`;
+    const seq = (parseInt(localStorage.getItem(key), 10) || 0) + 1;
+    localStorage.setItem(key, String(seq));
+    return seq;
+}
+
+// Buffer a Geolocation fix for the next upload (or send it right away over the gateway)
+function queueLocation(position) {
     if (!isSharing || !participantId) return;
     
+    if (gatewaySocket && locationBuffer.length === 0) {
+        if (position.timestamp - lastGatewayFixTime < LOCATION_MIN_FIX_INTERVAL_MS) return;
+        lastGatewayFixTime = position.timestamp;
+        const { latitude, longitude, accuracy } = position.coords;
+        gatewaySocket.send(JSON.stringify({ type: 'location', latitude, longitude, accuracy }));
+        return;
+    }
+    
+    const last = locationBuffer[locationBuffer.length - 1];
+    if (last && position.timestamp - last.timestamp < LOCATION_MIN_FIX_INTERVAL_MS) {
+        return;
+    }
+    
     const { latitude, longitude, accuracy } = position.coords;
+    locationBuffer.push({
+        latitude,
+        longitude,
+        accuracy,
+        timestamp: position.timestamp,
+        seq: nextLocationSeq()
+    });
+    
+    // Keep the newest fixes if we have been offline for a long time
+    if (locationBuffer.length > LOCATION_BUFFER_MAX) {
+        locationBuffer.splice(0, locationBuffer.length - LOCATION_BUFFER_MAX);
+    }
+}
+
+// Resend the last fix when watchPosition has gone quiet (standing still, or the
+// browser stopped reporting), so the participant stays online; the server merges it
+// into the last stored row
+function queueHeartbeat() {
+    if (!isSharing || !lastPosition || positionUpdateInterval === null || locationBuffer.length > 0) return;
+    
+    const { latitude, longitude, accuracy } = lastPosition.coords;
+    if (gatewaySocket) {
+        if (Date.now() - lastGatewayFixTime < LOCATION_FLUSH_INTERVAL_MS) return;
+        lastGatewayFixTime = Date.now();
+        gatewaySocket.send(JSON.stringify({ type: 'location', latitude, longitude, accuracy }));
+        return;
+    }
+    locationBuffer.push({ latitude, longitude, accuracy, timestamp: Date.now(), seq: nextLocationSeq() });
+}
+
+// Upload buffered fixes in one request; unacknowledged fixes stay buffered for the next try
+async function flushLocations() {
+    queueHeartbeat();
+    if (!participantId || isFlushingLocations || locationBuffer.length === 0) return;
+    
+    isFlushingLocations = true;
+    const batch = locationBuffer.slice();
     
     try {
-        const response = await fetch('/api/update_location', {
+        const response = await fetch('/api/update_locations_batch', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
             body: JSON.stringify({
                 session_code: sessionCode,
-                latitude,
-                longitude,
-                accuracy
+                stream: locationStreamId(),
+                sent_at: Date.now(),
+                fixes: batch
             })
         });
         
         const data = await response.json();
         
-        if (!data.success) {
+        if (data.success) {
+            const ackedSeq = data.last_seq !== null ? data.last_seq : batch[batch.length - 1].seq;
+            locationBuffer = locationBuffer.filter(fix => fix.seq > ackedSeq);
+        } else {
             console.error('Failed to update location:', data.message);
+            if (response.status === 400 || response.status === 401 || response.status === 404) {
+                // Retrying a rejected batch (or one from someone no longer in the session) won't help
+                locationBuffer = locationBuffer.filter(fix => !batch.includes(fix));
+            }
         }
     } catch (error) {
         console.error('Update location error:', error);
+    } finally {
+        isFlushingLocations = false;
     }
 }
 
@@ -355,53 +455,249 @@ async function loadParticipants() {
             ? `/api/get_all_participants_for_review?code=${sessionCode}`
             : `/api/get_participants?code=${sessionCode}`;
         
-        const response = await fetch(apiUrl);
-        const data = await response.json();
+        // Revalidate every poll: an unchanged roster comes back as a 304 the browser fills from cache
+        const response = await fetch(apiUrl, { cache: 'no-cache' });
+        applyParticipants(await response.json());
+    } catch (error) {
+        console.error('Load participants error:', error);
+    }
+}
+
+// Replace the participant list with a get_participants response (polled or from the gateway)
+function applyParticipants(data) {
+    if (data.success) {
+        // Store participants data for later use
+        participantsData = data.participants;
         
-        if (data.success) {
-            // Store participants data for later use
-            participantsData = data.participants;
+        // Skip removal check in review mode
+        if (!isReviewMode) {
+            // Check if current participant is still in the list
+            const stillInSession = data.participants.some(p => p.id === participantId);
             
-            // Skip removal check in review mode
-            if (!isReviewMode) {
-                // Check if current participant is still in the list
-                const stillInSession = data.participants.some(p => p.id === participantId);
-                
-                if (!stillInSession && participantId) {
-                    // User was removed from the session
-                    showMessage('You have been removed from this session', 'error');
-                    
-                    // Stop sharing location
-                    if (isSharing) {
-                        stopSharing();
-                    }
-                    
-                    // Redirect based on user type
-                    setTimeout(async () => {
-                        const authResponse = await fetch('/api/check_auth');
-                        const authData = await authResponse.json();
-                        
-                        if (authData.authenticated) {
-                            // Redirect to dashboard if logged in
-                            window.location.href = 'dashboard.html';
-                        } else {
-                            // Redirect to homepage if guest
-                            window.location.href = 'index.html';
-                        }
-                    }, 2000);
-                    
-                    return;
-                }
+            if (!stillInSession && participantId) {
+                handleRemovedFromSession();
+                return;
             }
-            
-            updateParticipantsList(data.participants);
-            updateMapMarkers(data.participants);
         }
-    } catch (error) {
-        console.error('Load participants error:', error);
+        
+        // Remember when each online position arrived so streamed updates can age out
+        participantsData.forEach(p => { p.receivedAt = Date.now(); });
+        
+        updateParticipantsList(data.participants);
+        updateMapMarkers(data.participants);
+    }
+}
+
+// Current participant was removed from the session
+function handleRemovedFromSession() {
+    showMessage('You have been removed from this session', 'error');
+    
+    closeSessionStream();
+    
+    // Stop sharing location
+    if (isSharing) {
+        stopSharing();
+    }
+    
+    // Redirect based on user type
+    setTimeout(async () => {
+        const authResponse = await fetch('/api/check_auth');
+        const authData = await authResponse.json();
+        
+        if (authData.authenticated) {
+            // Redirect to dashboard if logged in
+            window.location.href = 'dashboard.html';
+        } else {
+            // Redirect to homepage if guest
+            window.location.href = 'index.html';
+        }
+    }, 2000);
+}
+
+// Fall back to polling participants every 3 seconds
+function startParticipantPolling() {
+    if (updateInterval === null) {
+        updateInterval = setInterval(loadParticipants, 3000);
+    }
+}
+
+function stopParticipantPolling() {
+    if (updateInterval !== null) {
+        clearInterval(updateInterval);
+        updateInterval = null;
+    }
+}
+
+// Subscribe to live participant changes; polling is only used while the stream is down
+function subscribeToSessionStream() {
+    if (!window.EventSource) {
+        startParticipantPolling();
+        return;
+    }
+    
+    eventSource = new EventSource(`/api/sessions/${sessionCode}/stream`);
+    
+    eventSource.addEventListener('open', () => {
+        stopParticipantPolling();
+        // Full refresh on (re)connect; the stream carries changes from here on
+        loadParticipants();
+    });
+    
+    eventSource.addEventListener('participant', (e) => {
+        applyParticipantUpdate(JSON.parse(e.data));
+    });
+    
+    eventSource.addEventListener('participant_left', (e) => {
+        handleParticipantLeft(JSON.parse(e.data));
+    });
+    
+    eventSource.addEventListener('resync', () => {
+        loadParticipants();
+    });
+    
+    eventSource.addEventListener('ended', () => {
+        closeSessionStream();
+        showMessage('This session has ended', 'info');
+    });
+    
+    eventSource.addEventListener('error', () => {
+        // The browser reconnects on its own (sending Last-Event-ID); poll until it does
+        if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+            eventSource = null;
+        }
+        startParticipantPolling();
+    });
+    
+    if (staleCheckInterval === null) {
+        staleCheckInterval = setInterval(expireStaleParticipants, 5000);
+    }
+}
+
+function closeSessionStream() {
+    if (eventSource) {
+        eventSource.close();
+        eventSource = null;
+    }
+    if (staleCheckInterval !== null) {
+        clearInterval(staleCheckInterval);
+        staleCheckInterval = null;
+    }
+}
+
+function handleParticipantLeft(data) {
+    if (data.id === participantId) {
+        gatewayClosed = true;
+        handleRemovedFromSession();
+        return;
+    }
+    participantsData = participantsData.filter(p => p.id !== data.id);
+    renderParticipants();
+}
+
+// One WebSocket for fixes, participant changes and alerts; the HTTP loops take over while it is down
+function connectGateway() {
+    if (!window.WebSocket || !websocketPort || gatewayClosed) return;
+    
+    const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${scheme}://${window.location.hostname}:${websocketPort}/ws/sessions/${sessionCode}`);
+    
+    socket.addEventListener('open', () => {
+        gatewaySocket = socket;
+        gatewayRetryMs = 2000;
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+        stopParticipantPolling();
+        notificationPolling = false;
+        // Anything buffered while offline still goes up as one batch
+        flushLocations();
+    });
+    
+    socket.addEventListener('message', (e) => {
+        const message = JSON.parse(e.data);
+        switch (message.type) {
+            case 'snapshot':
+                applyParticipants(message.data);
+                break;
+            case 'participant':
+                applyParticipantUpdate(message.data);
+                break;
+            case 'participant_left':
+                handleParticipantLeft(message.data);
+                break;
+            case 'alert':
+                checkNotifications();
+                break;
+            case 'ended':
+                gatewayClosed = true;
+                showMessage('This session has ended', 'info');
+                break;
+            case 'error':
+                console.error('Gateway error:', message.message);
+                break;
+        }
+    });
+    
+    socket.addEventListener('close', () => {
+        const wasOpen = gatewaySocket === socket;
+        gatewaySocket = null;
+        if (gatewayClosed) return;
+        if (wasOpen) {
+            subscribeToSessionStream();
+            startNotificationPolling();
+        }
+        setTimeout(connectGateway, gatewayRetryMs);
+        gatewayRetryMs = Math.min(gatewayRetryMs * 2, 60000);
+    });
+}
+
+function closeGateway() {
+    gatewayClosed = true;
+    if (gatewaySocket) {
+        gatewaySocket.close();
+        gatewaySocket = null;
+    }
+}
+
+// Merge a streamed participant entry into the local list
+function applyParticipantUpdate(participant) {
+    participant.receivedAt = Date.now();
+    const index = participantsData.findIndex(p => p.id === participant.id);
+    if (index >= 0) {
+        participantsData[index] = participant;
+    } else {
+        participantsData.push(participant);
+    }
+    renderParticipants();
+}
+
+// Server treats positions older than 30 seconds as offline; mirror that locally
+function expireStaleParticipants() {
+    let changed = false;
+    participantsData.forEach(p => {
+        if (p.is_online && p.receivedAt && Date.now() - p.receivedAt > 30000) {
+            p.is_online = false;
+            if (p.is_guest) {
+                // Guests have no last known position to fall back to
+                p.latitude = null;
+                p.longitude = null;
+                p.accuracy = null;
+                p.last_update = null;
+            }
+            changed = true;
+        }
+    });
+    if (changed) {
+        renderParticipants();
     }
 }
 
+function renderParticipants() {
+    updateParticipantsList(participantsData);
+    updateMapMarkers(participantsData);
+}
+
 // Update participants list
 function updateParticipantsList(participants) {
     const participantsList = document.getElementById('participantsList');
@@ -706,15 +1002,78 @@ async function removeParticipant(participantId, participantName) {
     }
 }
 
+// Decode the signed integers of a polyline-style string (zigzag, 5-bit chunks + 63)
+function decodeSigned(text) {
+    const values = [];
+    let index = 0;
+    while (index < text.length) {
+        let shift = 0;
+        let result = 0;
+        let chunk;
+        do {
+            chunk = text.charCodeAt(index++) - 63;
+            // Arithmetic rather than bitwise: epoch seconds overflow 32-bit ints once zigzagged
+            result += (chunk & 0x1f) * Math.pow(2, shift);
+            shift += 5;
+        } while (chunk >= 0x20);
+        values.push(result % 2 ? -(result + 1) / 2 : result / 2);
+    }
+    return values;
+}
+
+// Decode integers written by tracks.encode_deltas (each a difference from the previous)
+function decodeDeltas(text) {
+    let value = 0;
+    return decodeSigned(text).map(delta => (value += delta));
+}
+
+// Turn a get_user_positions ?format=polyline|columnar track back into position objects
+function decodeTrack(format, track) {
+    if (format === 'columnar') {
+        return track.latitude.map((latitude, i) => ({
+            latitude,
+            longitude: track.longitude[i],
+            accuracy: track.accuracy[i],
+            timestamp: track.time[i] * 1000,
+            last_seen: track.last_seen[i] !== null ? track.last_seen[i] * 1000 : null
+        }));
+    }
+    
+    // polyline: interleaved lat/lon deltas, then per-point time, accuracy (-1 = unknown) and dwell seconds
+    const factor = Math.pow(10, track.precision);
+    const coordinates = decodeSigned(track.points);
+    const times = decodeDeltas(track.time);
+    const accuracies = decodeDeltas(track.accuracy);
+    const dwells = decodeDeltas(track.dwell);
+    
+    const positions = [];
+    let lat = 0;
+    let lng = 0;
+    for (let i = 0; i < times.length; i++) {
+        lat += coordinates[2 * i];
+        lng += coordinates[2 * i + 1];
+        positions.push({
+            latitude: lat / factor,
+            longitude: lng / factor,
+            accuracy: accuracies[i] >= 0 ? accuracies[i] : null,
+            timestamp: times[i] * 1000,
+            last_seen: dwells[i] > 0 ? (times[i] + dwells[i]) * 1000 : null
+        });
+    }
+    return positions;
+}
+
 // Show user track (position history)
 async function showUserTrack(participantId, participantName) {
     try {
         // Clear any existing track markers and polyline
         clearTrackMarkers();
         
-        // Fetch position history (add review_mode parameter if in review mode)
+        // Fetch position history (add review_mode parameter if in review mode),
+        // simplified server-side so long tracks don't need a marker per fix
         const reviewParam = isReviewMode ? '&review_mode=true' : '';
-        const response = await fetch(`/api/get_user_positions?participant_id=${participantId}&session_code=${sessionCode}${reviewParam}`);
+        const simplifyParams = `&tolerance_m=${TRACK_TOLERANCE_M}&max_points=${TRACK_MAX_POINTS}&format=polyline`;
+        const response = await fetch(`/api/get_user_positions?participant_id=${participantId}&session_code=${sessionCode}${reviewParam}${simplifyParams}`);
         const data = await response.json();
         
         if (!data.success) {
@@ -722,12 +1081,13 @@ async function showUserTrack(participantId, participantName) {
             return;
         }
         
-        if (!data.positions || data.positions.length === 0) {
+        const positions = data.track ? decodeTrack(data.format, data.track) : data.positions;
+        
+        if (!positions || positions.length === 0) {
             showMessage(`No position history available for ${participantName}`, 'info');
             return;
         }
-        
-        const positions = data.positions;
+
         const latLngs = [];
         
         // Create markers for each position
@@ -736,7 +1096,9 @@ async function showUserTrack(participantId, participantName) {
             const lng = parseFloat(pos.longitude);
             latLngs.push([lat, lng]);
             
-            const timestamp = new Date(pos.timestamp).toLocaleString();
+            // Stationary fixes are merged into one point that lasts until last_seen
+            const timestamp = new Date(pos.timestamp).toLocaleString()
+                + (pos.last_seen ? ` – ${new Date(pos.last_seen).toLocaleTimeString()}` : '');
             const isLast = index === positions.length - 1;
             
             // Create pin marker with emoji
@@ -783,7 +1145,8 @@ async function showUserTrack(participantId, participantName) {
             map.fitBounds(bounds, { padding: [50, 50] });
         }
         
-        showMessage(`Showing ${positions.length} location${positions.length > 1 ? 's' : ''} for ${participantName}`, 'success');
+        const simplifiedNote = data.total_points > positions.length ? ` (simplified from ${data.total_points})` : '';
+        showMessage(`Showing ${positions.length} location${positions.length > 1 ? 's' : ''} for ${participantName}${simplifiedNote}`, 'success');
         
     } catch (error) {
         console.error('Show user track error:', error);
@@ -1019,6 +1382,7 @@ document.getElementById('leaveSessionBtn').addEventListener('click', async () =>
         return;
     }
     
+    closeSessionStream();
     stopSharing();
     
     try {
@@ -1053,15 +1417,16 @@ initMap();
 loadSessionInfo().then(() => {
     // Auto-start location sharing after session info is loaded (but not in review mode)
     if (participantId && !isReviewMode) {
+        connectGateway();
         setTimeout(() => {
             startSharing();
         }, 1000); // Small delay to ensure map is ready
     }
 });
 
-// Start polling for participants updates (only if not in review mode)
+// Subscribe to participant updates (only if not in review mode)
 if (!isReviewMode) {
-    updateInterval = setInterval(loadParticipants, 3000); // Update every 3 seconds
+    subscribeToSessionStream();
 }
 
 // Initial load
@@ -1091,7 +1456,7 @@ document.getElementById('alertBtn').addEventListener('click', async () => {
 });
 
 // Poll for notifications
-let notificationInterval = null;
+let notificationPolling = false;
 let alertBlinkTimeout = null;
 let notificationPermissionGranted = false;
 let isPageVisible = true;
@@ -1238,14 +1603,27 @@ function showBlinkingAlert(senderName) {
     }, 60000);
 }
 
-async function checkNotifications() {
+// Fetch unread notifications; with wait > 0 the server holds the request until an alert arrives
+async function checkNotifications(wait = 0) {
     try {
-        const response = await fetch('/api/get_notifications');
+        const waitParam = wait > 0 ? `?wait=${wait}` : '';
+        const response = await fetch(`/api/get_notifications${waitParam}`);
         const data = await response.json();
         
         if (data.success && data.notifications.length > 0) {
             // Process each notification
             data.notifications.forEach(notification => {
+                // Automatic proximity alerts are informational: no alarm panel, sound or map jump
+                if (notification.kind === 'proximity') {
+                    showMessage(notification.message, 'info');
+                    if (!isPageVisible || document.hidden) {
+                        showBrowserNotification('Proximity', notification.message, 'img/hunt-hunt-planur-48p.webp');
+                        missedNotificationsCount++;
+                    }
+                    vibrateDevice();
+                    return;
+                }
+                
                 // Show blinking alert panel with sender name
                 showBlinkingAlert(notification.sender_name);
                 
@@ -1293,8 +1671,27 @@ async function checkNotifications() {
                 body: JSON.stringify({ notification_ids: notificationIds })
             });
         }
+        return data.success;
     } catch (error) {
         console.error('Check notifications error:', error);
+        return false;
+    }
+}
+
+function startNotificationPolling() {
+    if (!notificationPolling) {
+        notificationPolling = true;
+        pollNotifications();
+    }
+}
+
+// Long-poll for notifications: one parked request at a time, back off 2 seconds on errors
+async function pollNotifications() {
+    while (notificationPolling) {
+        const ok = await checkNotifications(25);
+        if (!ok && notificationPolling) {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
     }
 }
 
@@ -1320,21 +1717,18 @@ document.addEventListener('visibilitychange', () => {
 // Request notification permission
 requestNotificationPermission();
 
-// Start polling for notifications every 2 seconds
-notificationInterval = setInterval(checkNotifications, 2000);
-
-// Initial check
-checkNotifications();
+// Start long-polling for notifications (until the gateway connects)
+startNotificationPolling();
 
 // Cleanup on page unload
 window.addEventListener('beforeunload', () => {
     stopSharing();
+    closeSessionStream();
+    closeGateway();
     if (updateInterval) {
         clearInterval(updateInterval);
     }
-    if (notificationInterval) {
-        clearInterval(notificationInterval);
-    }
+    notificationPolling = false;
     if (alertBlinkTimeout) {
         clearTimeout(alertBlinkTimeout);
     }
@@ -0,0 +1,510 @@
+"""
+Hunt-Hunt-Planur - Versioned Database Migrations
+Replaces the old one-off migrate_*.py scripts. Every migration is idempotent and
+applied at most once; applied versions are recorded in the schema_migrations table.
+
+Usage:
+    python migrations.py                 Apply pending migrations
+    python migrations.py --status        Show applied / pending versions
+    python migrations.py --check-plans   Fail if a hot endpoint query does a full table scan
+"""
+
+import re
+import sys
+from datetime import datetime
+
+# Set UTF-8 encoding for console output
+if sys.platform == 'win32':
+    import codecs
+    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
+    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+
+
+# Helpers
+
+def table_exists(conn, table):
+    return conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone() is not None
+
+def column_names(conn, table):
+    return [row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()]
+
+def add_column(conn, table, column, definition):
+    if table_exists(conn, table) and column not in column_names(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# Migrations, in order. Each one receives a connection inside a transaction.
+
+def m001_session_location_name(conn):
+    """Add location_name to sessions"""
+    add_column(conn, 'sessions', 'location_name', 'VARCHAR(200)')
+
+def m002_notifications(conn):
+    """Create the notifications table for alerts"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            sender_participant_id INTEGER NOT NULL,
+            message VARCHAR(500) NOT NULL,
+            sender_latitude FLOAT,
+            sender_longitude FLOAT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_read BOOLEAN DEFAULT 0,
+            FOREIGN KEY (session_id) REFERENCES sessions (id),
+            FOREIGN KEY (sender_participant_id) REFERENCES session_participants (id)
+        )
+    """)
+
+def m003_user_positions(conn):
+    """Create user_positions and drop the old last_latitude/last_longitude columns"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS user_positions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            accuracy REAL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_user_positions_timestamp ON user_positions(timestamp)")
+
+    # SQLite doesn't support DROP COLUMN on older versions, so recreate the tables
+    if table_exists(conn, 'users') and 'last_latitude' in column_names(conn, 'users'):
+        conn.exec_driver_sql("""
+            CREATE TABLE users_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                email VARCHAR(100) UNIQUE NOT NULL,
+                password_hash VARCHAR(255),
+                google_id VARCHAR(255) UNIQUE,
+                profile_picture VARCHAR(500),
+                auth_provider VARCHAR(20) DEFAULT 'local',
+                created_at DATETIME,
+                last_login DATETIME
+            )
+        """)
+        conn.exec_driver_sql("""
+            INSERT INTO users_new (id, username, email, password_hash, google_id,
+                                   profile_picture, auth_provider, created_at, last_login)
+            SELECT id, username, email, password_hash, google_id,
+                   profile_picture, auth_provider, created_at, last_login
+            FROM users
+        """)
+        conn.exec_driver_sql("DROP TABLE users")
+        conn.exec_driver_sql("ALTER TABLE users_new RENAME TO users")
+
+    if table_exists(conn, 'session_participants') and 'last_latitude' in column_names(conn, 'session_participants'):
+        conn.exec_driver_sql("""
+            CREATE TABLE session_participants_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                user_id INTEGER,
+                guest_name VARCHAR(50),
+                joined_at DATETIME,
+                is_active BOOLEAN,
+                FOREIGN KEY (session_id) REFERENCES sessions (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
+        conn.exec_driver_sql("""
+            INSERT INTO session_participants_new (id, session_id, user_id, guest_name, joined_at, is_active)
+            SELECT id, session_id, user_id, guest_name, joined_at, is_active
+            FROM session_participants
+        """)
+        conn.exec_driver_sql("DROP TABLE session_participants")
+        conn.exec_driver_sql("ALTER TABLE session_participants_new RENAME TO session_participants")
+
+def m004_last_positions(conn):
+    """Create participant_last_positions / user_last_positions and backfill them from history"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS participant_last_positions (
+            participant_id INTEGER PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            accuracy REAL,
+            timestamp DATETIME,
+            last_seq INTEGER,
+            FOREIGN KEY (participant_id) REFERENCES session_participants (id)
+        )
+    """)
+    add_column(conn, 'participant_last_positions', 'last_seq', 'INTEGER')
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS user_last_positions (
+            user_id INTEGER PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            accuracy REAL,
+            timestamp DATETIME,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    conn.exec_driver_sql("""
+        INSERT OR IGNORE INTO participant_last_positions
+            (participant_id, latitude, longitude, accuracy, timestamp)
+        SELECT l.participant_id, l.latitude, l.longitude, l.accuracy, l.timestamp
+        FROM locations l
+        WHERE l.id = (
+            SELECT l2.id FROM locations l2
+            WHERE l2.participant_id = l.participant_id
+            ORDER BY l2.timestamp DESC, l2.id DESC
+            LIMIT 1
+        )
+    """)
+    conn.exec_driver_sql("""
+        INSERT OR IGNORE INTO user_last_positions
+            (user_id, latitude, longitude, accuracy, timestamp)
+        SELECT p.user_id, p.latitude, p.longitude, p.accuracy, p.timestamp
+        FROM user_positions p
+        WHERE p.id = (
+            SELECT p2.id FROM user_positions p2
+            WHERE p2.user_id = p.user_id
+            ORDER BY p2.timestamp DESC, p2.id DESC
+            LIMIT 1
+        )
+    """)
+
+# Composite indexes matching the hot query shapes (names match the models' __table_args__)
+HOT_INDEXES = [
+    ('ix_locations_participant_timestamp', 'locations', 'participant_id, timestamp'),
+    ('ix_session_participants_session_active', 'session_participants', 'session_id, is_active'),
+    ('ix_session_participants_session_user', 'session_participants', 'session_id, user_id'),
+    ('ix_session_participants_session_guest', 'session_participants', 'session_id, guest_name'),
+    ('ix_session_participants_user', 'session_participants', 'user_id'),
+    ('ix_sessions_creator_created', 'sessions', 'creator_id, created_at'),
+    ('ix_notifications_session_read_created', 'notifications', 'session_id, is_read, created_at'),
+    ('ix_user_positions_user_timestamp', 'user_positions', 'user_id, timestamp'),
+]
+
+def m005_hot_query_indexes(conn):
+    """Add composite indexes for the polling and dashboard queries"""
+    for name, table, columns in HOT_INDEXES:
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    # Left behind by the old migrate_user_positions.py; superseded by the indexes above
+    conn.exec_driver_sql("DROP INDEX IF EXISTS idx_user_positions_user_id")
+    conn.exec_driver_sql("DROP INDEX IF EXISTS idx_user_positions_timestamp")
+    conn.exec_driver_sql("ANALYZE")
+
+# One identity per registered user or guest name, as counted everywhere else
+_PARTICIPANT_IDENTITY = "CASE WHEN sp.user_id IS NOT NULL THEN 'u:' || sp.user_id ELSE 'g:' || sp.guest_name END"
+_EVER_JOINED = f"""(SELECT COUNT(DISTINCT {_PARTICIPANT_IDENTITY}) FROM session_participants sp
+                    WHERE sp.session_id = sessions.id)"""
+_ACTIVE = f"""(SELECT COUNT(DISTINCT {_PARTICIPANT_IDENTITY}) FROM session_participants sp
+               WHERE sp.session_id = sessions.id AND sp.is_active = 1)"""
+
+def recompute_participant_counters(conn):
+    """
+    Rebuild sessions.participant_count / active_participant_count from session_participants.
+    Only rows that disagree are written; returns how many were repaired. Archived
+    sessions keep theirs: their participant rows are gone (see m010).
+    """
+    archived = "archived_at IS NULL AND " if 'archived_at' in column_names(conn, 'sessions') else ""
+    return conn.exec_driver_sql(f"""
+        UPDATE sessions SET
+            participant_count = {_EVER_JOINED},
+            active_participant_count = {_ACTIVE}
+        WHERE {archived}(participant_count IS NOT {_EVER_JOINED}
+           OR active_participant_count IS NOT {_ACTIVE})
+    """).rowcount
+
+def m006_session_participant_counters(conn):
+    """Add denormalized participant counters to sessions and backfill them"""
+    add_column(conn, 'sessions', 'participant_count', 'INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'sessions', 'active_participant_count', 'INTEGER NOT NULL DEFAULT 0')
+    recompute_participant_counters(conn)
+
+def m007_history_last_seen(conn):
+    """Add last_seen to locations / user_positions for merged stationary fixes"""
+    add_column(conn, 'locations', 'last_seen', 'DATETIME')
+    add_column(conn, 'user_positions', 'last_seen', 'DATETIME')
+
+def m008_notification_kind(conn):
+    """Add kind to notifications, so automatic proximity alerts can be told from manual ones"""
+    add_column(conn, 'notifications', 'kind', "VARCHAR(20) NOT NULL DEFAULT 'alert'")
+
+def m009_incremental_auto_vacuum(conn):
+    """
+    Let retention hand freed pages back with PRAGMA incremental_vacuum (storage.py).
+    The mode only takes effect on an existing database after a full VACUUM, which
+    rewrites the file once. Runs before anything in the transaction writes, so the
+    driver has not opened a transaction yet and VACUUM is allowed.
+    """
+    if conn.dialect.name != 'sqlite' or conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+        return
+    conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.exec_driver_sql("VACUUM")
+
+def m010_session_archives(conn):
+    """Create session_archives, the cold store for ended sessions (see archive_session in app.py)"""
+    add_column(conn, 'sessions', 'ended_at', 'DATETIME')
+    add_column(conn, 'sessions', 'archived_at', 'DATETIME')
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS session_archives (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            user_id INTEGER,
+            guest_name VARCHAR(50),
+            joined_at DATETIME,
+            point_count INTEGER NOT NULL DEFAULT 0,
+            track BLOB NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES sessions (id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_session_archives_session ON session_archives (session_id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_session_archives_user ON session_archives (user_id)")
+
+def m011_location_streams(conn):
+    """Count batch sequence numbers per participant and upload stream instead of per participant"""
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS location_streams (
+            participant_id INTEGER NOT NULL,
+            stream_id VARCHAR(64) NOT NULL,
+            last_seq INTEGER NOT NULL,
+            PRIMARY KEY (participant_id, stream_id),
+            FOREIGN KEY (participant_id) REFERENCES session_participants (id)
+        )
+    """)
+    # Clients from before streams send none, which is stream ''
+    conn.exec_driver_sql("""
+        INSERT OR IGNORE INTO location_streams (participant_id, stream_id, last_seq)
+        SELECT participant_id, '', last_seq FROM participant_last_positions WHERE last_seq IS NOT NULL
+    """)
+
+def m012_session_participant_ids_never_reused(conn):
+    """
+    Make session_participants.id AUTOINCREMENT. Archiving deletes participant rows, and a
+    plain INTEGER PRIMARY KEY hands the highest freed id to the next join - so a stale
+    participant cookie would sign in as a stranger.
+    """
+    if not table_exists(conn, 'session_participants'):
+        return
+    table_sql = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'session_participants'"
+    ).scalar()
+    if 'AUTOINCREMENT' not in table_sql.upper():
+        conn.exec_driver_sql("""
+            CREATE TABLE session_participants_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER NOT NULL,
+                user_id INTEGER,
+                guest_name VARCHAR(50),
+                joined_at DATETIME,
+                is_active BOOLEAN,
+                FOREIGN KEY (session_id) REFERENCES sessions (id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        """)
+        conn.exec_driver_sql("""
+            INSERT INTO session_participants_new (id, session_id, user_id, guest_name, joined_at, is_active)
+            SELECT id, session_id, user_id, guest_name, joined_at, is_active
+            FROM session_participants
+        """)
+        conn.exec_driver_sql("DROP TABLE session_participants")
+        conn.exec_driver_sql("ALTER TABLE session_participants_new RENAME TO session_participants")
+        for name, table, columns in HOT_INDEXES:
+            if table == 'session_participants':
+                conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+    # Ids already archived (and so already deleted) must not come back either
+    high_water = conn.exec_driver_sql("""
+        SELECT MAX(COALESCE((SELECT MAX(id) FROM session_participants), 0),
+                   COALESCE((SELECT MAX(participant_id) FROM session_archives), 0))
+    """).scalar()
+    conn.exec_driver_sql("DELETE FROM sqlite_sequence WHERE name = 'session_participants'")
+    conn.exec_driver_sql(
+        "INSERT INTO sqlite_sequence (name, seq) VALUES ('session_participants', ?)", (high_water,)
+    )
+
+MIGRATIONS = [
+    (1, 'session_location_name', m001_session_location_name),
+    (2, 'notifications', m002_notifications),
+    (3, 'user_positions', m003_user_positions),
+    (4, 'last_positions', m004_last_positions),
+    (5, 'hot_query_indexes', m005_hot_query_indexes),
+    (6, 'session_participant_counters', m006_session_participant_counters),
+    (7, 'history_last_seen', m007_history_last_seen),
+    (8, 'notification_kind', m008_notification_kind),
+    (9, 'incremental_auto_vacuum', m009_incremental_auto_vacuum),
+    (10, 'session_archives', m010_session_archives),
+    (11, 'location_streams', m011_location_streams),
+    (12, 'session_participant_ids_never_reused', m012_session_participant_ids_never_reused),
+]
+
+
+# Runner
+
+def ensure_version_table(conn):
+    conn.exec_driver_sql("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+    """)
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        ensure_version_table(conn)
+        return {row[0] for row in conn.exec_driver_sql("SELECT version FROM schema_migrations")}
+
+def current_version(engine):
+    return max(applied_versions(engine), default=0)
+
+def upgrade(engine, verbose=False):
+    """Apply every pending migration, each in its own transaction. Returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, migration in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            migration(conn)
+            conn.exec_driver_sql(
+                "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.utcnow().isoformat())
+            )
+        applied.append(version)
+        if verbose:
+            print(f"✓ {version:03d} {name}")
+    return applied
+
+
+# Query plan check
+
+# Tables that grow with usage; a full scan of any of these in a hot endpoint is a regression
+HOT_TABLES = {'sessions', 'session_participants', 'locations', 'user_positions', 'notifications',
+              'participant_last_positions', 'user_last_positions', 'location_streams'}
+
+_TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+_NOT_ALIASES = {'WHERE', 'ON', 'USING', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL',
+                'ORDER', 'GROUP', 'HAVING', 'LIMIT', 'OFFSET', 'UNION', 'EXCEPT', 'INTERSECT', 'WINDOW'}
+
+def table_aliases(statement):
+    """
+    name -> set of tables for every table reference in ``statement``. EXPLAIN QUERY PLAN
+    names an aliased table by its alias only ("SCAN sp"), so plans are read through this.
+    """
+    aliases = {}
+    for table, alias in _TABLE_REFERENCE.findall(statement):
+        aliases.setdefault(table, set()).add(table)
+        if alias and alias.upper() not in _NOT_ALIASES:
+            aliases.setdefault(alias, set()).add(table)
+    return aliases
+
+def check_query_plans(verbose=True):
+    """
+    Drive the hot endpoints against a scratch database, run EXPLAIN QUERY PLAN on
+    every SELECT they issue and report any full scan of a hot table.
+    Returns a list of (endpoint, sql, plan detail) problems.
+    """
+    import os
+    import tempfile
+    import time
+    from sqlalchemy import event
+
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    scratch.close()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + scratch.name
+    from app import app, db
+
+    with app.app_context():
+        db.create_all()
+        upgrade(db.engine)
+        engine = db.engine
+
+    def login(client, name):
+        client.post('/api/register', json={'username': name, 'email': f'{name}@example.com', 'password': 'password123'})
+        client.post('/api/login', json={'username': name, 'password': 'password123'})
+
+    creator, joiner, guest = app.test_client(), app.test_client(), app.test_client()
+    login(creator, 'plan_creator')
+    login(joiner, 'plan_joiner')
+    code = creator.post('/api/create_session', json={'session_name': 'Plan check'}).get_json()['session']['session_code']
+    joiner.post('/api/join_session', json={'session_code': code})
+    guest.post('/api/join_session', json={'session_code': code, 'guest_name': 'plan_guest'})
+    participant_id = joiner.get('/api/get_participant_info').get_json()['participant_id']
+
+    now_ms = time.time() * 1000
+    hot_calls = [
+        ('update_location', lambda: joiner.post('/api/update_location', json={'latitude': 42.7, 'longitude': 23.3, 'accuracy': 5})),
+        ('update_locations_batch', lambda: guest.post('/api/update_locations_batch', json={
+            'sent_at': now_ms,
+            'fixes': [{'latitude': 42.7, 'longitude': 23.3, 'timestamp': now_ms, 'seq': 1}]
+        })),
+        ('get_participants', lambda: creator.get(f'/api/get_participants?code={code}')),
+        ('send_alert', lambda: guest.post('/api/send_alert')),
+        ('get_notifications', lambda: joiner.get('/api/get_notifications')),
+        ('get_user_positions', lambda: creator.get(f'/api/get_user_positions?participant_id={participant_id}&session_code={code}')),
+        ('get_sessions', lambda: creator.get('/api/get_sessions')),
+        ('get_joined_sessions', lambda: joiner.get('/api/get_joined_sessions')),
+        ('get_all_sessions_history', lambda: creator.get('/api/get_all_sessions_history')),
+    ]
+
+    captured = []
+    current = {'endpoint': None}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if current['endpoint'] and statement.lstrip().upper().startswith('SELECT') and not executemany:
+            captured.append((current['endpoint'], statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        for endpoint, call in hot_calls:
+            current['endpoint'] = endpoint
+            call()
+        current['endpoint'] = None
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    problems = []
+    # "SCAN t" is a full scan; "SCAN t USING [COVERING] INDEX ..." walks an index
+    scan = re.compile(r'^SCAN (\S+)')
+    with engine.connect() as conn:
+        for endpoint, statement, parameters in captured:
+            aliases = table_aliases(statement)
+            plan = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+            for row in plan:
+                detail = row[-1]
+                match = scan.match(detail)
+                if match and ' USING ' not in detail and aliases.get(match.group(1), {match.group(1)}) & HOT_TABLES:
+                    problems.append((endpoint, statement, detail))
+
+    os.unlink(scratch.name)
+
+    if verbose:
+        print(f"Checked {len(captured)} queries from {len(hot_calls)} hot endpoints")
+        for endpoint, statement, detail in problems:
+            print(f"\n❌ {endpoint}: {detail}\n   {' '.join(statement.split())}")
+        if not problems:
+            print("✅ No full table scans")
+    return problems
+
+
+if __name__ == '__main__':
+    if '--check-plans' in sys.argv:
+        sys.exit(1 if check_query_plans() else 0)
+
+    from app import app, db
+
+    with app.app_context():
+        db.create_all()
+        engine = db.engine
+
+        if '--status' in sys.argv:
+            done = applied_versions(engine)
+            for version, name, _ in MIGRATIONS:
+                print(f"{'✓' if version in done else ' '} {version:03d} {name}")
+            sys.exit(0)
+
+        print("=" * 60)
+        print("Hunt-Hunt-Planur - Database Migrations")
+        print("=" * 60)
+        applied = upgrade(engine, verbose=True)
+        if not applied:
+            print("Database is up to date.")
+        print(f"\n✅ Schema version: {current_version(engine)}")
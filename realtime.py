@@ -0,0 +1,299 @@
+"""
+Hunt-Hunt-Planur - In-process session event broker
+Fans out participant changes to Server-Sent Events streams, and caches
+responses that stay valid until the next event
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Every id handed out by this process carries the process start time, so a
+# Last-Event-ID from before a restart is recognised as unknown and triggers a resync
+BROKER_EPOCH = int(time.time())
+
+
+class SessionEvent:
+    """One published change, formatted lazily as an SSE frame"""
+
+    __slots__ = ('seq', 'event_type', 'data')
+
+    def __init__(self, seq, event_type, data):
+        self.seq = seq
+        self.event_type = event_type
+        self.data = data
+
+    @property
+    def event_id(self):
+        return f"{BROKER_EPOCH}-{self.seq}"
+
+    def to_sse(self):
+        return f"id: {self.event_id}\nevent: {self.event_type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class _Channel:
+    def __init__(self, history_size, seq):
+        self.condition = threading.Condition()
+        self.seq = seq
+        self.events = deque(maxlen=history_size)
+        self.subscribers = 0
+        self.dropped = False
+
+
+class SessionEventBroker:
+    """
+    Per-session ring buffer of recent events plus a condition to wake waiting streams.
+    A session's channel is dropped when its last subscriber leaves, or on ``close``
+    if it has none; a channel created again later numbers on from the highest
+    sequence number handed out so far, so versions and event ids never repeat.
+    """
+
+    def __init__(self, history_size=200):
+        self._history_size = history_size
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._listeners = []
+        self._high_seq = 0  # Highest seq of any channel, dropped ones included
+
+    def _channel(self, session_id):
+        with self._lock:
+            channel = self._channels.get(session_id)
+            if channel is None:
+                channel = _Channel(self._history_size, self._high_seq)
+                self._channels[session_id] = channel
+            return channel
+
+    def _drop(self, session_id, channel):
+        # Caller holds channel.condition, so no publish is halfway through this channel
+        with self._lock:
+            if self._channels.get(session_id) is channel:
+                del self._channels[session_id]
+        channel.dropped = True
+
+    def publish(self, session_id, event_type, data):
+        """Record an event for a session and wake everyone waiting on it"""
+        while True:
+            channel = self._channel(session_id)
+            with channel.condition:
+                if channel.dropped:
+                    continue
+                channel.seq += 1
+                with self._lock:
+                    self._high_seq = max(self._high_seq, channel.seq)
+                event = SessionEvent(channel.seq, event_type, data)
+                channel.events.append(event)
+                channel.condition.notify_all()
+                break
+        for listener in self._listeners:
+            try:
+                listener(session_id, event)
+            except Exception as e:
+                print(f"Event listener error: {e}")
+        return event
+
+    @contextmanager
+    def subscription(self, session_id):
+        """
+        Keep a session's channel (and its buffered events) while the block runs; the
+        last subscriber to leave drops it. Wrap anything that reads a version and
+        later waits or replays from it.
+        """
+        while True:
+            channel = self._channel(session_id)
+            with channel.condition:
+                if not channel.dropped:
+                    channel.subscribers += 1
+                    break
+        try:
+            yield
+        finally:
+            with channel.condition:
+                channel.subscribers -= 1
+                if channel.subscribers == 0:
+                    self._drop(session_id, channel)
+
+    def close(self, session_id):
+        """The session is over: drop its channel now, or when its last subscriber leaves"""
+        with self._lock:
+            channel = self._channels.get(session_id)
+        if channel is not None:
+            with channel.condition:
+                if channel.subscribers == 0:
+                    self._drop(session_id, channel)
+
+    def add_listener(self, listener):
+        """Call ``listener(session_id, event)`` after every publish, in the publishing thread"""
+        self._listeners.append(listener)
+
+    def version(self, session_id):
+        """Sequence number of the latest event published for a session"""
+        return self._channel(session_id).seq
+
+    def parse_event_id(self, event_id):
+        """Turn a Last-Event-ID header into a sequence number, or None if it is not ours"""
+        try:
+            epoch, seq = event_id.split('-', 1)
+            if int(epoch) != BROKER_EPOCH:
+                return None
+            return int(seq)
+        except (AttributeError, ValueError):
+            return None
+
+    def events_since(self, session_id, seq):
+        """
+        Return (events, complete) for everything published after ``seq``.
+        ``complete`` is False when some of those events already fell out of the buffer.
+        """
+        channel = self._channel(session_id)
+        with channel.condition:
+            return self._collect(channel, seq)
+
+    def wait(self, session_id, seq, timeout):
+        """Block until an event newer than ``seq`` is published or ``timeout`` elapses"""
+        channel = self._channel(session_id)
+        with channel.condition:
+            if channel.seq <= seq:
+                channel.condition.wait(timeout)
+            return self._collect(channel, seq)
+
+    @staticmethod
+    def _collect(channel, seq):
+        if seq >= channel.seq:
+            return [], True
+        events = [e for e in channel.events if e.seq > seq]
+        complete = bool(events) and events[0].seq == seq + 1
+        return events, complete
+
+
+class Snapshot:
+    """One rendered response, valid while its session is at ``version`` and until ``expires_at``"""
+
+    __slots__ = ('session_id', 'version', 'body', 'etag', 'expires_at')
+
+    def __init__(self, session_id, version, body, ttl=None):
+        self.session_id = session_id
+        self.version = version
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.expires_at = time.monotonic() + ttl if ttl is not None else None
+
+
+class SnapshotCache:
+    """
+    Latest Snapshot per key (e.g. session code), shared by every request in the
+    process. A snapshot goes stale as soon as anything is published for its
+    session, so writers only have to publish as they already do. Concurrent
+    rebuilds of one key share a single call of the builder, and its error.
+    """
+
+    def __init__(self, broker, max_entries=1024):
+        self.broker = broker
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def _fresh(self, snapshot):
+        return (snapshot is not None
+                and snapshot.version == self.broker.version(snapshot.session_id)
+                and (snapshot.expires_at is None or time.monotonic() < snapshot.expires_at))
+
+    def get(self, key):
+        """The cached snapshot for ``key`` if it is still fresh, else None"""
+        with self._lock:
+            snapshot = self._entries.get(key)
+        return snapshot if self._fresh(snapshot) else None
+
+    def get_or_build(self, key, build):
+        """
+        Fresh snapshot for ``key``, calling ``build()`` if there is none. ``build``
+        must read the broker version before the data it renders and returns a
+        Snapshot, or None for nothing to cache (which is passed through). If it raises,
+        every caller waiting on the same build gets that exception too.
+        """
+        snapshot = self.get(key)
+        if snapshot is not None:
+            return snapshot
+
+        with self._lock:
+            call = self._building.get(key)
+            leader = call is None
+            if leader:
+                call = self._building[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            snapshot = call['result'] = build()
+            if snapshot is not None:
+                with self._lock:
+                    self._entries[key] = snapshot
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            return snapshot
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._building[key]
+            call['done'].set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def sse_stream(broker, session_id, last_event_id=None, heartbeat=15, retry_ms=3000):
+    """
+    Generator producing an SSE response body for one subscriber.
+    Replays buffered events after ``last_event_id``; sends a ``resync`` event
+    when that is not possible and a comment line every ``heartbeat`` seconds.
+    """
+    yield f"retry: {retry_ms}\n\n"
+
+    with broker.subscription(session_id):
+        yield from _stream_events(broker, session_id, last_event_id, heartbeat)
+
+
+def _stream_events(broker, session_id, last_event_id, heartbeat):
+    seq = broker.parse_event_id(last_event_id) if last_event_id else None
+    if seq is None:
+        # New subscriber (or unknown id): start from the current head
+        seq = broker.version(session_id)
+        if last_event_id:
+            yield SessionEvent(seq, 'resync', {}).to_sse()
+    else:
+        events, complete = broker.events_since(session_id, seq)
+        if not complete:
+            seq = broker.version(session_id)
+            yield SessionEvent(seq, 'resync', {}).to_sse()
+        else:
+            for event in events:
+                yield event.to_sse()
+                seq = event.seq
+                if event.event_type == 'ended':
+                    return
+
+    while True:
+        events, complete = broker.wait(session_id, seq, heartbeat)
+        if not events:
+            yield ": heartbeat\n\n"
+            continue
+        if not complete:
+            seq = events[-1].seq
+            yield SessionEvent(seq, 'resync', {}).to_sse()
+            continue
+        for event in events:
+            yield event.to_sse()
+            seq = event.seq
+            if event.event_type == 'ended':
+                return
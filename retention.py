@@ -0,0 +1,91 @@
+"""
+Hunt-Hunt-Planur - Position history retention
+Set-based pruning of locations / user_positions, run by a background worker
+instead of on every update_location request
+"""
+
+import threading
+import time
+from sqlalchemy import text
+
+# (table, owner column, config key holding how many rows to keep per owner)
+RETENTION_RULES = [
+    ('locations', 'participant_id', 'RETENTION_LOCATIONS_PER_PARTICIPANT'),
+    ('user_positions', 'user_id', 'RETENTION_POSITIONS_PER_USER'),
+]
+
+
+def prune_table(engine, table, owner_column, keep, chunk_size=500):
+    """
+    Keep the newest ``keep`` rows per owner and delete the rest.
+    Ids are assigned in arrival order, so everything below the id of the
+    ``keep``-th newest row is surplus. Deletes run in chunks of ``chunk_size``,
+    each in its own short transaction, so writers are never blocked for long.
+    Returns the number of rows deleted.
+    """
+    with engine.connect() as conn:
+        owners = [row[0] for row in conn.execute(text(
+            f"SELECT {owner_column} FROM {table} "
+            f"GROUP BY {owner_column} HAVING COUNT(*) > :keep"
+        ), {'keep': keep})]
+
+    deleted = 0
+    for owner in owners:
+        with engine.connect() as conn:
+            cutoff = conn.execute(text(
+                f"SELECT id FROM {table} WHERE {owner_column} = :owner "
+                f"ORDER BY id DESC LIMIT 1 OFFSET :offset"
+            ), {'owner': owner, 'offset': keep - 1}).scalar()
+
+        if cutoff is None:
+            continue
+
+        while True:
+            with engine.begin() as conn:
+                result = conn.execute(text(
+                    f"DELETE FROM {table} WHERE id IN ("
+                    f"SELECT id FROM {table} WHERE {owner_column} = :owner AND id < :cutoff "
+                    f"LIMIT :chunk)"
+                ), {'owner': owner, 'cutoff': cutoff, 'chunk': chunk_size})
+            deleted += result.rowcount
+            if result.rowcount < chunk_size:
+                break
+
+    return deleted
+
+
+def prune_history(engine, config):
+    """Apply every retention rule; returns {table: rows deleted}"""
+    chunk_size = config.get('RETENTION_CHUNK_SIZE', 500)
+    return {
+        table: prune_table(engine, table, owner_column, config[keep_key], chunk_size)
+        for table, owner_column, keep_key in RETENTION_RULES
+    }
+
+
+class PeriodicWorker(threading.Thread):
+    """Daemon thread calling ``job`` every ``interval`` seconds (the first time after ``delay``) until stopped"""
+
+    def __init__(self, job, interval, name='periodic-worker', delay=None):
+        super().__init__(name=name, daemon=True)
+        self.job = job
+        self.interval = interval
+        self.delay = interval if delay is None else delay
+        self._stop_event = threading.Event()
+
+    def run(self):
+        wait = self.delay
+        while not self._stop_event.wait(wait):
+            wait = self.interval
+            started = time.monotonic()
+            try:
+                self.job()
+            except Exception as e:
+                print(f"{self.name} error: {e}")
+                continue
+            elapsed = time.monotonic() - started
+            if elapsed > self.interval:
+                print(f"{self.name}: run took {elapsed:.1f}s, longer than the {self.interval}s interval")
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,125 @@
+"""
+Hunt-Hunt-Planur - Production server
+Serves the app with gunicorn's threaded workers instead of the Werkzeug
+development server that `python app.py` starts.
+
+Usage:
+    python serve.py [--workers 1] [--threads 100] [--port 5000]
+
+HTTPS uses cert.pem / key.pem when both exist, like app.py. `kill -HUP <pid>`
+applies pending migrations, starts workers running the current code and lets
+the old ones finish their requests; `kill -TERM <pid>` stops gracefully.
+"""
+
+import argparse
+import os
+import ssl
+import subprocess
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def upgrade_database(server):
+    """
+    Create tables and apply pending migrations before workers start. Runs in a
+    child process so the arbiter never imports the app and HUP loads fresh code.
+    """
+    subprocess.run([sys.executable, os.path.join(BASE_DIR, 'migrations.py')], check=True)
+
+
+def start_worker_threads(worker):
+    """Background workers and, with a single process, the WebSocket gateway"""
+    from app import app, start_background_workers, start_websocket_gateway
+
+    start_background_workers()
+    if app.config['SERVE_WORKERS'] > 1 and app.config['PROXIMITY_ALERTS'] != 'off':
+        worker.log.info('Proximity alerts disabled with more than one worker process')
+    if not app.config['WEBSOCKET_ENABLED']:
+        return
+    if app.config['SERVE_WORKERS'] > 1:
+        # Rooms are per process and only one process can own the port: clients use polling
+        worker.log.info('WebSocket gateway disabled with more than one worker process')
+        return
+    gateway_ssl = None
+    if worker.cfg.certfile:
+        gateway_ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        gateway_ssl.load_cert_chain(worker.cfg.certfile, worker.cfg.keyfile)
+    try:
+        # reuse_port: after a HUP the new worker binds while the old one is still draining
+        gateway = start_websocket_gateway(gateway_ssl, reuse_port=True)
+        worker.log.info('WebSocket gateway on port %s', gateway.port)
+    except OSError as e:
+        worker.log.error('WebSocket gateway not started: %s', e)
+
+
+def stop_worker_threads(server, worker):
+    import app
+
+    if app.websocket_gateway:
+        app.websocket_gateway.stop()
+
+
+class Server(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        app.debug = False
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hunt-Hunt-Planur production server')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVE_WORKERS') or 1),
+                        help='processes; realtime features need 1 (default)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVE_THREADS') or 100),
+                        help='threads per process; every open event stream or held long-poll occupies one')
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds old workers get to finish requests on restart / shutdown')
+    parser.add_argument('--http', action='store_true', help='plain HTTP even if cert.pem / key.pem exist')
+    args = parser.parse_args()
+
+    # Read by config.py when the workers import the app
+    os.environ['SERVE_WORKERS'] = str(args.workers)
+    os.environ['SERVE_THREADS'] = str(args.threads)
+
+    options = {
+        'bind': f'{args.host}:{args.port}',
+        'workers': args.workers,
+        'worker_class': 'gthread',
+        'threads': args.threads,
+        # Idle keep-alive connections wait in the worker's poller, not on a thread
+        'worker_connections': 10000,
+        'keepalive': 30,
+        'timeout': 60,
+        'graceful_timeout': args.graceful_timeout,
+        'chdir': BASE_DIR,
+        'on_starting': upgrade_database,
+        'on_reload': upgrade_database,
+        'post_worker_init': start_worker_threads,
+        'worker_exit': stop_worker_threads,
+    }
+    cert_file = os.path.join(BASE_DIR, 'cert.pem')
+    key_file = os.path.join(BASE_DIR, 'key.pem')
+    if not args.http and os.path.exists(cert_file) and os.path.exists(key_file):
+        options['certfile'] = cert_file
+        options['keyfile'] = key_file
+
+    scheme = 'https' if 'certfile' in options else 'http'
+    print(f"Serving on {scheme}://{args.host}:{args.port}/ with {args.workers} worker(s) x {args.threads} threads")
+    Server(options).run()
+
+
+if __name__ == '__main__':
+    main()
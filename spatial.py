@@ -0,0 +1,253 @@
+"""
+Hunt-Hunt-Planur - Spatial index
+Current participant positions bucketed into a uniform grid per session, so
+"who is near this point" only looks at the cells around it, and the proximity
+state built on top of it
+"""
+
+import math
+import threading
+import time
+
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres"""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """
+    Points keyed by id in cells ``cell_m`` tall and as many degrees wide. Cells
+    narrow east-west away from the equator, so searches widen their column range
+    to match; columns past ±180° wrap around to the other side. Searches that reach
+    a polar cap check every occupied cell instead.
+    """
+
+    def __init__(self, cell_m=250):
+        self.cell_m = cell_m
+        self.cell_deg = cell_m / METRES_PER_DEGREE
+        # Columns a search can only reach directly. Past them it may come around the
+        # antimeridian, and the columns next to it may be reached both ways
+        self._first_col = math.ceil(-180 / self.cell_deg) + 1
+        self._last_col = math.floor(180 / self.cell_deg) - 2
+        self.loaded = False  # Set once filled from the database (see app.load_participant_grid)
+        self._cells = {}   # (row, col) -> {key: (latitude, longitude, data)}
+        self._points = {}  # key -> (row, col)
+        self._lock = threading.Lock()
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg)
+
+    def update(self, key, latitude, longitude, data=None, replace=True):
+        """Insert or move a point; with ``replace=False`` an existing point is left alone"""
+        cell = self._cell(latitude, longitude)
+        with self._lock:
+            previous = self._points.get(key)
+            if previous is not None:
+                if not replace:
+                    return
+                if previous != cell:
+                    self._discard(previous, key)
+            self._points[key] = cell
+            self._cells.setdefault(cell, {})[key] = (latitude, longitude, data)
+
+    def remove(self, key):
+        with self._lock:
+            cell = self._points.pop(key, None)
+            if cell is not None:
+                self._discard(cell, key)
+
+    def _discard(self, cell, key):
+        bucket = self._cells[cell]
+        del bucket[key]
+        if not bucket:
+            del self._cells[cell]
+
+    def get(self, key):
+        """(latitude, longitude, data) of a point, or None"""
+        with self._lock:
+            cell = self._points.get(key)
+            return self._cells[cell][key] if cell is not None else None
+
+    def __len__(self):
+        return len(self._points)
+
+    def _columns(self, c):
+        """Columns holding the longitudes [c, c + 1) * cell_deg, taken modulo 360°"""
+        west, east = c * self.cell_deg, (c + 1) * self.cell_deg
+        columns = set()
+        if east > -180 and west <= 180:
+            columns.add(c)
+        if west < -180:
+            columns.update(range(math.floor((west + 360) / self.cell_deg),
+                                 math.floor((min(east, -180) + 360) / self.cell_deg) + 1))
+        if east > 180:
+            columns.update(range(math.floor((max(west, 180) - 360) / self.cell_deg),
+                                 math.floor((east - 360) / self.cell_deg) + 1))
+        return columns
+
+    def nearby(self, latitude, longitude, radius_m=None, k=None):
+        """
+        [(distance_m, key, latitude, longitude, data)] sorted by distance: every
+        point within ``radius_m``, the ``k`` nearest, or the ``k`` nearest within
+        ``radius_m``.
+
+        Searches rectangles of cells growing outwards from the query point. After
+        ``rings`` rows each way, every point within ``rings * cell_m`` has been seen,
+        so the search stops once that covers the radius or the k-th distance found.
+        """
+        if radius_m is None and k is None:
+            raise ValueError('nearby() needs radius_m, k or both')
+        row, col = self._cell(latitude, longitude)
+        candidates = []
+        visited = set()  # Cells near or across the antimeridian, which several columns can lead to
+
+        with self._lock:
+            total = len(self._points)
+            seen = 0
+            rings = 0
+            cols = -1
+            while True:
+                # Columns needed so the rectangle reaches rings * cell_m east and west too,
+                # measured at its latitude farthest from the equator
+                edge = abs(latitude) + (rings + 1) * self.cell_deg
+                everywhere = edge >= 89.9  # Around the pole every longitude is close
+                if not everywhere:
+                    new_cols = math.ceil(rings / math.cos(math.radians(edge)))
+                    everywhere = (2 * new_cols + 1) * self.cell_deg >= 360
+                    new_cells = (2 * rings + 1) * (2 * new_cols + 1) - max(0, 2 * rings - 1) * (2 * cols + 1)
+
+                if everywhere or new_cells > len(self._cells):
+                    # Sparse or far-flung points: checking every occupied cell is cheaper
+                    candidates = [(haversine_m(latitude, longitude, lat, lon), key, lat, lon, data)
+                                  for bucket in self._cells.values()
+                                  for key, (lat, lon, data) in bucket.items()]
+                    break
+
+                for r in range(row - rings, row + rings + 1):
+                    inner = abs(r - row) < rings  # Row already searched out to the old column range
+                    for c in range(col - new_cols, col + new_cols + 1):
+                        if inner and abs(c - col) <= cols:
+                            continue
+                        if self._first_col <= c <= self._last_col:
+                            cells = ((r, c),)
+                        else:
+                            cells = [(r, wrapped) for wrapped in self._columns(c) if (r, wrapped) not in visited]
+                            visited.update(cells)
+                        for cell in cells:
+                            bucket = self._cells.get(cell)
+                            if bucket:
+                                seen += len(bucket)
+                                candidates.extend((haversine_m(latitude, longitude, lat, lon), key, lat, lon, data)
+                                                  for key, (lat, lon, data) in bucket.items())
+                cols = new_cols
+
+                covered = rings * self.cell_m
+                if seen == total or (radius_m is not None and covered >= radius_m):
+                    break
+                if k is not None and len(candidates) >= k and \
+                        sorted(c[0] for c in candidates)[k - 1] <= covered:
+                    break
+                rings += 1
+
+        if radius_m is not None:
+            candidates = [c for c in candidates if c[0] <= radius_m]
+        candidates.sort(key=lambda c: c[0])
+        return candidates[:k] if k is not None else candidates
+
+
+class SessionGrids:
+    """One GridIndex per session, created on first use"""
+
+    def __init__(self, cell_m=250):
+        self.cell_m = cell_m
+        self._grids = {}
+        self._lock = threading.Lock()
+
+    def grid(self, session_id):
+        with self._lock:
+            grid = self._grids.get(session_id)
+            if grid is None:
+                grid = self._grids[session_id] = GridIndex(self.cell_m)
+            return grid
+
+    def drop(self, session_id):
+        with self._lock:
+            self._grids.pop(session_id, None)
+
+
+class ProximityMonitor:
+    """
+    Which pairs of participants are near each other, with hysteresis: a pair comes
+    near within ``enter_m`` and only counts as apart again beyond ``exit_m``, so
+    GPS jitter around the threshold does not re-trigger it. Entering alerts at most
+    once per ``cooldown_s`` per pair. Only the participant that moved is evaluated,
+    against the neighbours the caller found for it (e.g. GridIndex.nearby within ``exit_m``).
+    """
+
+    def __init__(self, enter_m=50, exit_m=100, cooldown_s=600):
+        self.enter_m = enter_m
+        self.exit_m = max(exit_m, enter_m)
+        self.cooldown_s = cooldown_s
+        self._near = {}        # session_id -> {participant_id: set of participant ids near it}
+        self._alerted_at = {}  # (session_id, low id, high id) -> monotonic time of the last alert
+        self._lock = threading.Lock()
+
+    def update(self, session_id, participant_id, neighbours, scope=None):
+        """
+        ``neighbours``: [(distance_m, other_id)] for everyone within ``exit_m`` of
+        the participant that moved. ``scope``, if given, is the set of other ids
+        this evaluation covered; near pairs outside it are left alone.
+        Returns [(other_id, distance_m)] for pairs that just came near and should alert.
+        """
+        now = time.monotonic()
+        alerts = []
+        with self._lock:
+            near = self._near.setdefault(session_id, {})
+            mine = near.setdefault(participant_id, set())
+            within = {}
+            for distance, other_id in neighbours:
+                if other_id != participant_id and distance <= self.exit_m:
+                    within[other_id] = distance
+
+            # Pairs that drifted beyond exit_m (or whose partner was not in range at all)
+            for other_id in list(mine):
+                if other_id not in within and (scope is None or other_id in scope):
+                    self._release(near, participant_id, other_id)
+
+            for other_id, distance in within.items():
+                if distance > self.enter_m or other_id in mine:
+                    continue
+                mine.add(other_id)
+                near.setdefault(other_id, set()).add(participant_id)
+                pair = (session_id, min(participant_id, other_id), max(participant_id, other_id))
+                last = self._alerted_at.get(pair)
+                if last is None or now - last >= self.cooldown_s:
+                    self._alerted_at[pair] = now
+                    alerts.append((other_id, distance))
+        return alerts
+
+    @staticmethod
+    def _release(near, a, b):
+        near.get(a, set()).discard(b)
+        near.get(b, set()).discard(a)
+
+    def forget(self, session_id, participant_id):
+        """Drop a participant that left; their pairs count as apart"""
+        with self._lock:
+            near = self._near.get(session_id, {})
+            for other_id in near.pop(participant_id, set()):
+                near.get(other_id, set()).discard(participant_id)
+
+    def drop(self, session_id):
+        with self._lock:
+            self._near.pop(session_id, None)
+            for pair in [pair for pair in self._alerted_at if pair[0] == session_id]:
+                del self._alerted_at[pair]
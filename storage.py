@@ -0,0 +1,74 @@
+"""
+Hunt-Hunt-Planur - SQLite storage profile
+Pragmas applied to every new connection, and the maintenance that keeps the
+query planner's statistics fresh and hands pruned pages back to the filesystem
+"""
+
+from sqlalchemy import event
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def configure_sqlite(engine, pragmas):
+    """
+    Run ``PRAGMA name = value`` for each of ``pragmas`` on every connection the
+    engine opens. ``pragmas`` is read at connect time, so changes to the dict
+    apply to connections opened afterwards. Does nothing for other databases.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+def optimize(engine):
+    """
+    Refresh planner statistics: a full ANALYZE the first time (there is nothing to
+    go on yet), PRAGMA optimize afterwards, which only re-analyzes tables that
+    changed enough to matter. Returns the statement run.
+    """
+    if engine.dialect.name != 'sqlite':
+        return None
+    with engine.connect() as conn:
+        analyzed = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+        ).fetchone()
+        statement = 'PRAGMA optimize' if analyzed else 'ANALYZE'
+        conn.exec_driver_sql(statement)
+        conn.commit()
+    return statement
+
+
+def reclaim_free_pages(engine, chunk_pages=1000):
+    """
+    Return free pages to the filesystem with incremental vacuum, ``chunk_pages``
+    at a time so each step holds the write lock only briefly. Needs
+    auto_vacuum = INCREMENTAL (migration 9); otherwise does nothing.
+    Returns the number of pages freed.
+    """
+    if engine.dialect.name != 'sqlite':
+        return 0
+    freed = 0
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return 0
+        while True:
+            free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free:
+                break
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({min(free, chunk_pages)})")
+            conn.commit()
+            remaining = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if remaining >= free:
+                break
+            freed += free - remaining
+    return freed
@@ -0,0 +1,131 @@
+"""
+Tests for the Nominatim client against a local HTTP stand-in
+No network access needed
+
+    python -m pytest -q test_geocoding.py
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from geocoding import NominatimGeocoder
+
+MILAN = {
+    'display_name': 'Brera, Milan, Lombardy, Italy',
+    'address': {'neighbourhood': 'Brera', 'city': 'Milan', 'state': 'Lombardy', 'country': 'Italy'}
+}
+
+
+class FakeNominatim(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so connection reuse is visible
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.client_ports.add(self.client_address[1])
+        if server.delay:
+            time.sleep(server.delay)
+        body = json.dumps(MILAN).encode() if server.status == 200 else b'{}'
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeNominatim)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.client_ports = set()
+    server.status = 200
+    server.delay = 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/reverse'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(upstream, **kwargs):
+    options = {'rate': 1000, 'burst': 1000, 'max_wait': 5}
+    options.update(kwargs)
+    return NominatimGeocoder(url=upstream.url, **options)
+
+
+def test_formats_address_and_reuses_connection(upstream):
+    geocoder = make_client(upstream)
+
+    names = [geocoder.reverse(45.47 + i * 0.01, 9.18) for i in range(5)]
+
+    assert names == ['Brera, Milan, Italy'] * 5
+    assert upstream.requests == 5
+    assert len(upstream.client_ports) == 1
+
+
+def test_concurrent_lookups_for_one_cell_share_a_request(upstream):
+    upstream.delay = 0.3
+    geocoder = make_client(upstream)
+    results = []
+
+    threads = [threading.Thread(target=lambda: results.append(geocoder.reverse(45.4719, 9.1875)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == ['Brera, Milan, Italy'] * 8
+    assert upstream.requests == 1
+
+
+def test_rate_limit_spaces_requests(upstream):
+    geocoder = make_client(upstream, rate=10, burst=1)
+
+    started = time.monotonic()
+    for i in range(4):
+        geocoder.reverse(45.0 + i, 9.0)
+    elapsed = time.monotonic() - started
+
+    assert upstream.requests == 4
+    assert elapsed >= 0.3 - 0.05
+
+
+def test_rate_limit_gives_up_after_max_wait(upstream):
+    geocoder = make_client(upstream, rate=0.1, burst=1, max_wait=0.1)
+
+    assert geocoder.reverse(45.0, 9.0) == 'Brera, Milan, Italy'
+    assert geocoder.reverse(46.0, 9.0) is None
+    assert upstream.requests == 1
+
+
+def test_circuit_breaker_fails_fast_then_recovers(upstream):
+    upstream.status = 503
+    geocoder = make_client(upstream, failure_threshold=3, reset_timeout=0.2)
+
+    for i in range(3):
+        assert geocoder.reverse(45.0 + i, 9.0) is None
+    assert upstream.requests == 3
+    assert geocoder.breaker.is_open
+
+    # Open: no upstream traffic at all
+    for i in range(5):
+        assert geocoder.reverse(50.0 + i, 9.0) is None
+    assert upstream.requests == 3
+
+    # After the reset timeout one trial request goes through and closes the circuit
+    upstream.status = 200
+    time.sleep(0.25)
+    assert geocoder.reverse(60.0, 9.0) == 'Brera, Milan, Italy'
+    assert not geocoder.breaker.is_open
+    assert upstream.requests == 4
@@ -0,0 +1,261 @@
+"""
+Tests for location ingest: batch upload sequence numbers, stationary fix suppression,
+participant cookies outliving an archived session, the review window archiving keeps and
+fixes from people no longer in a running session, the group commit writer's timeout and
+creator-only proximity alerts
+Runs against a scratch SQLite database (conftest.py); no server needed
+
+    python -m pytest -q test_locations.py
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from ingest import GroupCommitWriter
+from app import (app, db, run_archive, session_events, ws_receive, creator_participants,
+                 Location, Notification, Session, SessionParticipant)
+
+pytestmark = pytest.mark.usefixtures('scratch_database')
+
+
+def signed_in(name):
+    """Client of a fresh registered user"""
+    client = app.test_client()
+    client.post('/api/register', json={'username': name, 'email': f'{name}@example.com',
+                                       'password': 'password123'})
+    client.post('/api/login', json={'username': name, 'password': 'password123'})
+    return client
+
+
+def new_session(name, creator=None):
+    """Code of a new session created by ``creator``, or by a fresh registered user"""
+    creator = creator or signed_in(name)
+    return creator.post('/api/create_session', json={'session_name': name}).get_json()['session']['session_code']
+
+
+def join(code, guest_name):
+    client = app.test_client()
+    participant_id = client.post('/api/join_session', json={'session_code': code, 'guest_name': guest_name}
+                                 ).get_json()['participant_id']
+    return client, participant_id
+
+
+def stored_rows(participant_id):
+    with app.app_context():
+        return Location.query.filter_by(participant_id=participant_id).order_by(Location.id).all()
+
+
+def batch(client, stream, seqs, latitude=45.46):
+    now_ms = time.time() * 1000
+    fixes = [{'latitude': latitude + seq * 0.01, 'longitude': 9.19, 'accuracy': 5,
+              'timestamp': now_ms - (len(seqs) - i) * 1000, 'seq': seq} for i, seq in enumerate(seqs)]
+    return client.post('/api/update_locations_batch',
+                       json={'stream': stream, 'sent_at': now_ms, 'fixes': fixes}).get_json()
+
+
+def test_batch_retries_are_skipped_per_stream():
+    code = new_session('streams_creator')
+    phone, participant_id = join(code, 'walker')
+    tablet, same_participant_id = join(code, 'walker')
+    assert same_participant_id == participant_id
+
+    first = batch(phone, 'phone', range(1, 11))
+    assert (first['accepted'], first['last_seq']) == (10, 10)
+
+    # A retry of part of that batch stores nothing new
+    retry = batch(phone, 'phone', range(8, 12))
+    assert (retry['accepted'], retry['duplicates'], retry['last_seq']) == (1, 3, 11)
+
+    # Another device counts from 1 on its own stream and is not mistaken for a retry
+    other = batch(tablet, 'tablet', range(1, 4), latitude=46.46)
+    assert (other['accepted'], other['duplicates'], other['last_seq']) == (3, 0, 3)
+    assert len(stored_rows(participant_id)) == 14
+
+
+def test_still_fixes_extend_one_row_and_a_move_adds_another():
+    code = new_session('still_creator')
+    client, participant_id = join(code, 'sitter')
+
+    def post(latitude, longitude):
+        response = client.post('/api/update_location', json={'latitude': latitude, 'longitude': longitude,
+                                                              'accuracy': 8})
+        assert response.get_json()['success']
+
+    # GPS noise of a few metres around one spot
+    for i in range(6):
+        post(45.46420 + (i % 3) * 0.00002, 9.19000 - (i % 2) * 0.00002)
+    rows = stored_rows(participant_id)
+    assert len(rows) == 1
+    assert rows[0].last_seen is not None and rows[0].last_seen > rows[0].timestamp
+    first_last_seen = rows[0].last_seen
+
+    post(45.46421, 9.19001)
+    rows = stored_rows(participant_id)
+    assert len(rows) == 1
+    assert rows[0].last_seen > first_last_seen
+
+    # Beyond STATIONARY_MAX_RADIUS_M from the stored fix: a new row
+    post(45.46420 + 2 * app.config['STATIONARY_MAX_RADIUS_M'] / 111320, 9.19000)
+    rows = stored_rows(participant_id)
+    assert len(rows) == 2
+    assert rows[1].last_seen is None
+
+
+def test_cookie_of_an_archived_participant_is_not_reused():
+    code = new_session('archived_creator')
+    stale, stale_id = join(code, 'leaver')
+    end_long_ago(code, datetime.utcnow() - timedelta(seconds=app.config['ARCHIVE_AFTER_SECONDS'] + 60))
+    assert run_archive()['sessions'] >= 1
+
+    # The archived row held the highest id; the next join must not be handed it again
+    newcomer, newcomer_id = join(new_session('next_creator'), 'newcomer')
+    assert newcomer_id > stale_id
+
+    response = stale.post('/api/update_location', json={'latitude': 45.46, 'longitude': 9.19, 'accuracy': 5})
+    assert response.status_code == 404
+    assert stale.get('/api/get_participant_info').status_code != 200
+    assert stored_rows(newcomer_id) == []
+
+
+def end_long_ago(code, ended_at):
+    with app.app_context():
+        ended = Session.query.filter_by(session_code=code).first()
+        ended.is_active = False
+        ended.ended_at = ended_at
+        SessionParticipant.query.filter_by(session_id=ended.id).update({'is_active': False})
+        db.session.commit()
+
+
+def test_review_keeps_the_track_from_before_a_rejoin():
+    creator = signed_in('rejoin_creator')
+    code = new_session('rejoin_creator', creator)
+    walker = signed_in('rejoin_walker')
+    participant_id = walker.post('/api/join_session', json={'session_code': code}).get_json()['participant_id']
+
+    def post(latitude):
+        assert walker.post('/api/update_location', json={'latitude': latitude, 'longitude': 9.19,
+                                                        'accuracy': 5}).get_json()['success']
+
+    post(45.46)
+    walker.post('/api/leave_session')
+    time.sleep(0.01)
+    # Rejoining resets joined_at
+    assert walker.post('/api/join_session', json={'session_code': code}).get_json()['participant_id'] == participant_id
+    post(45.56)
+    end_long_ago(code, datetime.utcnow())
+
+    track = creator.get(f'/api/get_user_positions?participant_id={participant_id}'
+                        f'&session_code={code}&review_mode=true').get_json()
+    assert [p['latitude'] for p in track['positions']] == [45.46, 45.56]
+
+
+def test_sessions_ended_before_ended_at_are_not_archived():
+    code = new_session('legacy_creator')
+    join(code, 'legacy_guest')
+    end_long_ago(code, None)
+    run_archive()
+    with app.app_context():
+        assert Session.query.filter_by(session_code=code).first().archived_at is None
+
+
+def test_fixes_from_removed_participants_and_ended_sessions_are_rejected():
+    code = new_session('gone_creator')
+    removed, removed_id = join(code, 'removed')
+    stays, stays_id = join(code, 'stays')
+    with app.app_context():
+        SessionParticipant.query.get(removed_id).is_active = False
+        db.session.commit()
+        session_id = Session.query.filter_by(session_code=code).first().id
+    version = session_events.version(session_id)
+
+    fix = {'latitude': 45.46, 'longitude': 9.19, 'accuracy': 5}
+    assert removed.post('/api/update_location', json=fix).status_code == 404
+    assert 'error' == ws_receive(removed_id, dict(fix, type='location'))['type']
+    assert stays.post('/api/update_location', json=fix).status_code == 200
+
+    end_long_ago(code, datetime.utcnow())
+    assert stays.post('/api/update_location', json=fix).status_code == 404
+    assert stays.post('/api/update_locations_batch', json={
+        'stream': 'phone', 'fixes': [dict(fix, seq=1)]}).status_code == 404
+    assert stays.post('/api/stop_sharing').status_code == 200
+
+    # stop_sharing still clears what was stored, without telling the ended session
+    assert stored_rows(removed_id) == stored_rows(stays_id) == []
+    # Only the one fix from while the session was running reached the stream
+    assert session_events.version(session_id) == version + 1
+
+
+def test_writer_submit_times_out_and_a_dead_writer_is_replaced():
+    started, release = threading.Event(), threading.Event()
+    applied = []
+
+    def apply(items):
+        if 'stuck' in items:
+            started.set()
+            release.wait()
+        if 'crash' in items:
+            raise SystemExit
+        applied.extend(items)
+        return items
+
+    writer = GroupCommitWriter(apply, max_delay_s=0, timeout_s=0.05)
+    try:
+        threading.Thread(target=lambda: writer.submit('stuck', timeout=5), daemon=True).start()
+        started.wait(5)
+        with pytest.raises(TimeoutError):
+            writer.submit('queued behind')
+        release.set()
+        assert writer.submit('next', timeout=5) == 'next'
+        # Given up on before the writer reached it: never applied
+        assert applied == ['stuck', 'next']
+
+        # Fails its caller without taking the writer down
+        with pytest.raises(RuntimeError):
+            writer.submit('crash', timeout=5)
+        assert writer.submit('survived', timeout=5) == 'survived'
+
+        # A writer thread that died anyway is replaced
+        writer._queue.put(GroupCommitWriter._STOP)
+        writer._thread.join(5)
+        assert writer.submit('after restart', timeout=5) == 'after restart'
+    finally:
+        writer.stop()
+
+
+def test_creator_mode_alerts_only_for_the_creator(monkeypatch):
+    monkeypatch.setitem(app.config, 'PROXIMITY_ALERTS', 'creator')
+    creator = signed_in('near_creator')
+    code = new_session('near_creator', creator)
+    first, _ = join(code, 'first')
+    second, _ = join(code, 'second')
+    with app.app_context():
+        session_id = Session.query.filter_by(session_code=code).first().id
+
+    def post(client, metres_north):
+        assert client.post('/api/update_location', json={'latitude': 45.46 + metres_north / 111320,
+                                                         'longitude': 9.19, 'accuracy': 5}).get_json()['success']
+
+    def alerts():
+        with app.app_context():
+            return [n.message for n in Notification.query.filter_by(session_id=session_id, kind='proximity')]
+
+    # Before the creator has joined there is no one to be near
+    post(first, 1000)
+    creator.post('/api/join_session', json={'session_code': code})
+    post(creator, 0)
+    # Two guests together, far from the creator
+    post(second, 1010)
+    assert alerts() == []
+
+    post(first, 20)
+    assert alerts() == ['first is 20 m from near_creator']
+    post(first, 25)
+    post(second, 30)
+    assert len(alerts()) == 2
+
+    assert session_id in creator_participants
+    creator.post('/api/end_session', json={'session_code': code})
+    assert session_id not in creator_participants
@@ -0,0 +1,178 @@
+"""
+Query budget tests for the dashboard / history endpoints and participant polling
+Runs against a scratch SQLite database (conftest.py); no server needed
+
+    python -m pytest -q test_query_budget.py
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import app, db, run_archive, User, Session, SessionParticipant, Location, UserPosition
+from migrations import table_aliases
+
+ENDPOINTS = [
+    '/api/get_sessions',
+    '/api/get_joined_sessions',
+    '/api/get_all_sessions_history',
+]
+
+
+pytestmark = pytest.mark.usefixtures('scratch_database')
+
+
+def seed_user(username, session_count):
+    """User with ``session_count`` created and ``session_count`` joined active sessions"""
+    client = app.test_client()
+    client.post('/api/register', json={'username': username,
+                                       'email': f'{username}@example.com',
+                                       'password': 'password123'})
+    client.post('/api/login', json={'username': username, 'password': 'password123'})
+    with app.app_context():
+        user = User.query.filter_by(username=username).first()
+        other = User(username=f'{username}_other', email=f'{username}_other@example.com',
+                     password_hash='x')
+        db.session.add(other)
+        db.session.flush()
+        for i in range(session_count):
+            for creator in (user, other):
+                s = Session(session_code=f'{creator.id:03d}{i:05d}', creator_id=creator.id,
+                            session_name=f'Session {i}')
+                db.session.add(s)
+                db.session.flush()
+                db.session.add(SessionParticipant(session_id=s.id, user_id=user.id))
+                db.session.add(SessionParticipant(session_id=s.id, user_id=other.id))
+                db.session.add(SessionParticipant(session_id=s.id, guest_name='guest'))
+        db.session.commit()
+    return client
+
+
+def count_queries(client, url, status=200, **kwargs):
+    statements = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        response = client.get(url, **kwargs)
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
+    assert response.status_code == status
+    return len(statements), response
+
+
+@pytest.mark.parametrize('url', ENDPOINTS)
+def test_query_count_does_not_grow_with_sessions(url):
+    small_client = seed_user(f'small{ENDPOINTS.index(url)}', 1)
+    large_client = seed_user(f'large{ENDPOINTS.index(url)}', 30)
+
+    small_queries, small_response = count_queries(small_client, url)
+    large_queries, large_response = count_queries(large_client, url)
+
+    assert len(large_response.get_json()['sessions']) > len(small_response.get_json()['sessions'])
+    assert small_queries == 1
+    assert large_queries == 1
+
+
+def test_participant_polls_share_one_snapshot_until_a_change():
+    poller = seed_user('poller', 1)
+    with app.app_context():
+        creator = User.query.filter_by(username='poller').first()
+        code = Session.query.filter_by(creator_id=creator.id).first().session_code
+    url = f'/api/get_participants?code={code}'
+
+    first_queries, first = count_queries(poller, url)
+    etag = first.headers['ETag']
+    assert first_queries > 0
+    assert len(first.get_json()['participants']) == 3
+
+    # Unchanged: a conditional poll is a 304, a plain one is served from the snapshot
+    revalidate_queries, _ = count_queries(poller, url, status=304, headers={'If-None-Match': etag})
+    other_queries, other = count_queries(app.test_client(), url)
+    assert revalidate_queries == 0
+    assert other_queries == 0
+    assert other.headers['ETag'] == etag
+
+    # A join is published for the session, so the next poll is rebuilt
+    app.test_client().post('/api/join_session', json={'session_code': code, 'guest_name': 'late'})
+    changed_queries, changed = count_queries(poller, url, headers={'If-None-Match': etag})
+    assert changed_queries > 0
+    assert changed.headers['ETag'] != etag
+    assert len(changed.get_json()['participants']) == 4
+
+
+def test_archived_sessions_read_like_hot_ones():
+    archiver = seed_user('archiver', 1)
+    with app.app_context():
+        user = User.query.filter_by(username='archiver').first()
+        sessions = Session.query.join(SessionParticipant).filter(SessionParticipant.user_id == user.id).all()
+        now = datetime.utcnow()
+        for k, s in enumerate(sessions):
+            # As end_session leaves them, an hour long and over long enough ago to archive
+            began = now - timedelta(hours=3 + 2 * k)
+            s.is_active = False
+            s.created_at = began
+            s.ended_at = began + timedelta(hours=1)
+            for p in SessionParticipant.query.filter_by(session_id=s.id):
+                p.is_active = False
+                p.joined_at = began
+                # Sub-second times, fractional and unknown accuracy, merged stationary fixes
+                for i in range(8):
+                    timestamp = began + timedelta(seconds=60 * i + 0.375 + p.id)
+                    fix = dict(latitude=45.4642 + 0.00037 * i - 0.01 * k, longitude=-9.19 - 0.00041 * i,
+                               accuracy=None if i == 3 else 4.6 + i, timestamp=timestamp,
+                               last_seen=timestamp + timedelta(seconds=42.5) if i % 2 else None)
+                    if p.user_id:
+                        db.session.add(UserPosition(user_id=p.user_id, **fix))
+                    else:
+                        db.session.add(Location(participant_id=p.id, **fix))
+        db.session.commit()
+        codes = [s.session_code for s in sessions]
+
+    def review():
+        responses = [archiver.get('/api/get_all_sessions_history').get_json()]
+        tracks = []
+        for code in codes:
+            participants = archiver.get(f'/api/get_all_participants_for_review?code={code}').get_json()
+            responses.append(participants)
+            tracks += [archiver.get(f'/api/get_user_positions?participant_id={p["id"]}'
+                                    f'&session_code={code}&review_mode=true').get_json()
+                       for p in participants['participants']]
+        return responses, tracks
+
+    hot, hot_tracks = review()
+    assert run_archive()['sessions'] == len(codes) == 2
+    with app.app_context():
+        assert SessionParticipant.query.filter(SessionParticipant.session_id.in_([s.id for s in sessions])).count() == 0
+
+    history_queries, _ = count_queries(archiver, '/api/get_all_sessions_history')
+    assert history_queries == 1
+    archived, archived_tracks = review()
+    assert archived == hot
+
+    # Tracks come back from the blobs to 1e-6 degrees, whole seconds and whole metres
+    assert len(archived_tracks) == len(hot_tracks) == 6
+    for hot_track, archived_track in zip(hot_tracks, archived_tracks):
+        assert archived_track['participant_name'] == hot_track['participant_name']
+        assert archived_track['total_points'] == hot_track['total_points'] == 8
+        for before, after in zip(hot_track['positions'], archived_track['positions']):
+            assert abs(after['latitude'] - before['latitude']) <= 5e-7
+            assert abs(after['longitude'] - before['longitude']) <= 5e-7
+            assert after['accuracy'] == (None if before['accuracy'] is None else round(before['accuracy']))
+            for key in ('timestamp', 'last_seen'):
+                assert after[key] == (before[key] and before[key].split('.')[0])
+
+
+def test_plan_check_sees_through_table_aliases():
+    statement = """SELECT s.id, (SELECT COUNT(*) FROM session_participants AS sp WHERE sp.session_id = s.id)
+                   FROM sessions s JOIN users ON users.id = s.creator_id WHERE s.is_active = 1"""
+    aliases = table_aliases(statement)
+    assert aliases['sp'] == {'session_participants'}
+    assert aliases['s'] == {'sessions'}
+    assert aliases['users'] == {'users'}
+    assert 'WHERE' not in aliases and 'ON' not in aliases
@@ -0,0 +1,129 @@
+"""
+Tests for the in-process session event broker, the SSE stream and snapshot cache
+built on it, and notification long-polling. Only the long-polling test needs the
+scratch database (conftest.py); no server needed
+
+    python -m pytest -q test_realtime.py
+"""
+
+import threading
+import time
+
+import pytest
+
+from realtime import BROKER_EPOCH, SessionEventBroker, SnapshotCache, Snapshot, sse_stream
+
+
+def test_a_failed_build_fails_its_waiters_too():
+    broker = SessionEventBroker()
+    cache = SnapshotCache(broker)
+    started, proceed = threading.Event(), threading.Event()
+    calls = []
+
+    def failing_build():
+        calls.append('build')
+        started.set()
+        proceed.wait(5)
+        raise RuntimeError('database is locked')
+
+    errors = []
+
+    def request():
+        try:
+            cache.get_or_build('ABC123', failing_build)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=request) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    time.sleep(0.1)  # Let the waiters block on the leader's build
+    proceed.set()
+    for thread in [leader] + waiters:
+        thread.join(5)
+
+    assert calls == ['build']
+    assert errors == ['database is locked'] * 4
+
+    # Nothing was cached; the next caller builds again
+    assert cache.get_or_build('ABC123', lambda: Snapshot(1, broker.version(1), b'{}')).body == b'{}'
+
+
+def frames(stream, count):
+    return [next(stream) for _ in range(count)]
+
+
+def test_stream_resumes_after_last_event_id():
+    broker = SessionEventBroker()
+    first, second, third = [broker.publish(1, 'participant', {'id': i}) for i in range(3)]
+
+    stream = sse_stream(broker, 1, last_event_id=first.event_id, heartbeat=0.01)
+    assert frames(stream, 3) == ['retry: 3000\n\n', second.to_sse(), third.to_sse()]
+    assert next(stream) == ': heartbeat\n\n'
+
+    ended = broker.publish(1, 'ended', {})
+    assert next(stream) == ended.to_sse()
+    with pytest.raises(StopIteration):
+        next(stream)
+
+
+def test_stream_resyncs_when_it_cannot_replay():
+    broker = SessionEventBroker(history_size=2)
+    first = broker.publish(1, 'participant', {'id': 1})
+    for i in range(3):
+        broker.publish(1, 'participant', {'id': i})
+
+    # The events after ``first`` no longer all fit in the buffer
+    retry, resync = frames(sse_stream(broker, 1, last_event_id=first.event_id), 2)
+    assert resync.startswith(f'id: {BROKER_EPOCH}-4\nevent: resync\n')
+    # An id from before a restart is not ours either
+    assert 'event: resync' in frames(sse_stream(broker, 1, last_event_id='1-4'), 2)[1]
+
+
+def test_channels_go_with_their_last_subscriber_and_versions_never_repeat():
+    broker = SessionEventBroker()
+    stream = sse_stream(broker, 1, heartbeat=0.01)
+    assert frames(stream, 2)[1] == ': heartbeat\n\n'
+    seen = broker.publish(1, 'participant', {})
+
+    # Ending the session keeps the channel while the stream is still open
+    broker.close(1)
+    ended = broker.publish(1, 'ended', {})
+    assert frames(stream, 2) == [seen.to_sse(), ended.to_sse()]
+    stream.close()
+    assert 1 not in broker._channels
+
+    # A later channel numbers on, so old versions and ids can't match new events
+    assert broker.version(1) == ended.seq > seen.seq
+    broker.close(1)
+    assert 1 not in broker._channels
+    assert broker.publish(1, 'participant', {}).seq == ended.seq + 1
+
+
+@pytest.mark.usefixtures('scratch_database')
+def test_long_poll_wakes_on_an_alert():
+    from test_locations import join, new_session
+
+    code = new_session('poll_creator')
+    waiter, _ = join(code, 'waiter')
+    caller, _ = join(code, 'caller')
+    replies = []
+
+    def poll():
+        started = time.monotonic()
+        body = waiter.get('/api/get_notifications?wait=10').get_json()
+        replies.append((time.monotonic() - started, body))
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    time.sleep(0.2)
+    assert not replies
+    assert caller.post('/api/send_alert').get_json()['success']
+    thread.join(10)
+
+    elapsed, body = replies[0]
+    assert elapsed < 5
+    assert [n['message'] for n in body['notifications']] == ['Alert! caller is calling you']
@@ -0,0 +1,120 @@
+"""
+Tests for the spatial grid (radius and k-nearest searches against a brute-force
+distance check, including across the antimeridian and around the poles) and the
+proximity hysteresis built on it
+No database or server needed
+
+    python -m pytest -q test_spatial.py
+"""
+
+import math
+import random
+
+import pytest
+
+from spatial import GridIndex, ProximityMonitor, haversine_m
+
+# (latitude, longitude) of each cluster's centre
+CENTRES = {
+    'equator': (0.0, 0.0),
+    'milan': (45.4642, 9.19),
+    'antimeridian east': (0.0, 179.9995),
+    'antimeridian west': (-16.5, -179.9995),
+    'antimeridian far north': (71.0, 180.0),
+    'north pole': (89.995, 0.0),
+    'south pole': (-89.99, 135.0),
+}
+
+
+def scatter(rng, latitude, longitude, count, spread_m):
+    """Points within about ``spread_m`` of a centre, wrapped back into -180..180 and clamped at the poles"""
+    points = []
+    for _ in range(count):
+        lat = latitude + rng.uniform(-spread_m, spread_m) / 111320
+        lat = max(-90.0, min(90.0, lat))
+        lon = longitude + rng.uniform(-spread_m, spread_m) / (111320 * max(0.01, math.cos(math.radians(latitude))))
+        lon = (lon + 180) % 360 - 180
+        points.append((lat, lon))
+    return points
+
+
+def brute_force(points, latitude, longitude):
+    return sorted((haversine_m(latitude, longitude, lat, lon), key) for key, (lat, lon) in enumerate(points))
+
+
+@pytest.mark.parametrize('place', list(CENTRES))
+def test_nearby_matches_brute_force(place):
+    rng = random.Random(place)
+    latitude, longitude = CENTRES[place]
+    points = scatter(rng, latitude, longitude, 400, spread_m=5000)
+    grid = GridIndex(cell_m=250)
+    for key, (lat, lon) in enumerate(points):
+        grid.update(key, lat, lon)
+
+    queries = [(latitude, longitude)] + scatter(rng, latitude, longitude, 20, spread_m=4000)
+    for query_lat, query_lon in queries:
+        expected = brute_force(points, query_lat, query_lon)
+        for radius_m in (100, 600, 2500):
+            found = grid.nearby(query_lat, query_lon, radius_m=radius_m)
+            assert sorted(key for _, key, *_ in found) == sorted(key for d, key in expected if d <= radius_m)
+        for k in (1, 5, 40):
+            found = grid.nearby(query_lat, query_lon, k=k)
+            assert [d for d, *_ in found] == pytest.approx([d for d, _ in expected[:k]])
+        found = grid.nearby(query_lat, query_lon, radius_m=600, k=5)
+        assert [d for d, *_ in found] == pytest.approx([d for d, _ in expected if d <= 600][:5])
+
+
+def test_neighbours_across_the_antimeridian_are_found():
+    grid = GridIndex(cell_m=250)
+    grid.update('east', 10.0, 179.9999)
+    grid.update('west', 10.0, -179.9999)
+    # Enough other points that the search works cell by cell rather than checking everything
+    for key, (lat, lon) in enumerate(scatter(random.Random(1), 10.0, 170.0, 300, spread_m=20000)):
+        grid.update(key, lat, lon)
+
+    found = grid.nearby(10.0, 179.9999, radius_m=100)
+    assert [key for _, key, *_ in found] == ['east', 'west']
+    assert found[1][0] == pytest.approx(haversine_m(10.0, 179.9999, 10.0, -179.9999))
+    assert [key for _, key, *_ in grid.nearby(10.0, -179.9999, k=2)] == ['west', 'east']
+
+
+def test_proximity_alerts_once_and_rearms_only_beyond_the_release_distance():
+    monitor = ProximityMonitor(enter_m=50, exit_m=100, cooldown_s=0)
+
+    def move(distance_m):
+        # Participant 1 moves; participant 2 is the only one within exit_m, if at all
+        return monitor.update('s', 1, [(distance_m, 2)] if distance_m <= 100 else [])
+
+    assert move(80) == []            # Within the release distance but never came near
+    assert move(45) == [(2, 45)]     # Came near: one alert
+    assert move(30) == []            # Staying close
+    assert move(60) == []            # Jitter past enter_m but within exit_m: still near
+    assert move(49) == []
+    assert move(150) == []           # Apart beyond exit_m: re-armed
+    assert move(40) == [(2, 40)]
+
+    # The other side of the pair sees the same state
+    assert monitor.update('s', 2, [(40, 1)]) == []
+
+
+def test_proximity_cooldown_and_forgetting():
+    monitor = ProximityMonitor(enter_m=50, exit_m=100, cooldown_s=600)
+    assert monitor.update('s', 1, [(10, 2)]) == [(2, 10)]
+    monitor.update('s', 1, [])
+    # Apart and near again, but within the cooldown
+    assert monitor.update('s', 1, [(10, 2)]) == []
+
+    # A participant who left counts as apart, but the pair's cooldown still holds
+    monitor.forget('s', 2)
+    assert monitor.update('s', 1, [(10, 2)]) == []
+    # Ending the session clears it all
+    monitor.drop('s')
+    assert monitor.update('s', 1, [(10, 2)]) == [(2, 10)]
+
+
+def test_proximity_scope_leaves_pairs_outside_it_alone():
+    monitor = ProximityMonitor(enter_m=50, exit_m=100, cooldown_s=0)
+    assert monitor.update('s', 1, [(10, 2), (20, 3)]) == [(2, 10), (3, 20)]
+    # Checked against participant 3 only (creator mode): the pair with 2 stays near
+    assert monitor.update('s', 1, [], scope={3}) == []
+    assert monitor.update('s', 1, [(10, 2), (20, 3)]) == [(3, 20)]
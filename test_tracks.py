@@ -0,0 +1,121 @@
+"""
+Tests for track simplification and the compact track encodings (tracks.py)
+
+    python -m pytest -q test_tracks.py
+"""
+
+import math
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from tracks import EPOCH, Track, decode_deltas, decode_polyline, encode_polyline, simplify
+
+
+def walk(size, seed=7):
+    """A jittery walk with a fix every 5 s, as (latitude, longitude, accuracy, timestamp) rows"""
+    rng = random.Random(seed)
+    lat, lon, heading = 45.4642, 9.19, 0.0
+    start = datetime(2024, 5, 1, 8, 0)
+    rows = []
+    for i in range(size):
+        heading += rng.gauss(0, 0.5)
+        lat += 7 * math.cos(heading) / 111320
+        lon += 7 * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+        rows.append((lat, lon, 8.0, start + timedelta(seconds=5 * i)))
+    return rows
+
+
+def segment_distance(track, i, a, b):
+    """Distance in metres from point i to the segment between points a and b"""
+    px, py = track.xs[i] - track.xs[a], track.ys[i] - track.ys[a]
+    dx, dy = track.xs[b] - track.xs[a], track.ys[b] - track.ys[a]
+    length_squared = dx * dx + dy * dy
+    t = 0.0 if not length_squared else max(0.0, min(1.0, (px * dx + py * dy) / length_squared))
+    return math.hypot(px - t * dx, py - t * dy)
+
+
+def test_dropped_points_stay_within_tolerance():
+    track = Track.from_rows(walk(2000))
+    for tolerance_m in (1, 5, 25):
+        kept = simplify(track, tolerance_m)
+        assert kept[0] == 0 and kept[-1] == len(track) - 1
+        assert len(kept) < len(track)
+        for a, b in zip(kept, kept[1:]):
+            for i in range(a + 1, b):
+                assert segment_distance(track, i, a, b) <= tolerance_m + 1e-9
+
+
+def test_max_points_keeps_the_endpoints():
+    track = Track.from_rows(walk(2000))
+    for max_points in (2, 3, 50, 500):
+        kept = simplify(track, max_points=max_points, keep=[10, 700, 1500])
+        assert len(kept) <= max_points
+        assert kept[0] == 0 and kept[-1] == len(track) - 1
+        assert kept == sorted(set(kept))
+
+
+def test_polyline_round_trip():
+    # Google's reference example, then both hemispheres and large jumps
+    assert encode_polyline([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    latitudes = [38.5, 40.7, 43.252, -33.8688, -0.00001, 0.0, 89.99999, -89.99999]
+    longitudes = [-120.2, -120.95, -126.453, 151.2093, -0.00001, 0.0, 179.99999, -179.99999]
+    for precision in (5, 6):
+        decoded = decode_polyline(encode_polyline(latitudes, longitudes, precision), precision)
+        for original, values in zip((latitudes, longitudes), decoded):
+            assert len(values) == len(original)
+            for a, b in zip(original, values):
+                assert abs(a - b) <= 0.5 / 10 ** precision + 1e-12
+    assert decode_polyline('') == ([], [])
+
+
+@pytest.mark.usefixtures('scratch_database')
+def test_get_user_positions_formats_decode_to_the_same_points():
+    from app import app, db, User, UserPosition
+
+    client = app.test_client()
+    client.post('/api/register', json={'username': 'formats_user', 'email': 'formats_user@example.com',
+                                       'password': 'password123'})
+    client.post('/api/login', json={'username': 'formats_user', 'password': 'password123'})
+    code = client.post('/api/create_session', json={'session_name': 'Formats'}).get_json()['session']['session_code']
+    info = client.get('/api/get_participant_info').get_json()
+    with app.app_context():
+        user_id = User.query.filter_by(username='formats_user').first().id
+        start = datetime.utcnow().replace(microsecond=0) - timedelta(hours=1)
+        for i, (latitude, longitude, accuracy, timestamp) in enumerate(walk(50)):
+            db.session.add(UserPosition(
+                user_id=user_id, latitude=latitude - 50, longitude=-longitude, accuracy=None if i == 7 else accuracy,
+                timestamp=start + (timestamp - datetime(2024, 5, 1, 8, 0)),
+                last_seen=start + timedelta(seconds=5 * i + 3) if i % 4 == 0 else None
+            ))
+        db.session.commit()
+
+    def positions(fmt):
+        response = client.get(f'/api/get_user_positions?participant_id={info["participant_id"]}'
+                              f'&session_code={code}&format={fmt}')
+        assert response.status_code == 200
+        return response.get_json()
+
+    expected = positions('json')['positions']
+    assert len(expected) == 50
+
+    def as_seconds(iso):
+        return None if iso is None else int((datetime.fromisoformat(iso) - EPOCH).total_seconds())
+
+    columnar = positions('columnar')['track']
+    assert columnar['latitude'] == [p['latitude'] for p in expected]
+    assert columnar['longitude'] == [p['longitude'] for p in expected]
+    assert columnar['accuracy'] == [None if p['accuracy'] is None else round(p['accuracy']) for p in expected]
+    assert columnar['time'] == [as_seconds(p['timestamp']) for p in expected]
+    assert columnar['last_seen'] == [as_seconds(p['last_seen']) for p in expected]
+
+    polyline = positions('polyline')['track']
+    latitudes, longitudes = decode_polyline(polyline['points'], polyline['precision'])
+    for p, latitude, longitude in zip(expected, latitudes, longitudes):
+        assert abs(latitude - p['latitude']) <= 0.5 / 10 ** polyline['precision'] + 1e-12
+        assert abs(longitude - p['longitude']) <= 0.5 / 10 ** polyline['precision'] + 1e-12
+    times = decode_deltas(polyline['time'])
+    assert times == columnar['time']
+    assert decode_deltas(polyline['accuracy']) == [-1 if a is None else a for a in columnar['accuracy']]
+    assert [t + d if d else None for t, d in zip(times, decode_deltas(polyline['dwell']))] == columnar['last_seen']
@@ -0,0 +1,267 @@
+"""
+Hunt-Hunt-Planur - Track simplification
+Ramer-Douglas-Peucker over flat coordinate arrays, so long position histories
+can be drawn on a phone without a marker per fix
+"""
+
+import heapq
+import json
+import math
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+EARTH_RADIUS_M = 6371000.0
+EPOCH = datetime(1970, 1, 1)
+
+
+class Track:
+    """
+    A position history as parallel arrays: metres on a local plane, plus epoch
+    seconds of each fix and of the last fix merged into it (see ingest.py)
+    """
+
+    __slots__ = ('xs', 'ys', 'times', 'until')
+
+    def __init__(self, xs, ys, times, until=None):
+        self.xs = xs
+        self.ys = ys
+        self.times = times
+        self.until = until if until is not None else times
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        ``rows``: (latitude, longitude, accuracy, timestamp[, last_seen]) tuples in time order.
+        Coordinates are projected equirectangularly around the first fix, which
+        is accurate to well under a metre over the few kilometres of a session.
+        """
+        xs, ys, times, until = array('d'), array('d'), array('d'), array('d')
+        if rows:
+            origin_lat = math.radians(rows[0][0])
+            origin_lon = math.radians(rows[0][1])
+            x_scale = EARTH_RADIUS_M * math.cos(origin_lat)
+            for row in rows:
+                xs.append((math.radians(row[1]) - origin_lon) * x_scale)
+                ys.append((math.radians(row[0]) - origin_lat) * EARTH_RADIUS_M)
+                times.append((row[3] - EPOCH).total_seconds())
+                last_seen = row[4] if len(row) > 4 and row[4] else row[3]
+                until.append((last_seen - EPOCH).total_seconds())
+        return cls(xs, ys, times, until)
+
+    def __len__(self):
+        return len(self.xs)
+
+
+def stop_points(track, radius_m=25, min_duration_s=120):
+    """
+    Indices where the track dwells: for every run of fixes staying within
+    ``radius_m`` of its first fix for at least ``min_duration_s`` (counting merged
+    stationary fixes), the arrival and departure fixes.
+    """
+    xs, ys, times, until = track.xs, track.ys, track.times, track.until
+    radius_squared = radius_m * radius_m
+    stops = []
+    n = len(xs)
+    i = 0
+    while i < n:
+        j = i + 1
+        while j < n and (xs[j] - xs[i]) ** 2 + (ys[j] - ys[i]) ** 2 <= radius_squared:
+            j += 1
+        if until[j - 1] - times[i] >= min_duration_s:
+            stops.append(i)
+            if j - 1 != i:
+                stops.append(j - 1)
+        i = j
+    return stops
+
+
+def _farthest(xs, ys, first, last):
+    """(distance, index) of the point between first and last farthest from the chord joining them"""
+    ax, ay = xs[first], ys[first]
+    dx, dy = xs[last] - ax, ys[last] - ay
+    length = math.hypot(dx, dy)
+    best, best_index = -1.0, -1
+    for i in range(first + 1, last):
+        px, py = xs[i] - ax, ys[i] - ay
+        if length:
+            # Distance to the segment, not the infinite line, so back-tracks are kept
+            t = (px * dx + py * dy) / (length * length)
+            if t <= 0:
+                distance = math.hypot(px, py)
+            elif t >= 1:
+                distance = math.hypot(px - dx, py - dy)
+            else:
+                distance = abs(px * dy - py * dx) / length
+        else:
+            distance = math.hypot(px, py)
+        if distance > best:
+            best, best_index = distance, i
+    return best, best_index
+
+
+def simplify(track, tolerance_m=None, max_points=None, keep=()):
+    """
+    Sorted indices of the fixes to keep. The first and last fix and every index
+    in ``keep`` are always kept. Beyond those, points are added most-significant
+    first (Ramer-Douglas-Peucker, driven by a priority queue) until every dropped
+    point is within ``tolerance_m`` of the simplified line, or ``max_points`` is
+    reached, whichever comes first.
+    """
+    n = len(track)
+    if n <= 2 or (tolerance_m is None and max_points is None):
+        return list(range(n))
+
+    anchors = sorted({0, n - 1, *keep})
+    if max_points is not None and len(anchors) > max_points:
+        # More forced points than the budget: keep the ends and an even sample of the rest
+        inner = anchors[1:-1]
+        step = len(inner) / max(max_points - 2, 1)
+        anchors = [0] + [inner[int(k * step)] for k in range(max(max_points - 2, 0))] + [n - 1]
+
+    xs, ys = track.xs, track.ys
+    kept = set(anchors)
+    queue = []
+    for first, last in zip(anchors, anchors[1:]):
+        if last - first > 1:
+            distance, index = _farthest(xs, ys, first, last)
+            heapq.heappush(queue, (-distance, index, first, last))
+
+    threshold = tolerance_m if tolerance_m is not None else 0.0
+    while queue and (max_points is None or len(kept) < max_points):
+        distance, index, first, last = heapq.heappop(queue)
+        if -distance <= threshold:
+            break
+        kept.add(index)
+        for a, b in ((first, index), (index, last)):
+            if b - a > 1:
+                d, i = _farthest(xs, ys, a, b)
+                heapq.heappush(queue, (-d, i, a, b))
+
+    return sorted(kept)
+
+
+# Compact encodings for get_user_positions?format=polyline|columnar and the session archive
+
+def _encode_signed(value, out):
+    """Append one integer in Google's encoded polyline form (zigzag, 5-bit chunks + 63)"""
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    out.append(chr(value + 63))
+
+def encode_deltas(values):
+    """Integers as polyline-encoded differences from the previous value"""
+    out = []
+    previous = 0
+    for value in values:
+        _encode_signed(value - previous, out)
+        previous = value
+    return ''.join(out)
+
+def _decode_signed(text):
+    """The integers of a polyline-encoded string, as written by _encode_signed"""
+    index = 0
+    while index < len(text):
+        shift = result = 0
+        while True:
+            chunk = ord(text[index]) - 63
+            index += 1
+            result |= (chunk & 0x1f) << shift
+            shift += 5
+            if chunk < 0x20:
+                break
+        yield ~(result >> 1) if result & 1 else result >> 1
+
+def decode_deltas(text):
+    """Inverse of encode_deltas"""
+    values = []
+    value = 0
+    for delta in _decode_signed(text):
+        value += delta
+        values.append(value)
+    return values
+
+def decode_polyline(text, precision=5):
+    """Inverse of encode_polyline: (latitudes, longitudes)"""
+    deltas = list(_decode_signed(text))
+    factor = 10 ** precision
+    latitudes, longitudes = [], []
+    lat = lon = 0
+    for i in range(0, len(deltas) - 1, 2):
+        lat += deltas[i]
+        lon += deltas[i + 1]
+        latitudes.append(lat / factor)
+        longitudes.append(lon / factor)
+    return latitudes, longitudes
+
+def encode_polyline(latitudes, longitudes, precision=5):
+    """Standard Google encoded polyline (interleaved lat/lon deltas)"""
+    factor = 10 ** precision
+    out = []
+    previous_lat = previous_lon = 0
+    for latitude, longitude in zip(latitudes, longitudes):
+        lat = round(latitude * factor)
+        lon = round(longitude * factor)
+        _encode_signed(lat - previous_lat, out)
+        _encode_signed(lon - previous_lon, out)
+        previous_lat, previous_lon = lat, lon
+    return ''.join(out)
+
+
+TRACK_FORMATS = ('json', 'polyline', 'columnar')
+
+def encode_track(rows, fmt, precision=5):
+    """
+    ``rows``: (latitude, longitude, accuracy, timestamp, last_seen) tuples.
+    ``polyline``: coordinates as an encoded polyline, epoch seconds and whole-metre
+    accuracy (-1 = unknown) as delta strings, and the seconds each point lasted
+    (last_seen - timestamp) as a delta string.
+    ``columnar``: parallel arrays with epoch-second times.
+    """
+    latitudes = [row[0] for row in rows]
+    longitudes = [row[1] for row in rows]
+    times = [int((row[3] - EPOCH).total_seconds()) for row in rows]
+    accuracies = [round(row[2]) if isinstance(row[2], (int, float)) else None for row in rows]
+    last_seen = [int((row[4] - EPOCH).total_seconds()) if row[4] else None for row in rows]
+
+    if fmt == 'columnar':
+        return {
+            'latitude': latitudes,
+            'longitude': longitudes,
+            'accuracy': accuracies,
+            'time': times,
+            'last_seen': last_seen
+        }
+
+    return {
+        'precision': precision,
+        'points': encode_polyline(latitudes, longitudes, precision),
+        'time': encode_deltas(times),
+        'accuracy': encode_deltas(-1 if a is None else a for a in accuracies),
+        'dwell': encode_deltas(0 if seen is None else seen - t for seen, t in zip(last_seen, times))
+    }
+
+
+# Archived tracks (session_archives.track): the polyline form, zlib-compressed
+
+ARCHIVE_PRECISION = 6  # ~0.1 m
+
+def pack_track(rows):
+    """``rows`` as for encode_track -> compressed blob. Times keep whole seconds, accuracy whole metres"""
+    return zlib.compress(json.dumps(encode_track(rows, 'polyline', ARCHIVE_PRECISION)).encode(), 9)
+
+def unpack_track(blob):
+    """Inverse of pack_track: (latitude, longitude, accuracy, timestamp, last_seen) tuples"""
+    track = json.loads(zlib.decompress(blob))
+    latitudes, longitudes = decode_polyline(track['points'], track['precision'])
+    times = decode_deltas(track['time'])
+    accuracies = decode_deltas(track['accuracy'])
+    dwells = decode_deltas(track['dwell'])
+    rows = []
+    for latitude, longitude, accuracy, t, dwell in zip(latitudes, longitudes, accuracies, times, dwells):
+        timestamp = EPOCH + timedelta(seconds=t)
+        rows.append((latitude, longitude, None if accuracy < 0 else accuracy, timestamp,
+                     timestamp + timedelta(seconds=dwell) if dwell else None))
+    return rows
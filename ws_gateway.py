@@ -0,0 +1,162 @@
+"""
+Hunt-Hunt-Planur - WebSocket gateway
+One connection per participant at /ws/sessions/<code> carries fixes up and
+participant changes and alerts down, instead of the upload, participant-stream
+and notification long-poll HTTP loops. Runs an asyncio server on its own thread
+next to the Flask app; database work is handed to a small thread pool.
+
+Client -> server messages (JSON):
+    {"type": "location", "latitude": 45.46, "longitude": 9.19, "accuracy": 8}
+Server -> client messages:
+    {"type": "snapshot", "data": {...get_participants response...}}  once, on connect
+    {"type": "participant" | "participant_left" | "ended", "data": {...}}  as on the SSE stream
+    {"type": "alert", "data": {...}}  fetch /api/get_notifications for the details
+    {"type": "error", "message": "..."}
+"""
+
+import asyncio
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from websockets.asyncio.server import broadcast, serve
+
+PATH = re.compile(r'^/ws/sessions/([A-Za-z0-9]+)/?$')
+
+
+class SessionGateway:
+    """
+    WebSocket server with one room per session. The app supplies three callables,
+    all run on the worker pool (so they may block on the database):
+
+    ``authenticate(code, cookie_header)`` -> (session_id, participant_id) or None
+    ``snapshot(code)`` -> JSON text of the current participant list
+    ``receive(participant_id, message)`` -> reply dict or None
+
+    ``publish`` may be called from any thread and fans a message out to a room.
+    ``reuse_port`` lets a replacement process bind the port while the old one drains.
+    """
+
+    def __init__(self, authenticate, snapshot, receive, host='0.0.0.0', port=5001,
+                 ssl_context=None, workers=4, reuse_port=False):
+        self.authenticate = authenticate
+        self.snapshot = snapshot
+        self.receive = receive
+        self.host = host
+        self.port = port
+        self.ssl_context = ssl_context
+        self.reuse_port = reuse_port
+        self.rooms = {}  # session_id -> set of connections, only touched on the event loop
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='websocket-worker')
+        self._loop = None
+        self._server = None
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = None
+
+    # Lifecycle
+
+    def start(self):
+        """Serve on a daemon thread; returns once the socket is listening (or raises why it is not)"""
+        self._thread = threading.Thread(target=self._main, daemon=True, name='websocket-gateway')
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+        return self
+
+    def stop(self):
+        if self._loop and self._server:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._thread.join(timeout=5)
+        self._loop = None  # publish() becomes a no-op
+        self._executor.shutdown(wait=False)
+
+    def _main(self):
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        # Messages are small and fanned out to many sockets: skip per-connection compression
+        async with serve(self._handle, self.host, self.port, ssl=self.ssl_context,
+                         process_request=self._process_request, compression=None,
+                         reuse_port=self.reuse_port or None) as server:
+            self._server = server
+            if not self.port:
+                self.port = server.sockets[0].getsockname()[1]
+            self._ready.set()
+            await server.wait_closed()
+
+    def _run(self, fn, *args):
+        return self._loop.run_in_executor(self._executor, fn, *args)
+
+    # Connections
+
+    async def _process_request(self, connection, request):
+        """Reject bad paths and non-participants before the upgrade"""
+        match = PATH.match(request.path.split('?', 1)[0])
+        if not match:
+            return connection.respond(HTTPStatus.NOT_FOUND, 'Not found\n')
+        identity = await self._run(self.authenticate, match.group(1).upper(), request.headers.get('Cookie', ''))
+        if identity is None:
+            return connection.respond(HTTPStatus.FORBIDDEN, 'Not a participant of this session\n')
+        connection.session_code = match.group(1).upper()
+        connection.session_id, connection.participant_id = identity
+        return None
+
+    async def _handle(self, connection):
+        room = self.rooms.setdefault(connection.session_id, set())
+        # Join before taking the snapshot so no change falls between the two
+        room.add(connection)
+        try:
+            snapshot = await self._run(self.snapshot, connection.session_code)
+            await connection.send(f'{{"type": "snapshot", "data": {snapshot}}}')
+
+            async for raw in connection:
+                try:
+                    message = json.loads(raw)
+                    if not isinstance(message, dict):
+                        raise ValueError
+                except ValueError:
+                    await connection.send(json.dumps({'type': 'error', 'message': 'Invalid JSON'}))
+                    continue
+                reply = await self._run(self.receive, connection.participant_id, message)
+                if reply is not None:
+                    await connection.send(json.dumps(reply))
+        finally:
+            room.discard(connection)
+            if not room:
+                self.rooms.pop(connection.session_id, None)
+
+    # Fan-out
+
+    def publish(self, session_id, event_type, data):
+        """Send an event to everyone connected to a session (thread-safe)"""
+        if self._loop is None:
+            return
+        message = json.dumps({'type': event_type, 'data': data})
+        self._loop.call_soon_threadsafe(self._fan_out, session_id, event_type, data, message)
+
+    def _fan_out(self, session_id, event_type, data, message):
+        room = self.rooms.get(session_id)
+        if not room:
+            return
+        broadcast(room, message)
+        # Whoever is no longer part of the session loses the connection too
+        if event_type == 'ended':
+            closing = list(room)
+        elif event_type == 'participant_left':
+            closing = [c for c in room if c.participant_id == data.get('id')]
+        else:
+            return
+        for connection in closing:
+            self._loop.create_task(connection.close(1000, 'No longer in this session'))
+
+    def connection_count(self):
+        return sum(len(room) for room in list(self.rooms.values()))